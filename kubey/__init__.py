@@ -1,4 +1,14 @@
-from .kubey import Kubey  # noqa: F401
+import sys
+
+# importing the package (e.g. for `kubey.cli`) does not load the API until it is used
+if sys.version_info < (3, 7):
+    from .kubey import Kubey  # noqa: F401
+else:
+    def __getattr__(name):
+        if name == 'Kubey':
+            from .kubey import Kubey  # noqa: F811
+            return Kubey
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
 
 __author__ = '''Brad Robel-Forrest'''
 __email__ = 'brad@bitpony.com'
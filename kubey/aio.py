@@ -0,0 +1,307 @@
+'''Asynchronous API (Python 3.6+) to select pods and run kubectl for them on an asyncio event
+loop, without a thread per child process, for embedding in other tools::
+
+    kubey = AsyncKubey(namespace='production')
+    for pod in await kubey.pods('web/app'):
+        print(pod.name)
+    async for result in kubey.exec('web/app', 'uptime', concurrency=50):
+        print(result.target, result.exit_code, result.stdout)
+
+Before Python 3.12, asyncio waits on each child process with a thread unless another child
+watcher is chosen, e.g. `asyncio.set_child_watcher(asyncio.PidfdChildWatcher())` on Linux.
+'''
+
+import asyncio
+import collections
+import json
+import logging
+import subprocess
+
+from configstruct import OpenStruct
+
+from . import kubeconfig
+from .cli import _target
+from .event import Event
+from .execution import Execution
+from .kubectl import KubeCtl, JsonLineDecoder, which
+from .pod import Pod
+from .selector import Alternative, Selector, exact_literal
+
+
+_logger = logging.getLogger(__name__)
+
+
+ExecResult = collections.namedtuple('ExecResult', 'target pod container exit_code stdout stderr')
+
+
+class AsyncKubeCtl(object):
+    '''Runs kubectl as asyncio subprocesses, with the same timeout and retry behavior as
+    `KubeCtl` for queries. Every child run is recorded in `executions` when that is a list.
+    '''
+
+    def __init__(self, context=None, timeout=None, retries=0):
+        self._kubectl = None
+        self._context = context
+        self.timeout = timeout
+        self.retries = retries
+        self.executions = None
+
+    @property
+    def executable(self):
+        if self._kubectl is None:
+            self._kubectl = which('kubectl')
+            if not self._kubectl:
+                raise KubeCtl.NotFoundError()
+        return self._kubectl
+
+    @property
+    def context(self):
+        if self._context is None:
+            self._context = kubeconfig.current_context()
+        return self._context
+
+    async def call_json(self, cmd, *args):
+        '''Output of a query as JSON, retried when idempotent.'''
+        attempts = 1 + (self.retries if cmd in KubeCtl.IDEMPOTENT_COMMANDS else 0)
+        for attempt in range(attempts):
+            try:
+                rc, stdout, stderr = await self.run(cmd, '--output=json', *args,
+                                                    timeout=self.timeout)
+                if rc != 0:
+                    raise subprocess.CalledProcessError(rc, cmd, stderr)
+                return json.loads(stdout.decode('utf-8'))
+            except KubeCtl.RETRYABLE_ERRORS + (asyncio.TimeoutError,) as ex:
+                if attempt + 1 >= attempts:
+                    raise
+                delay = KubeCtl._backoff(attempt)
+                _logger.warning('%s => %r (retrying in %.1fs)' % (cmd, ex, delay))
+                await asyncio.sleep(delay)
+
+    async def run(self, cmd, *args, stdin=None, timeout=None, target=None):
+        '''Returns (exit code, stdout, stderr) of a command. Raises asyncio.TimeoutError (after
+        killing it) if it does not finish in `timeout` seconds.
+        '''
+        proc, execution = await self._spawn(cmd, args, target, stdin=asyncio.subprocess.PIPE,
+                                            stdout=asyncio.subprocess.PIPE,
+                                            stderr=asyncio.subprocess.PIPE)
+        stdout = stderr = b''
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(stdin), timeout or None)
+        finally:
+            killed = await self._reap(proc)
+            if execution:  # like `KubeCtl`, a killed child has no exit code
+                execution.finish(None if killed else proc.returncode, len(stdout), len(stderr))
+        return proc.returncode, stdout, stderr
+
+    async def lines(self, cmd, *args, target=None, check=False):
+        '''Generate each line of output (bytes, with stderr discarded) until a command exits.
+        Raises CalledProcessError if it fails when `check` is set.
+        '''
+        proc, execution = await self._spawn(cmd, args, target, stdin=asyncio.subprocess.DEVNULL,
+                                            stdout=asyncio.subprocess.PIPE,
+                                            stderr=asyncio.subprocess.DEVNULL)
+        size = 0
+        try:
+            async for line in proc.stdout:
+                size += len(line)
+                yield line
+            await proc.wait()
+        finally:
+            killed = await self._reap(proc)
+            if execution:
+                execution.finish(None if killed else proc.returncode, size)
+        if check and proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    async def watch(self, cmd, *args):
+        '''Generate (type, object) for each change streamed by `cmd --watch` until it exits (see
+        `KubeCtl.call_watch`). Raises CalledProcessError if it fails.
+        '''
+        decoder = JsonLineDecoder()
+        async for line in self.lines(cmd, '--watch', '--output-watch-events', '--output=json',
+                                     *args, check=True):
+            event = decoder.feed(line)
+            if event is None:
+                continue
+            if event.get('type') == 'ERROR':
+                _logger.warning('%s => %s' % (cmd, event['object'].get('message')))
+                continue
+            yield event['type'], event['object']
+
+    async def _spawn(self, cmd, args, target, **kwargs):
+        cl = [self.executable]
+        if self.context:
+            cl.extend(['--context', self.context])
+        cl.append(cmd)
+        cl.extend(args)
+        _logger.debug(' '.join(cl))
+        execution = None
+        if self.executions is not None:
+            execution = Execution(None, target or cmd, cl)
+            self.executions.append(execution)
+        return await asyncio.create_subprocess_exec(*cl, **kwargs), execution
+
+    @staticmethod
+    async def _reap(proc):
+        '''Kill a child still running (returning True) and wait for it.'''
+        if proc.returncode is not None:
+            return False
+        try:
+            proc.kill()  # cancelled, timed out or the consumer stopped early
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+        return True
+
+
+class AsyncKubey(object):
+    '''Selects pods, events and log lines with the same MATCH (and predicates) as the `kubey`
+    command, and runs commands in selected containers, all as coroutines.
+
+    Pods are queried once for any number of concurrent selections (and reused for
+    `cache_seconds`). Every query and command is a child process driven by the event loop.
+    '''
+
+    MAX_QUEUED_LINES = 10000
+
+    def __init__(self, context=None, namespace='', timeout=60, retries=2, cache_seconds=0):
+        self.kubectl = AsyncKubeCtl(context, timeout=timeout, retries=retries)
+        self.namespace = '' if namespace == Alternative.ANY else namespace
+        self.cache_seconds = cache_seconds
+        self._config = OpenStruct(highlight_ok=str, highlight_warn=str, highlight_error=str,
+                                  namespace=namespace or Alternative.ANY, wide=False)
+        self._pods_info = None
+        self._pods_expiry = 0
+
+    def selector(self, match, **predicates):
+        '''Selector for MATCH with the predicates of `Selector` (phases, ready, min_restarts,
+        labels).
+        '''
+        return Selector(match, self.namespace, **predicates)
+
+    async def pods(self, match, limit=None, **predicates):
+        '''List the pods selected by MATCH (each only including the selected containers).'''
+        selector = self.selector(match, **predicates)
+        pods = []
+        for info in (await self._get_pods_info())['items']:
+            container_selector = selector.match_pod(info)
+            if not container_selector:
+                continue
+            pods.append(Pod(self._config, info, container_selector))
+            if limit and len(pods) >= limit:
+                break
+        return pods
+
+    async def events(self, match, **predicates):
+        '''Generate each event about pods or nodes selected by MATCH as it happens (the current
+        ones first). Raises CalledProcessError if the watch fails.
+        '''
+        selector = self.selector(match, **predicates)
+        seen = {}  # uid => resource version of each current event, to skip them when rewatching
+        while True:
+            async for change, info in self.kubectl.watch('get', 'events',
+                                                         *self._namespace_args()):
+                uid = info['metadata'].get('uid')
+                version = info['metadata'].get('resourceVersion')
+                if change == 'DELETED':
+                    seen.pop(uid, None)
+                    continue
+                if uid in seen and seen[uid] == version:
+                    continue  # reported again by a new watch
+                seen[uid] = version
+                if selector.match_event(info):
+                    yield Event(self._config, info)
+            # the server ends watches periodically: the new one reports everything as ADDED again
+            _logger.debug('restarting watch of events')
+
+    async def logs(self, match, follow=False, tail=None, **predicates):
+        '''Generate (pod, container, line) for the logs of every container selected by MATCH, as
+        lines arrive from any of them.
+        '''
+        args = (['--follow'] if follow else []) + \
+            (['--tail={0}'.format(tail)] if tail is not None else [])
+        queue = asyncio.Queue(self.MAX_QUEUED_LINES)  # slow consumers hold back the readers
+        done = object()
+
+        async def read(pod, container):
+            async for line in self.kubectl.lines(
+                    'logs', '-n', pod.namespace, '-c', container.name, pod.name, *args,
+                    target=_target(pod, container)):
+                await queue.put((pod, container, line.decode('utf-8', 'replace')))
+
+        async def read_all(readers):
+            await asyncio.gather(*readers, return_exceptions=True)
+            await queue.put(done)
+
+        readers = [asyncio.ensure_future(read(pod, container))
+                   for pod in await self.pods(match, **predicates)
+                   for container in pod.containers]
+        tasks = readers + [asyncio.ensure_future(read_all(readers))]
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def exec(self, match, command, *arguments, concurrency=10, stdin=None, timeout=None,
+                   **predicates):
+        '''Run a command in every ready container selected by MATCH, at most `concurrency` at
+        once, generating an ExecResult as each one finishes (with an exit code of None when it was
+        killed after `timeout` seconds). The same `stdin` (bytes) is given to every command.
+        '''
+        semaphore = asyncio.Semaphore(concurrency)
+        exec_args = ['-i'] if stdin is not None else []
+
+        async def run(pod, container):
+            async with semaphore:
+                target = _target(pod, container)
+                try:
+                    rc, stdout, stderr = await self.kubectl.run(
+                        'exec', *(exec_args + ['-n', pod.namespace, '-c', container.name,
+                                               pod.name, '--', command] + list(arguments)),
+                        stdin=stdin, timeout=timeout, target=target)
+                except asyncio.TimeoutError:
+                    _logger.warning('%s => timed out after %ss' % (target, timeout))
+                    rc, stdout, stderr = None, b'', b''
+                return ExecResult(target, pod, container, rc, stdout, stderr)
+
+        runs = []
+        for pod in await self.pods(match, **predicates):
+            for container in pod.containers:
+                if not container.ready:
+                    _logger.warning('skipping ' + str(container))
+                    continue
+                runs.append(asyncio.ensure_future(run(pod, container)))
+        try:
+            for finished in asyncio.as_completed(runs):
+                yield await finished
+        finally:
+            for pending in runs:
+                pending.cancel()
+            await asyncio.gather(*runs, return_exceptions=True)
+
+    async def _get_pods_info(self):
+        loop = asyncio.get_event_loop()
+        if self._pods_info is None or (self._pods_info.done() and
+                                       self._pods_expiry < loop.time()):
+            # concurrent callers all await this one query
+            self._pods_info = asyncio.ensure_future(
+                self.kubectl.call_json('get', 'pods', *self._namespace_args()))
+            self._pods_info.add_done_callback(self._pods_retrieved)
+        return await asyncio.shield(self._pods_info)
+
+    def _pods_retrieved(self, future):
+        if future.cancelled() or future.exception():
+            self._pods_info = None  # not kept, so the next caller tries again
+        else:
+            self._pods_expiry = asyncio.get_event_loop().time() + self.cache_seconds
+
+    def _namespace_args(self):
+        # only a namespace matched exactly (e.g. "^production$") can be queried alone
+        namespace = exact_literal(self.namespace)
+        return ['--namespace', namespace] if namespace else ['--all-namespaces']
@@ -8,12 +8,36 @@ class BackgroundPopen(subprocess.Popen):
     def prefix_handler(prefix, io):
         return lambda line: io.write(prefix + line)
 
+    @staticmethod
+    def decoding_handler(handler):
+        '''Handler of raw lines giving them to a handler of text lines.'''
+        return lambda line: handler(line.decode('utf-8', 'replace'))
+
+    @staticmethod
+    def raw_handler(io):
+        '''Handler writing raw lines (bytes) to a text stream's underlying binary stream.'''
+        io.flush()  # anything already written as text comes first
+        io = getattr(io, 'buffer', io)  # Python 2 streams take bytes themselves
+
+        def write(line):
+            io.write(line)
+            io.flush()
+        return write
+
     def __init__(self, out_handler, err_handler, *args, **kwargs):
+        '''Handlers are given each line of output from other threads: as text or, when `raw`, as
+        the bytes read (e.g. to proxy output that may not be UTF-8 unmodified).
+        '''
+        raw = kwargs.pop('raw', False)
         kwargs['stdout'] = subprocess.PIPE
         kwargs['stderr'] = subprocess.PIPE
         super(BackgroundPopen, self).__init__(*args, **kwargs)
-        self._stdout_thread = Thread(target=self._proxy_lines, args=[self.stdout, out_handler])
-        self._stderr_thread = Thread(target=self._proxy_lines, args=[self.stderr, err_handler])
+        self.stdout_bytes = 0
+        self.stderr_bytes = 0
+        self._stdout_thread = Thread(target=self._proxy_lines,
+                                     args=[self.stdout, out_handler, 'stdout_bytes', raw])
+        self._stderr_thread = Thread(target=self._proxy_lines,
+                                     args=[self.stderr, err_handler, 'stderr_bytes', raw])
         self._stdout_thread.start()
         self._stderr_thread.start()
 
@@ -23,10 +47,12 @@ class BackgroundPopen(subprocess.Popen):
         self._stderr_thread.join()
         return result
 
-    def _proxy_lines(self, io, handler):
+    def _proxy_lines(self, io, handler, counter, raw):
         with io:
             while True:
                 line = io.readline()
                 if not line:
                     break
-                handler(line.decode('utf-8'))
+                setattr(self, counter, getattr(self, counter) + len(line))
+                # an invalid byte must not stop the thread (leaving the child blocked writing)
+                handler(line if raw else line.decode('utf-8', 'replace'))
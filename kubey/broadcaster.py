@@ -0,0 +1,93 @@
+import logging
+
+from threading import Condition, Thread
+
+
+_logger = logging.getLogger(__name__)
+
+
+class Broadcaster(object):
+    '''Reads a source stream once and replays it into any number of writable streams.
+
+    Each attached stream is fed by its own thread, so a slow consumer only blocks itself while the
+    others keep draining. Streams may be attached at any time (e.g. one after another) and still
+    receive the whole input, so it is all kept: in memory up to `memory_bytes` and in a temporary
+    file beyond that, so memory stays bounded however large the input is.
+    '''
+
+    CHUNK_SIZE = 64 * 1024
+    MEMORY_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, source, chunk_size=CHUNK_SIZE, memory_bytes=MEMORY_BYTES):
+        import tempfile
+        self._source = source
+        self._read = getattr(source, 'read1', source.read)
+        self._chunk_size = chunk_size
+        self._buffer = tempfile.SpooledTemporaryFile(max_size=memory_bytes)
+        self._chunks = []  # (offset, length) of each chunk in the buffer
+        self._size = 0
+        self._eof = False
+        self._cond = Condition()
+        self._threads = []
+        self._reader = Thread(target=self._read_source)
+        self._reader.daemon = True
+        self._reader.start()
+
+    @property
+    def size(self):
+        with self._cond:
+            return self._size
+
+    def attach(self, io):
+        thread = Thread(target=self._feed, args=[io])
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _read_source(self):
+        while True:
+            chunk = self._read(self._chunk_size)
+            with self._cond:
+                if not chunk:
+                    self._eof = True
+                    self._cond.notify_all()
+                    break
+                self._buffer.seek(self._size)
+                self._buffer.write(chunk)
+                self._chunks.append((self._size, len(chunk)))
+                self._size += len(chunk)
+                self._cond.notify_all()
+
+    def _next_chunk(self, index):
+        with self._cond:
+            while index >= len(self._chunks) and not self._eof:
+                self._cond.wait()
+            if index < len(self._chunks):
+                offset, length = self._chunks[index]
+                self._buffer.seek(offset)
+                return self._buffer.read(length)
+            return None
+
+    def _feed(self, io):
+        index = 0
+        try:
+            while True:
+                chunk = self._next_chunk(index)
+                if chunk is None:
+                    break
+                io.write(chunk)
+                io.flush()
+                index += 1
+        except (IOError, OSError) as ex:
+            # child exited before consuming everything (e.g. broken pipe); nothing left to do
+            _logger.debug('stopped feeding input: %s' % ex)
+        finally:
+            try:
+                io.close()
+            except (IOError, OSError):
+                pass
@@ -1,37 +1,123 @@
 import os
 import io
+import gzip
 import json
+import logging
+import sys
 import time
 
-# Python 3 compatibility (no longer includes `unicode`):
-try:
-    unicode
-except NameError:
-    unicode = str
+from datetime import datetime
+
+from . import projection
+from . import timestamp
+from .file_lock import FileLock
+
+# `tempfile` and `subprocess` are imported where used, so that only reading caches (e.g. to
+# complete names, see `complete`) stays quick
+
+# Python 3 compatibility (`os.rename` will not overwrite an existing file on Windows):
+_replace = getattr(os, 'replace', os.rename)
+
+_logger = logging.getLogger(__name__)
+
+
+def write_atomically(path, data):
+    '''Write to a sibling and rename over `path` so readers never see a partial file.'''
+    import tempfile
+    parent, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=name + '.', dir=parent)
+    try:
+        try:
+            written = 0
+            while written < len(data):
+                written += os.write(fd, data[written:])
+        finally:
+            os.close(fd)
+        _replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def read(path):
+    '''Load a cached file as-is (see `Cache`).'''
+    with io.open(path, 'rb') as f:
+        with gzip.GzipFile(fileobj=f, mode='rb') as gz:
+            return json.loads(gz.read().decode('utf-8'))
 
 
 class Cache(object):
-    def __init__(self, path, seconds, retriever, *retriever_args):
+    '''Keeps the result of `retriever` as compressed JSON at `path` for `seconds`.
+
+    Files are replaced atomically and refreshes are serialized across processes with a lock file,
+    so concurrent kubey runs reuse a single retrieval instead of racing each other.
+
+    When `max_age` (seconds, greater than `seconds`) and `refresh_argv` (how `kubey.refresh` is to
+    request the JSON to cache, see `refresh.refresh_argv`) are provided, expired data younger than
+    `max_age` is served immediately and a detached process refreshes the file for the next caller.
+
+    When `fields` are provided, only those JSON paths are kept (see `projection`) and a file cached
+    with different fields is treated as expired.
+
+    An `on_access` callable is told the name and how the data was first obtained: HIT (from the
+    file), STALE (expired file served) or MISS (retrieved).
+    '''
+
+    HIT = 'hit'
+    STALE = 'stale'
+    MISS = 'miss'
+
+    COMPRESS_LEVEL = 1  # JSON compresses well even at the fastest level
+    READ_ERRORS = (IOError, OSError, EOFError, ValueError)
+
+    def __init__(self, path, seconds, retriever, *retriever_args, **kwargs):
         parent = os.path.dirname(path)
         if not os.path.exists(parent):
             os.makedirs(parent)
         self.path = path
+        self.name = kwargs.get('name', os.path.basename(path))
         self.seconds = seconds
+        self.max_age = kwargs.get('max_age')
+        self.refresh_argv = kwargs.get('refresh_argv')
+        self.on_access = kwargs.get('on_access')
+        self.fields = sorted(kwargs['fields']) if kwargs.get('fields') else None
         self.retriever = retriever
         self.retriever_args = retriever_args
         self._obj = None
         self._expiry = None
+        self._lock = FileLock(self.path + '.lock')
+
+    @property
+    def age(self):
+        '''Seconds since the cached file was written (None if there is none).'''
+        if not os.path.exists(self.path):
+            return None
+        return time.time() - os.path.getmtime(self.path)
 
     def obj(self):
-        self._consider_update()
+        first = self._obj is None
+        outcome = self._consider_update()
+        if first and outcome and self.on_access:
+            self.on_access(self.name, outcome)
         return self._obj
 
     def _consider_update(self):
         if self._is_stale():
-            self._update()
+            if not self._obj and self._can_serve_stale():
+                try:
+                    self._obj = self._read()
+                    self._refresh_detached()
+                    return self.STALE
+                except self.READ_ERRORS:
+                    pass
+            return self._update()
         elif not self._obj:
-            with io.open(self.path, 'r', encoding='utf-8') as f:
-                self._obj = json.load(f)
+            try:
+                self._obj = self._read()
+                return self.HIT
+            except self.READ_ERRORS as ex:
+                _logger.warn('discarding unreadable cache %s: %s' % (self.path, ex))
+                return self._update(force=True)
 
     def _is_stale(self):
         if not self._expiry:
@@ -42,11 +128,57 @@ class Cache(object):
             self._set_expiry()
         return self._expiry < time.time()
 
-    def _update(self):
-        self._obj = self.retriever(*self.retriever_args)
-        with io.open(self.path, 'w', encoding='utf-8') as f:
-            f.write(unicode(json.dumps(self._obj, ensure_ascii=False)))
-        self._set_expiry()
+    def _can_serve_stale(self):
+        if not self.max_age or not self.refresh_argv:
+            return False
+        age = self.age
+        return age is not None and age < self.max_age
+
+    def _refresh_detached(self):
+        import subprocess
+        stamp = datetime.fromtimestamp(os.path.getmtime(self.path), timestamp.epoch.tzinfo)
+        if self._lock.is_held():
+            _logger.warn('using %s cached %s (refresh in progress)' % (
+                self.name, timestamp.in_words_from_now(stamp, ' ')))
+            return
+        _logger.warn('using %s cached %s (refreshing in background)' % (
+            self.name, timestamp.in_words_from_now(stamp, ' ')))
+        with io.open(os.devnull, 'r+b') as devnull:
+            subprocess.Popen(
+                [sys.executable, '-m', 'kubey.refresh', self.path, str(self.seconds),
+                 ','.join(self.fields or [])] + list(self.refresh_argv),
+                stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True,
+                preexec_fn=getattr(os, 'setsid', None))  # detach from our terminal and signals
+
+    def _update(self, force=False):
+        with self._lock:
+            # another process may have refreshed it while this one was waiting on the lock
+            self._expiry = None
+            if not force and not self._is_stale():
+                try:
+                    self._obj = self._read()
+                    return self.HIT
+                except self.READ_ERRORS:
+                    pass
+            self._obj = self.retriever(*self.retriever_args)
+            if self.fields:
+                self._obj = projection.project(self._obj, self.fields)
+                self._obj['projection'] = self.fields
+            self._write(self._obj)
+            self._set_expiry()
+            return self.MISS
+
+    def _read(self):
+        obj = read(self.path)
+        if self.fields and obj.get('projection') != self.fields:
+            raise ValueError('cached with different fields')
+        return obj
+
+    def _write(self, obj):
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=self.COMPRESS_LEVEL) as gz:
+            gz.write(json.dumps(obj, separators=(',', ':')).encode('utf-8'))
+        write_atomically(self.path, buf.getvalue())
 
     def _set_expiry(self):
         self._expiry = os.path.getmtime(self.path) + self.seconds
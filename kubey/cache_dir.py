@@ -0,0 +1,158 @@
+import os
+import io
+import re
+import json
+import time
+import logging
+
+from .cache import Cache, write_atomically
+from .file_lock import FileLock
+from .name_index import NameIndex
+
+
+_logger = logging.getLogger(__name__)
+
+KEY_CHARS = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-')
+
+
+def _hex_of_key_char(m):
+    return m.group(1) or '{0:02X}'.format(ord(m.group(0)))
+
+
+class CacheDir(object):
+    '''Directory holding the cache files of every context, kept under a total size budget.
+
+    Files are named `<CONTEXT>_<NAME>[.<EXT>]` and the least recently accessed caches are evicted
+    first. Access times are set explicitly (mounts often use "noatime" or "relatime") and per
+    context hit/miss counts are kept in a small stats file alongside, updated once per run (see
+    `flush`) or when a cache is written anyway.
+    '''
+
+    CACHE_EXT = '.json.gz'
+    STATS_FILENAME = 'stats.json'
+
+    def __init__(self, root, max_bytes=None):
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self.root = root
+        self.max_bytes = max_bytes
+        self._stats_path = os.path.join(root, self.STATS_FILENAME)
+        self._counts = {}  # (context, name, outcome) => accesses not yet in the stats file
+
+    @staticmethod
+    def default_root():
+        return os.path.join(os.path.expanduser('~'), '.kubey', 'cache')
+
+    @staticmethod
+    def key_for(context):
+        '''Context escaped for use in file names (as "%XX" for each byte other than letters, digits
+        and dashes), so that every context has its own key.
+        '''
+        return ''.join(chr(b) if chr(b) in KEY_CHARS else '%{0:02X}'.format(b)
+                       for b in bytearray(context.encode('utf-8')))
+
+    @staticmethod
+    def context_for(key):
+        return bytearray.fromhex(re.sub(r'[^%]|%(..)', _hex_of_key_char, key)).decode('utf-8')
+
+    def path_for(self, context, name, ext=''):
+        return os.path.join(self.root, '{0}_{1}{2}'.format(self.key_for(context), name, ext))
+
+    def cache_path_for(self, context, name):
+        return self.path_for(context, name, self.CACHE_EXT)
+
+    def name_index_for(self, context):
+        '''Index of the pod, container and node names cached for context (see `NameIndex`).'''
+        return NameIndex(self.path_for(context, 'names', '.txt'),
+                         [self.cache_path_for(context, name) for name in ('pods', 'nodes')])
+
+    def record(self, context, name, outcome):
+        '''Count a cache access and, if it produced a new file, enforce the size budget.'''
+        path = self.cache_path_for(context, name)
+        if os.path.exists(path):
+            os.utime(path, (time.time(), os.path.getmtime(path)))  # keep mtime for expiry
+        key = (context, name, outcome)
+        self._counts[key] = self._counts.get(key, 0) + 1
+        if outcome == Cache.MISS:
+            self.flush()
+            if self.max_bytes:
+                self.prune()
+
+    def flush(self):
+        '''Add the accesses recorded since last flushed to the stats file.'''
+        if not self._counts:
+            return
+        pending, self._counts = self._counts, {}
+        with FileLock(self._stats_path + '.lock'):
+            stats = self._load_stats()
+            for (context, name, outcome), count in pending.items():
+                entry = stats.setdefault(self.key_for(context), {'context': context, 'counts': {}})
+                counts = entry['counts'].setdefault(name, {})
+                counts[outcome] = counts.get(outcome, 0) + count
+            write_atomically(self._stats_path, json.dumps(stats, indent=2).encode('utf-8'))
+
+    def stats(self):
+        '''Summaries per context: bytes used, last access and cache hit/miss/stale counts.'''
+        summaries = {}
+        for key, _path, atime, size in self._files():
+            summary = summaries.setdefault(key, {
+                'context': self.context_for(key), 'files': 0, 'bytes': 0, 'last_access': 0,
+                'hit': 0, 'stale': 0, 'miss': 0,
+            })
+            summary['files'] += 1
+            summary['bytes'] += size
+            summary['last_access'] = max(summary['last_access'], atime)
+        for key, entry in self._load_stats().items():
+            summary = summaries.get(key)
+            if not summary:
+                continue  # all files evicted
+            for counts in entry['counts'].values():
+                for outcome, count in counts.items():
+                    summary[outcome] = summary.get(outcome, 0) + count
+        return sorted(summaries.values(), key=lambda s: -s['last_access'])
+
+    def prune(self, max_bytes=None):
+        '''Evict least recently accessed caches until under budget. Returns evicted (path, size).'''
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        files = self._files()
+        total = sum(f[3] for f in files)
+        caches = [f for f in files if f[1].endswith(self.CACHE_EXT)]
+        evicted = []
+        for _key, path, _atime, size in sorted(caches, key=lambda f: f[2]):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError as ex:
+                _logger.debug('unable to evict %s: %s' % (path, ex))
+                continue
+            total -= size
+            evicted.append((path, size))
+            lock_path = path + '.lock'
+            if os.path.exists(lock_path):
+                os.remove(lock_path)  # worst case, a concurrent refresh happens twice
+            _logger.debug('evicted %s (%d bytes)' % (path, size))
+        return evicted
+
+    def _files(self):
+        '''List (context key, path, access time, size) of every file but the stats.'''
+        files = []
+        for name in os.listdir(self.root):
+            if name.startswith(self.STATS_FILENAME):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # removed by another process
+            # keys never contain dots or underscores, so the base name is always "<KEY>_<NAME>"
+            key = name.split('.', 1)[0].split('_', 1)[0]
+            files.append((key, path, st.st_atime, st.st_size))
+        return files
+
+    def _load_stats(self):
+        try:
+            with io.open(self._stats_path, 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return {}
@@ -1,17 +1,28 @@
+# modules only used by one command are imported by it (to keep startup quick)
 import os
 import sys
+import json
 import logging
 import re
 import signal
+import time
 import click
 
 from configstruct import OpenStruct
 from collections import defaultdict
+from datetime import datetime
 
+from . import jsonpath
 from . import tabular
+from . import timestamp
+from . import units
 
-from .kubey import Kubey
+from .cache_dir import CacheDir
+from .broadcaster import Broadcaster
 from .event import Event
+from .execution import Execution
+from .openitem import OpenItem
+from .watch_table import DiffLog, LiveTable
 from .node import Node
 from .pod import Pod
 
@@ -44,16 +55,145 @@ class ColumnsOption(click.ParamType):
         return self.envvar_list_splitter.join(attrs)
 
 
+class CacheTtlOption(click.ParamType):
+    name = 'ttl'
+
+    def convert(self, value, param, ctx):
+        m = re.match(r'^(\w+)=(\d+)(?::(\d+))?$', value)
+        if not m:
+            self.fail('expected RESOURCE=SECONDS[:MAX_AGE] (e.g. pods=60:3600): ' + value)
+        resource, seconds, max_age = m.groups()
+        seconds = int(seconds)
+        max_age = int(max_age) if max_age else None
+        if max_age is not None and max_age <= seconds:
+            self.fail('max age must be greater than seconds: ' + value)
+        return (resource, (seconds, max_age))
+
+
+class DurationOption(click.ParamType):
+    name = 'duration'
+    UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600}
+
+    def convert(self, value, param, ctx):
+        m = re.match(r'^(\d+(?:\.\d+)?)([smh]?)$', str(value))
+        if not m or float(m.group(1)) <= 0:
+            self.fail('expected a positive duration (e.g. 5s, 2m, 1h): ' + str(value))
+        return float(m.group(1)) * self.UNITS[m.group(2)]
+
+
+class GroupByOption(click.ParamType):
+    name = 'group'
+    KINDS = ('image', 'node', 'phase', 'namespace')
+
+    def convert(self, value, param, ctx):
+        if value in self.KINDS:
+            return (value, None)
+        if value.startswith('label:') and len(value) > 6:
+            return ('label', value[6:])
+        self.fail('expected one of {0} or label:KEY: {1}'.format('|'.join(self.KINDS), value))
+
+
+class TableFormatOption(click.ParamType):
+    '''One of the formats of tabulate (which is not loaded just to check the default).'''
+    name = 'format'
+    DEFAULT = 'simple'
+
+    def convert(self, value, param, ctx):
+        if value == self.DEFAULT:
+            return value
+        formats = tabular.formats()
+        if value not in formats:
+            self.fail('expected one of {0}: {1}'.format(', '.join(formats), value))
+        return value
+
+
+class JsonPathColumnsOption(click.ParamType):
+    '''Comma separated [HEADER:]JSONPATH columns (see `jsonpath`), like kubectl's custom-columns.'''
+    name = 'columns'
+    DEFAULT = 'namespace:.metadata.namespace,name:.metadata.name'
+
+    def convert(self, value, param, ctx):
+        columns = []
+        for spec in value.split(','):
+            header, path = ('', spec) if spec[:1] in ('.', '{', '[') else spec.partition(':')[::2]
+            try:
+                steps = jsonpath.compile_path(path)
+            except ValueError as ex:
+                self.fail(str(ex))
+            columns.append((header or jsonpath.default_name(steps), steps))
+        return columns
+
+
+class LabelOption(click.ParamType):
+    name = 'label'
+
+    def convert(self, value, param, ctx):
+        key, sep, label_value = value.partition('=')
+        if not key:
+            self.fail('expected KEY[=VALUE] (e.g. app=web): ' + value)
+        return (key, label_value if sep else None)
+
+
+class ForwardPortsOption(click.ParamType):
+    name = 'ports'
+
+    def convert(self, value, param, ctx):
+        m = re.match(r'^(?:(\d*):)?(\d+)$', value)
+        if not m or int(m.group(2)) == 0 or int(m.group(1) or 0) > 65535 or \
+                int(m.group(2)) > 65535:
+            self.fail('expected [LOCAL_PORT:]REMOTE_PORT (e.g. 8080:80): ' + value)
+        local, remote = m.groups()
+        return (int(remote if local is None else local or 0), int(remote))
+
+
+class KubeyGroup(click.Group):
+    '''Lets the commands that select nothing be given without MATCH (e.g. "kubey cache stats").'''
+    MATCHLESS_COMMANDS = ('cache',)
+
+    def parse_args(self, ctx, args):
+        # options come first and MATCH is then taken, so a command given instead of MATCH is what
+        # was taken unless another command follows it (e.g. pods matching "cache" are listed by
+        # "kubey cache list")
+        opts, rest, _order = self.make_parser(ctx).parse_args(args=list(args))
+        following = rest[0] if rest else None
+        if opts.get('match') in self.MATCHLESS_COMMANDS and following not in self.commands:
+            at = len(args) - len(rest) - 1
+            args = list(args[:at]) + [''] + list(args[at:])
+        return super(KubeyGroup, self).parse_args(ctx, args)
+
+
 _logger = None
 _event_columns = ColumnsOption(Event)
 _node_columns = ColumnsOption(Node)
 _pod_columns = ColumnsOption(Pod)
 
 
-@click.group(invoke_without_command=True, context_settings=dict(help_option_names=['-h', '--help']))
+@click.group(cls=KubeyGroup, invoke_without_command=True,
+             context_settings=dict(help_option_names=['-h', '--help']))
 @click.version_option()
 @click.option('--cache-seconds', envvar='KUBEY_CACHE_SECONDS', default=300, show_default=True,
               help='change number of seconds to keep pod info cached')
+@click.option('--cache-ttl', 'cache_ttls', envvar='KUBEY_CACHE_TTL', multiple=True,
+              type=CacheTtlOption(),
+              help='seconds to cache a resource (pods, nodes, namespaces) and, optionally, the max '
+                   'age of expired data to keep using while refreshing in background '
+                   '(e.g. pods=60:3600)')
+@click.option('--cache-dir', envvar='KUBEY_CACHE_DIR', type=click.Path(file_okay=False),
+              help='directory for cached cluster info  [default: ~/.kubey/cache]')
+@click.option('--cache-max-mb', envvar='KUBEY_CACHE_MAX_MB', type=click.IntRange(1), default=100,
+              show_default=True,
+              help='evict least recently used cache files once all contexts exceed this size')
+@click.option('--request-timeout', envvar='KUBEY_REQUEST_TIMEOUT', type=float, default=60,
+              show_default=True, help='seconds before giving up on a kubectl query (0 to disable)')
+@click.option('--retries', envvar='KUBEY_RETRIES', type=click.IntRange(0), default=2,
+              show_default=True, help='number of times to retry a failed or timed out query')
+@click.option('--hedge-after', envvar='KUBEY_HEDGE_AFTER', type=float,
+              help='seconds to wait on a slow query before racing a duplicate request')
+@click.option('--qps', envvar='KUBEY_QPS', type=float, default=0, show_default=True,
+              help='max kubectl calls per second shared by all kubey processes for a context '
+                   '(0 to disable)')
+@click.option('--burst', envvar='KUBEY_BURST', type=click.IntRange(1), default=10,
+              show_default=True, help='number of kubectl calls allowed at once before pacing')
 @click.option('-l', '--log-level', envvar='KUBEY_LOG_LEVEL',
               type=click.Choice(('debug', 'info', 'warning', 'error', 'critical')),
               default='info', help='set logging level')
@@ -61,20 +201,34 @@ _pod_columns = ColumnsOption(Pod)
 @click.option('-n', '--namespace', envvar='KUBEY_NAMESPACE', default='production',
               show_default=True, help='namespace to use when selecting')
 @click.option('-f', '--format', 'table_format', envvar='KUBEY_TABLE_FORMAT',
-              type=click.Choice(tabular.formats), default='simple',
+              type=TableFormatOption(), default=TableFormatOption.DEFAULT,
               show_default=True, help='output format of tabular data (e.g. listing)')
 @click.option('-m', '--max', 'maximum', type=int, help='max number of matches')
+@click.option('--phase', 'phases', multiple=True,
+              help='only select pods in this phase (e.g. Running, Pending; may be repeated)')
+@click.option('--ready/--not-ready', default=None,
+              help='only select pods that are (or are not) ready')
+@click.option('--min-restarts', type=click.IntRange(0),
+              help='only select pods whose containers restarted at least this many times')
+@click.option('--label', 'labels', type=LabelOption(), multiple=True,
+              help='only select pods with this label (KEY) or label value (KEY=VALUE; may be '
+              'repeated)')
 @click.option('--no-headers', is_flag=True, help='disable table headers')
 @click.option('--wide', is_flag=True, help='force use of wide output')
+@click.option('--report', type=click.File('w', lazy=True),
+              help='write a JSON record of every kubectl process run (target, exit code, timing)')
+@click.option('--report-summary', is_flag=True,
+              help='show a table of every kubectl process run when finished (slowest first)')
 @click.argument('match')
 @click.pass_context
-def cli(ctx, cache_seconds, log_level, context, namespace,
-        table_format, maximum, no_headers, wide, match):
+def cli(ctx, cache_seconds, cache_ttls, cache_dir, cache_max_mb, request_timeout, retries,
+        hedge_after, qps, burst, log_level, context, namespace, table_format, maximum, phases,
+        ready, min_restarts, labels, no_headers, wide, report, report_summary, match):
     '''Simple wrapper to help find specific Kubernetes pods and containers and run asynchronous
     commands (default is to list those that matched).
 
     \b
-    MATCH       [<NODE>/]<POD>[/<CONTAINER>]
+    MATCH       [<NODE>/]<POD>[/<CONTAINER>][,...]
     \b
     NODE        provide a regular expression to select one or more nodes
     POD         provide a regular expression to select one or more pods
@@ -83,6 +237,11 @@ def cli(ctx, cache_seconds, log_level, context, namespace,
     Partial match using just node or just node and pod, provide trailing slash:
         my-node//          match all pods and containers hosted in my-node
         my-node/my-pod/    match all containers hosted in my-node/my-pod
+    \b
+    Select any of several matches by separating them with commas:
+        web,worker/sidekiq match all web pods and sidekiq containers in worker pods
+    \b
+    The cache commands select nothing, so take no MATCH (e.g. "kubey cache stats").
     '''
 
     logging.basicConfig(
@@ -116,23 +275,47 @@ def cli(ctx, cache_seconds, log_level, context, namespace,
         highlight_error=highlight_with('red'),
         hard_percent_limit=hard_percent_limit,
         soft_percent_limit=soft_percent_limit,
-        cache_path=os.path.expanduser('~'),
+        cache_path=cache_dir or CacheDir.default_root(),
+        cache_max_bytes=cache_max_mb * 1024 * 1024,
         cache_seconds=cache_seconds,
+        cache_ttls=dict(cache_ttls),
+        request_timeout=request_timeout,
+        retries=retries,
+        hedge_after=hedge_after,
+        qps=qps,
+        burst=burst,
         context=context,
         namespace=namespace,
         table_format=table_format,
         no_headers=no_headers,
         wide=wide,
         maximum=maximum,
+        phases=phases,
+        ready=ready,
+        min_restarts=min_restarts,
+        labels=dict(labels),
         match=match,
     )
+    if ctx.invoked_subcommand == cache_group.name:
+        return  # only the cache directory is used (see `KubeyGroup`)
+    from .kubey import Kubey  # not needed to show help
     ctx.obj.kubey = Kubey(ctx.obj)
+    ctx.call_on_close(ctx.obj.kubey.close)
+
+    if qps:
+        ctx.call_on_close(lambda: _log_rate_limiting(ctx.obj.kubey.kubectl.rate_limiter))
+
+    if report or report_summary:
+        ctx.obj.kubey.kubectl.record_executions()
+        ctx.call_on_close(lambda: _write_report(ctx.obj, report, report_summary))
 
     def handle_interrupt(signal, _frame):
         ctx.obj.kubey.kubectl.kill(signal)
         ctx.exit(22)
     signal.signal(signal.SIGINT, handle_interrupt)
     signal.signal(signal.SIGTERM, handle_interrupt)
+    if hasattr(signal, 'SIGHUP'):  # children in their own process groups miss terminal hangups
+        signal.signal(signal.SIGHUP, handle_interrupt)
 
     if not ctx.invoked_subcommand:
         ctx.invoke(list_pods)
@@ -142,10 +325,26 @@ def cli(ctx, cache_seconds, log_level, context, namespace,
 @click.option('-c', '--columns', type=_node_columns, default=_node_columns.default,
               help=_node_columns.help)
 @click.option('-f', '--flat', is_flag=True, help='flatten columns with multiple items')
+@click.option('--sort-by', type=click.Choice(Node.SORT_ATTRIBUTES),
+              help='order nodes by this column (largest or newest first)')
+@click.option('--ascending', is_flag=True, help='order smallest or oldest first')
+@click.option('--top', type=click.IntRange(1), help='only show the first nodes in the order')
+@click.option('-w', '--watch', is_flag=True, help='keep updating rows as nodes change')
+@click.option('--sample', 'sample_interval', type=DurationOption(),
+              help='sample usage every INTERVAL (e.g. 5s) and show min/avg/p95/max and sparklines')
+@click.option('--duration', type=DurationOption(), default='1m', show_default=True,
+              help='how long to keep sampling')
 @click.pass_obj
-def health(obj, columns, flat):
+def health(obj, columns, flat, sort_by, ascending, top, watch, sample_interval, duration):
     '''Show health stats about matches.'''
-    click.echo(tabular.tabulate(obj, obj.kubey.each_node(obj.maximum, True), columns, flat))
+    if sample_interval:
+        if watch:
+            raise click.BadParameter('not available with --watch', param_hint='--sample')
+        return _sample(obj, sample_interval, duration, columns, flat, sort_by or top)
+    if watch:
+        return _watch(obj, obj.kubey.watch_nodes(True), columns, flat, sort_by or top)
+    nodes = _ranked(obj.kubey.each_node(obj.maximum, True), sort_by, ascending, top)
+    click.echo(tabular.tabulate(obj, nodes, columns, flat))
 
 
 # FIXME: if --wide use all attributes, not default
@@ -153,13 +352,22 @@ def health(obj, columns, flat):
 @click.option('-c', '--columns', type=_pod_columns, default=_pod_columns.default,
               help=_pod_columns.help)
 @click.option('-f', '--flat', is_flag=True, help='flatten columns with multiple items')
+@click.option('--sort-by', type=click.Choice(Pod.SORT_ATTRIBUTES),
+              help='order pods by this column (largest or newest first)')
+@click.option('--ascending', is_flag=True, help='order smallest or oldest first')
+@click.option('--top', type=click.IntRange(1), help='only show the first pods in the order')
+@click.option('-w', '--watch', is_flag=True, help='keep updating rows as pods change')
 @click.pass_obj
-def list_pods(obj, columns, flat):
+def list_pods(obj, columns, flat, sort_by, ascending, top, watch):
     '''List available pods and containers for current context.'''
     # FIXME: find a "click" way to ask if columns were provided or defaults used
-    if obj.namespace == Kubey.ANY and '-c' not in sys.argv and '--columns' not in sys.argv:
+    if obj.namespace == obj.kubey.ANY and '-c' not in sys.argv and '--columns' not in sys.argv:
         columns = ['namespace'] + columns
-    click.echo(tabular.tabulate(obj, obj.kubey.each_pod(obj.maximum), columns, flat))
+    if watch:
+        return _watch(obj, obj.kubey.watch_pods(), columns, flat, sort_by or top)
+    usage = set(Pod.USAGE_ATTRIBUTES) & (set(columns) | set([sort_by]))
+    pods = _ranked(obj.kubey.each_pod(obj.maximum, bool(usage)), sort_by, ascending, top)
+    click.echo(tabular.tabulate(obj, pods, columns, flat))
 
 
 @cli.command()
@@ -197,19 +405,40 @@ def repl(ctx, repl, arguments):
 @click.option('-i', '--interactive', is_flag=True,
               help='require interactive session '
                    '(works with REPLs like shells or other command instances needing input)')
-@click.option('-a', '--async', is_flag=True,
+@click.option('-a', '--async', 'run_async', is_flag=True,
               help='run commands asynchronously (incompatible with "interactive")')
 @click.option('-p', '--prefix', is_flag=True,
               help='add a prefix to all output indicating the pod and container names '
                    '(incompatible with "interactive")')
+@click.option('--stdin', 'use_stdin', is_flag=True,
+              help='read local input once and stream it to every remote command '
+                   '(incompatible with "interactive")')
+@click.option('-w', '--wave-size', type=click.IntRange(1),
+              help='run commands in waves of at most this many at once '
+                   '(incompatible with "async" and "interactive")')
+@click.option('--max-failures', type=click.IntRange(0),
+              help='stop starting new waves once more than this many commands failed')
+@click.option('-o', '--output-dir', type=click.Path(file_okay=False),
+              help='write the output of each command (as is) into files under this directory '
+                   '(as NAMESPACE/POD/CONTAINER.stdout and .stderr) instead of showing it '
+                   '(incompatible with "prefix" and "interactive")')
 @click.argument('command')
 @click.argument('arguments', nargs=-1, type=click.UNPROCESSED)
 @click.pass_obj
-def each(obj, shell, interactive, async, prefix, command, arguments):
+def each(obj, shell, interactive, run_async, prefix, use_stdin, wave_size, max_failures,
+         output_dir, command, arguments):
     '''Execute a command remotely for each pod matched.'''
 
     kubectl = obj.kubey.kubectl
+    if output_dir and (prefix or interactive):
+        raise click.UsageError('"output-dir" is incompatible with "prefix" and "interactive"')
     kexec_args = ['exec']
+    broadcaster = None
+    if use_stdin:
+        if interactive:
+            raise click.UsageError('"stdin" is incompatible with "interactive"')
+        kexec_args.append('-i')
+        broadcaster = Broadcaster(click.get_binary_stream('stdin'))
     if interactive:
         kexec_args.append('-ti')
         # FIXME: when https://github.com/docker/docker/issues/8755 is fixed, remove env/term?
@@ -222,46 +451,77 @@ def each(obj, shell, interactive, async, prefix, command, arguments):
     remote_cmd = [shell, '-c', ' '.join(remote_args)]
 
     # TODO: add option to include 'node' name in prefix
-    for pod in obj.kubey.each_pod(obj.maximum):
-        for container in pod.containers:
-            if not container.ready:
-                _logger.warn('skipping ' + str(container))
-                continue
-            args = kexec_args + \
-                ['-n', pod.namespace, '-c', container.name, pod.name, '--'] + \
-                remote_cmd
-            if prefix:
-                args.insert(0, '[%s/%s] ' % (pod.name, container.name))
-                kubectl.call_prefix(*args)
-            else:
-                kubectl.call_async(*args)
-            if not async:
+    def run(pod, container):
+        args = kexec_args + \
+            ['-n', pod.namespace, '-c', container.name, pod.name, '--'] + \
+            remote_cmd
+        if output_dir:
+            path = os.path.join(output_dir, pod.namespace, pod.name, container.name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            kubectl.call_to_files(path + '.stdout', path + '.stderr', *args, stdin=broadcaster,
+                                  target=_target(pod, container))
+        elif prefix:
+            args.insert(0, '[%s/%s] ' % (pod.name, container.name))
+            kubectl.call_prefix(*args, stdin=broadcaster, target=_target(pod, container))
+        else:
+            kubectl.call_async(*args, stdin=broadcaster, target=_target(pod, container),
+                               interactive=interactive)
+
+    if wave_size:
+        if run_async or interactive:
+            raise click.UsageError('"wave-size" is incompatible with "async" and "interactive"')
+        _run_waves(kubectl, list(_each_ready_container(obj)), run, wave_size, max_failures)
+    else:
+        for pod, container in _each_ready_container(obj):
+            run(pod, container)
+            if not run_async:
                 kubectl.wait()
 
-    if async:
+    if run_async:
         kubectl.wait()
     if kubectl.final_rc != 0:
         click.get_current_context().exit(kubectl.final_rc)
 
 
 @cli.command(name='ctl-each', context_settings=dict(ignore_unknown_options=True))
+@click.option('--json', 'use_json', is_flag=True,
+              help='read the output of each namespace as JSON and merge the items (instead of '
+              'reading text tables)')
+@click.option('--columns', type=JsonPathColumnsOption(),
+              help='with "json", columns as [HEADER:]JSONPATH (e.g. '
+              '"image:.spec.containers[*].image")  [default: namespace and name]')
+@click.option('--json-output', is_flag=True,
+              help='with "json", print the merged items (or columns) as JSON instead of a table')
 @click.argument('command')
 @click.argument('arguments', nargs=-1, type=click.UNPROCESSED)
 @click.pass_obj
-def ctl_each(obj, command, arguments):
-    '''Invoke any kubectl command directly for each pod matched and collate the output.'''
-    width, height = click.get_terminal_size()
+def ctl_each(obj, use_json, columns, json_output, command, arguments):
+    '''Invoke any kubectl command directly for each pod matched and collate the output.
+
+    The command runs once per namespace, for all of its pods at once, concurrently.
+    '''
+    if (columns or json_output) and not use_json:
+        raise click.UsageError('"columns" and "json-output" require "json"')
     kubectl = obj.kubey.kubectl
-    collector = tabular.RowCollector()
+    if use_json:
+        collector = tabular.ItemCollector()
+        call = kubectl.call_json_async
+    else:
+        collector = tabular.RowCollector()
+        call = kubectl.call_table_rows
     ns_pods = defaultdict(list)
     for pod in obj.kubey.each_pod(obj.maximum):
         ns_pods[pod.namespace].append(pod)
     for ns, pods in ns_pods.items():
         args = ['-n', ns] + list(arguments) + [p.name for p in pods]
-        kubectl.call_table_rows(collector.handler_for(ns), command, *args)
+        call(collector.handler_for(ns), command, *args, target=ns)
     kubectl.wait()
-    if collector.rows:
-        click.echo(tabular.tabulate(obj, sorted(collector.rows), collector.headers))
+    if use_json:
+        _echo_items(obj, collector.items, columns, json_output)
+    elif collector.rows:
+        rows = sorted(collector.rows, key=lambda r: [v for _a, v in r.attrvals(r.ATTRIBUTES)])
+        click.echo(tabular.tabulate(obj, rows, collector.headers))
     if kubectl.final_rc != 0:
         click.get_current_context().exit(kubectl.final_rc)
 
@@ -271,15 +531,36 @@ def ctl_each(obj, command, arguments):
               help='stream new logs until interrupted')
 @click.option('-p', '--prefix', is_flag=True,
               help='add a prefix to all output indicating the pod and container names')
+@click.option('--save', 'save_dir', type=click.Path(file_okay=False),
+              help='write the log of each container to its own files under this directory (as '
+              'NAMESPACE/POD/CONTAINER.NNNN.log)')
+@click.option('--compress', type=click.Choice(['gzip', 'zstd']),
+              help='compress saved logs (zstd requires the "zstandard" package)')
+@click.option('--rotate-mb', type=click.IntRange(1),
+              help='start a new file once this much has been saved to one')
+@click.option('--rotate-after', type=DurationOption(),
+              help='start a new file once one is this old (e.g. 1h)')
+@click.option('--max-open', type=click.IntRange(1), default=64, show_default=True,
+              help='most saved files kept open at once')
 @click.argument('number', default='10')
 @click.pass_obj
-def tail(obj, follow, prefix, number):
+def tail(obj, follow, prefix, save_dir, compress, rotate_mb, rotate_after, max_open, number):
     '''Show recent logs from containers for each pod matched.
 
     NUMBER is a count of recent lines or a relative duration (e.g. 5s, 2m, 3h)
     '''
 
     kubectl = obj.kubey.kubectl
+    archive = None
+    if save_dir:
+        from .log_archive import LogArchive
+        try:
+            archive = LogArchive(save_dir, compress, rotate_bytes=rotate_mb and rotate_mb << 20,
+                                 rotate_seconds=rotate_after, max_open=max_open)
+        except ImportError:
+            raise click.BadParameter('requires the "zstandard" package', param_hint='--compress')
+    elif compress or rotate_mb or rotate_after:
+        raise click.UsageError('"compress", "rotate-mb" and "rotate-after" require "save"')
 
     if re.match(r'^\d+$', number):
         log_args = ['--tail', str(number)]
@@ -289,32 +570,367 @@ def tail(obj, follow, prefix, number):
     if follow:
         log_args.append('-f')
 
-    for pod in obj.kubey.each_pod(obj.maximum):
-        for container in pod.containers:
-            args = ['-n', pod.namespace, '-c', container.name] + log_args + [pod.name]
-            if prefix:
-                prefix = '[%s:%s] ' % (pod.name, container.name)
-                kubectl.call_prefix(prefix, 'logs', *args)
-            else:
-                kubectl.call_async('logs', *args)
+    try:
+        for pod in obj.kubey.each_pod(obj.maximum):
+            for container in pod.containers:
+                args = ['-n', pod.namespace, '-c', container.name] + log_args + [pod.name]
+                if archive:
+                    kubectl.call_lines(archive.stream(pod.namespace, pod.name, container.name),
+                                       '[%s:%s] ' % (pod.name, container.name), 'logs', *args,
+                                       target=_target(pod, container), raw=True)
+                elif prefix:
+                    prefix = '[%s:%s] ' % (pod.name, container.name)
+                    kubectl.call_prefix(prefix, 'logs', *args, target=_target(pod, container))
+                else:
+                    kubectl.call_async('logs', *args, target=_target(pod, container))
+        kubectl.wait()
+    finally:
+        if archive:
+            archive.close()  # also when interrupted
+    if kubectl.final_rc != 0:
+        click.get_current_context().exit(kubectl.final_rc)
+
+
+@cli.command()
+@click.option('-j', '--jobs', default=10, show_default=True,
+              help='maximum number of copies to run concurrently')
+@click.argument('local', type=click.Path(exists=True))
+@click.argument('remote')
+@click.pass_obj
+def push(obj, jobs, local, remote):
+    '''Copy a local file or directory to REMOTE in each container matched.
 
+    The LOCAL path is archived and compressed once and the same archive is extracted into every
+    container, creating REMOTE's directory if needed (requires "sh" and "tar" in the containers).
+    '''
+    import posixpath
+    import tarfile
+    import tempfile
+    kubectl = obj.kubey.kubectl
+    if remote.endswith('/'):
+        remote_dir, remote_name = remote, os.path.basename(os.path.normpath(local))
+    else:
+        remote_dir, remote_name = posixpath.split(remote)
+    remote_dir = remote_dir or '.'
+
+    with tempfile.NamedTemporaryFile(suffix='.tar.gz') as archive:
+        with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+            tar.add(local, arcname=remote_name)
+        archive.flush()
+        size = os.path.getsize(archive.name)
+
+        started = time.time()
+        failures = kubectl.failures
+        count = 0
+        for pod, container in _each_ready_container(obj):
+            kubectl.throttle(jobs)
+            with open(archive.name, 'rb') as payload:
+                # the directory is given as an argument of the script, so it needs no quoting
+                kubectl.call_async('exec', '-i', '-n', pod.namespace, '-c', container.name,
+                                   pod.name, '--', 'sh', '-c',
+                                   'mkdir -p "$1" && exec tar xzf - -C "$1"', 'sh', remote_dir,
+                                   stdin=payload, target=_target(pod, container))
+            count += 1
+        kubectl.wait()
+        count -= kubectl.failures - failures  # only the copies that succeeded were transferred
+
+    elapsed = time.time() - started
+    click.echo('pushed {0} to {1} containers in {2:.1f}s ({3})'.format(
+        units.bytes_in_words(size * count), count, elapsed,
+        units.rate_in_words(size * count, elapsed)), err=True)
+    if kubectl.final_rc != 0:
+        click.get_current_context().exit(kubectl.final_rc)
+
+
+@cli.command()
+@click.option('-j', '--jobs', default=10, show_default=True,
+              help='maximum number of copies to run concurrently')
+@click.argument('remote')
+@click.argument('localdir', type=click.Path(file_okay=False))
+@click.pass_obj
+def pull(obj, jobs, remote, localdir):
+    '''Copy REMOTE from each container matched into LOCALDIR.
+
+    Files are written to LOCALDIR/<NAMESPACE>/<POD>/<CONTAINER>/ to keep each copy separate.
+    '''
+    import posixpath
+    kubectl = obj.kubey.kubectl
+    remote_name = posixpath.basename(remote.rstrip('/'))
+    started = time.time()
+    failures = kubectl.failures
+    destinations = []
+    for pod, container in _each_ready_container(obj):
+        dest_dir = os.path.join(localdir, pod.namespace, pod.name, container.name)
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+        dest = os.path.join(dest_dir, remote_name)
+        kubectl.throttle(jobs)
+        kubectl.call_async('cp', '-c', container.name,
+                           '{0}/{1}:{2}'.format(pod.namespace, pod.name, remote), dest,
+                           target=_target(pod, container))
+        destinations.append(dest)
     kubectl.wait()
+
+    elapsed = time.time() - started
+    size = sum(_path_size(d) for d in destinations if os.path.exists(d))
+    click.echo('pulled {0} from {1} containers in {2:.1f}s ({3})'.format(
+        units.bytes_in_words(size), len(destinations) - (kubectl.failures - failures), elapsed,
+        units.rate_in_words(size, elapsed)), err=True)
     if kubectl.final_rc != 0:
         click.get_current_context().exit(kubectl.final_rc)
 
 
+@cli.command()
+@click.option('-b', '--balance', type=click.Choice(['round-robin', 'least-connections']),
+              default='round-robin', show_default=True,
+              help='how connections are spread across the pods')
+@click.option('--address', default='127.0.0.1', show_default=True,
+              help='local address to accept connections on')
+@click.option('--stats-interval', type=DurationOption(),
+              help='show the counters of each pod every INTERVAL (they are always shown on exit)')
+@click.argument('ports', metavar='[LOCAL_PORT:]REMOTE_PORT', type=ForwardPortsOption())
+@click.pass_obj
+def forward(obj, balance, address, stats_interval, ports):
+    '''Forward connections to a local port to a port of the pods matched, balanced across them.
+
+    Each pod is reached through its own "kubectl port-forward", restarted whenever it stops. As
+    with kubectl, a single port is used for both and an empty LOCAL_PORT (e.g. ":80") picks any
+    free port.
+    '''
+    from .port_forward import Backend, ForwardProxy
+    kubectl = obj.kubey.kubectl
+    local_port, remote_port = ports
+    backends = [Backend(obj, pod, remote_port) for pod in obj.kubey.each_pod(obj.maximum)]
+    if not backends:
+        raise click.ClickException('no pods matched')
+    try:
+        proxy = ForwardProxy(backends, address, local_port, balance)
+    except EnvironmentError as ex:
+        raise click.BadParameter(str(ex), param_hint='LOCAL_PORT')
+    proxy.start()
+    click.echo('Forwarding from {0}:{1} -> {2} on {3} pods'.format(
+        address, proxy.port, remote_port, len(backends)))
+
+    show_at = stats_interval and time.time() + stats_interval
+    try:
+        while True:
+            now = time.time()
+            for backend in backends:
+                backend.supervise(kubectl, now)
+            if show_at and now >= show_at:
+                click.echo(tabular.tabulate(obj, backends, Backend.PRIMARY_ATTRIBUTES))
+                show_at += stats_interval
+            time.sleep(kubectl.POLL_SECONDS)
+    finally:
+        proxy.close()
+        click.echo(tabular.tabulate(obj, backends, Backend.PRIMARY_ATTRIBUTES))
+
+
 @cli.command()
 @click.option('-c', '--columns', type=_event_columns, default=_event_columns.default,
               help=_event_columns.help)
+@click.option('--since', type=DurationOption(),
+              help='show recorded events last seen within this long ago (e.g. 6h) and exit')
+@click.option('--offline', is_flag=True,
+              help='only show recorded events (i.e. do not first record the current ones)')
 @click.pass_obj
-def events(obj, columns):
-    '''Show events associated with matched nodes, pods, and/or containers.'''
-    if obj.namespace == Kubey.ANY and '-c' not in sys.argv and '--columns' not in sys.argv:
+def events(obj, columns, since, offline):
+    '''Show events associated with matched nodes, pods, and/or containers.
+
+    Every event seen is recorded locally, so past events remain available (with --since) after
+    the cluster has discarded them. Recorded events are also selected by the name of the object
+    they are about (e.g. MATCH "^web-1$" shows every event of that pod).
+    '''
+    if obj.namespace == obj.kubey.ANY and '-c' not in sys.argv and '--columns' not in sys.argv:
         columns = ['namespace'] + columns
-    for line in tabular.lines(obj, obj.kubey.each_event(obj.maximum), columns):
+    if since or offline:
+        since = time.time() - since if since else None
+        events = obj.kubey.each_past_event(since, obj.maximum, refresh=not offline)
+    else:
+        events = obj.kubey.each_event(obj.maximum)
+    for line in tabular.lines(obj, events, columns):
         click.echo(line)
 
 
+def _echo_items(obj, items, columns, json_output):
+    if json_output and not columns:
+        click.echo(json.dumps({'apiVersion': 'v1', 'kind': 'List', 'items': items}, indent=2))
+        return
+    columns = columns or JsonPathColumnsOption().convert(JsonPathColumnsOption.DEFAULT, None, None)
+    headers = [header for header, _steps in columns]
+    rows = []
+    for item in items:
+        row = []
+        for _header, steps in columns:
+            found = jsonpath.find(item, steps)
+            row.append(found[0] if len(found) == 1 else found or None)
+        rows.append(row)
+    if json_output:
+        click.echo(json.dumps([dict(zip(headers, row)) for row in rows], indent=2))
+        return
+    # objects are shown as JSON (lists are still spread over rows by the table)
+    rows = [OpenItem(headers, [_json_cell(value) for value in row]) for row in rows]
+    click.echo(tabular.tabulate(obj, rows, headers, serialize=False))
+
+
+def _json_cell(value):
+    if isinstance(value, dict):
+        return json.dumps(value, sort_keys=True)
+    if isinstance(value, list):
+        return [_json_cell(v) for v in value]
+    return '' if value is None else value
+
+
+def _ranked(items, sort_by, ascending, top):
+    if not sort_by:
+        if top:
+            raise click.BadParameter('requires --sort-by', param_hint='--top')
+        return items
+    return tabular.ranked(items, sort_by, top, ascending)
+
+
+def _watch(obj, changes, columns, flat, ranked):
+    if ranked:
+        raise click.BadParameter('not available with --watch', param_hint='--sort-by/--top')
+    table_class = LiveTable if sys.stdout.isatty() else DiffLog
+    table = table_class(obj, columns, flat, click.get_text_stream('stdout'))
+    for key, item in changes:
+        table.update(key, item)
+    click.get_current_context().exit(obj.kubey.kubectl.final_rc)
+
+
+def _sample(obj, interval, duration, columns, flat, ranked):
+    if ranked:
+        raise click.BadParameter('not available with --sample', param_hint='--sort-by/--top')
+    if '-c' not in sys.argv and '--columns' not in sys.argv:
+        columns = Node.SAMPLED_PRIMARY_ATTRIBUTES
+    # a terminal shows each sample as it arrives; otherwise only the final summary is written
+    table = None
+    if sys.stdout.isatty():
+        table = LiveTable(obj, columns, flat, click.get_text_stream('stdout'))
+    for nodes in obj.kubey.sample_nodes(interval, duration, obj.maximum):
+        if table:
+            for node in nodes:
+                table.update(node.name, node)
+    if not table:
+        click.echo(tabular.tabulate(obj, nodes, columns, flat))
+    click.get_current_context().exit(obj.kubey.kubectl.final_rc)
+
+
+def _each_ready_container(obj):
+    for pod in obj.kubey.each_pod(obj.maximum):
+        for container in pod.containers:
+            if not container.ready:
+                _logger.warn('skipping ' + str(container))
+                continue
+            yield pod, container
+
+
+def _target(pod, container):
+    return '{0}/{1}/{2}'.format(pod.namespace, pod.name, container.name)
+
+
+def _run_waves(kubectl, targets, run, wave_size, max_failures=None):
+    for number, beg in enumerate(range(0, len(targets), wave_size), 1):
+        if max_failures is not None and kubectl.failures > max_failures:
+            _logger.error('failure budget of %d exhausted: skipping %d remaining of %d targets' % (
+                max_failures, len(targets) - beg, len(targets)))
+            break
+        wave = targets[beg:beg + wave_size]
+        failures = kubectl.failures
+        started = time.time()
+        for pod, container in wave:
+            run(pod, container)
+        kubectl.wait()
+        _logger.info('wave %d: %d commands in %.2fs (%d failed)' % (
+            number, len(wave), time.time() - started, kubectl.failures - failures))
+
+
+def _log_rate_limiting(limiter):
+    if limiter.queued_calls:
+        _logger.info('rate limited %d of %d calls: queued %.2fs total (max %.2fs)' % (
+            limiter.queued_calls, limiter.calls, limiter.queued_seconds,
+            limiter.max_queued_seconds))
+
+
+def _write_report(obj, report, summary):
+    executions = obj.kubey.kubectl.executions
+    if report:
+        json.dump([e.as_dict() for e in executions], report, indent=2)
+        report.write('\n')
+        report.close()
+    if summary and executions:
+        # failures first, then the slowest
+        ordered = sorted(executions, key=lambda e: (not e.failed, -(e.duration or 0)))
+        failed = sum(1 for e in executions if e.failed)
+        click.echo(tabular.tabulate(obj, ordered, Execution.PRIMARY_ATTRIBUTES), err=True)
+        click.echo('{0} processes, {1} failed'.format(len(executions), failed), err=True)
+
+
+def _path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+@cli.command()
+@click.option('-g', '--group-by', type=GroupByOption(), default='phase', show_default=True,
+              help='count by image, node, phase, namespace or label:KEY')
+@click.pass_obj
+def summary(obj, group_by):
+    '''Show counts of matched pods (up to --max) and containers, their readiness and restarts
+    per group.
+    '''
+    kind, label = group_by
+    headers = [label or kind, 'pod_count', 'container_count', 'ready', 'ready_ratio', 'restarts']
+    rows = []
+    groups = obj.kubey.summarize(kind, label, obj.maximum)
+    for group, pods, containers, ready, restarts in groups:
+        ratio = '{0:.0%}'.format(float(ready) / containers) if containers else ''
+        rows.append(OpenItem(headers, [group, pods, containers, ready, ratio, restarts]))
+    click.echo(tabular.tabulate(obj, rows, headers))
+
+
+@cli.group(name='cache')
+def cache_group():
+    '''Manage cached cluster info for all contexts (given without MATCH).'''
+
+
+@cache_group.command(name='stats')
+@click.pass_obj
+def cache_stats(obj):
+    '''Show cache size, last access and hit/miss counts per context.'''
+    headers = ['context', 'files', 'size', 'last_access_time', 'hit', 'stale', 'miss', 'hit_ratio']
+    rows = []
+    for s in CacheDir(obj.cache_path).stats():
+        total = s['hit'] + s['stale'] + s['miss']
+        ratio = '{0:.0%}'.format(float(s['hit'] + s['stale']) / total) if total else ''
+        last_access = datetime.fromtimestamp(s['last_access'], timestamp.epoch.tzinfo)
+        rows.append(OpenItem(headers, [
+            s['context'], s['files'], units.bytes_in_words(s['bytes']), last_access,
+            s['hit'], s['stale'], s['miss'], ratio]))
+    click.echo(tabular.tabulate(obj, rows, headers))
+
+
+@cache_group.command(name='prune')
+@click.option('--max-mb', type=click.IntRange(0),
+              help='size to prune down to  [default: the "cache-max-mb" option]')
+@click.pass_obj
+def cache_prune(obj, max_mb):
+    '''Evict least recently used caches (and files left in HOME by older versions).'''
+    import glob
+    cache_dir = CacheDir(obj.cache_path, obj.cache_max_bytes)
+    evicted = cache_dir.prune(None if max_mb is None else max_mb * 1024 * 1024)
+    for path in glob.glob(os.path.join(os.path.expanduser('~'), '.kubey.kubey_*')):
+        evicted.append((path, os.path.getsize(path)))
+        os.remove(path)
+    click.echo('evicted {0} files ({1})'.format(
+        len(evicted), units.bytes_in_words(sum(size for _path, size in evicted))))
+
+
 # not using shlex/pipes.quote because we want glob expansion for remote calls
 def quote(arg):
     if ' ' not in arg or re.match(r'^[\'"].*[\'"]$', arg):
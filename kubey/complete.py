@@ -0,0 +1,97 @@
+'''Shell completion of MATCH from the cached names of pods, containers and nodes (see
+`NameIndex`), without running kubectl. For bash (or zsh with bashcompinit):
+
+    complete -o nospace -C kubey-complete kubey
+'''
+
+import os
+import sys
+
+from . import kubeconfig
+from .cache_dir import CacheDir
+from .selector import Alternative, compile_pattern
+
+
+# options of `kubey` that take a value (i.e. whose next word is not MATCH)
+VALUE_OPTIONS = frozenset([
+    '--cache-seconds', '--cache-ttl', '--cache-dir', '--cache-max-mb', '--request-timeout',
+    '--retries', '--hedge-after', '--qps', '--burst', '-l', '--log-level', '-c', '--context',
+    '-n', '--namespace', '-f', '--format', '-m', '--max', '--phase', '--min-restarts',
+    '--label', '--report',
+])
+
+# as selected by `kubey` when no namespace is given
+DEFAULT_NAMESPACE = 'production'
+
+
+def candidates(index, word, namespace=DEFAULT_NAMESPACE):
+    '''Completions of the last alternative in a MATCH word, one level ("NODE/", "POD/") at a time,
+    for names in namespace (a pattern, as for selecting).
+    '''
+    head, comma, prefix = word.rpartition(',')
+    in_namespace = compile_pattern('' if namespace == Alternative.ANY else namespace,
+                                   ignore_case=False)
+    completions = []
+    for name, name_namespace in index.search(prefix):
+        if name == prefix or (name_namespace and not in_namespace(name_namespace)):
+            continue
+        end = name.find('/', len(prefix))
+        completion = head + comma + (name if end < 0 else name[:end + 1])
+        if not completions or completions[-1] != completion:  # names are sorted
+            completions.append(completion)
+    return completions
+
+
+def parse_options(words):
+    '''Values of the options given before the word being completed, or None when MATCH was
+    already given (i.e. a subcommand or its arguments are being completed).
+    '''
+    options = {}
+    words = iter(words)
+    for word in words:
+        if word == '--':
+            return None
+        if not word.startswith('-'):
+            return None
+        name, equals, value = word.partition('=')
+        if name in VALUE_OPTIONS:
+            options[name] = value if equals else next(words, '')
+    return options
+
+
+def main():
+    '''Called by bash with the line being completed in COMP_LINE (and the cursor at COMP_POINT).
+    Prints one candidate per line.
+    '''
+    line = os.environ.get('COMP_LINE', '')
+    line = line[:int(os.environ.get('COMP_POINT', len(line)))]
+    words = line.split()
+    if not words or line[-1:].isspace():
+        words.append('')  # starting a new word
+    options = parse_options(words[1:-1])
+    if options is None:
+        return 0
+
+    def option(short, long_name, envvar):
+        return options.get(short) or options.get(long_name) or os.environ.get(envvar)
+
+    root = option(None, '--cache-dir', 'KUBEY_CACHE_DIR') or CacheDir.default_root()
+    if not os.path.isdir(root):
+        return 0
+    cache_dir = CacheDir(root)
+    context = option('-c', '--context', 'KUBEY_CONTEXT') or kubeconfig.current_context()
+    if not context:
+        # asking kubectl is too slow, so assume the context kubey was last used with
+        recent = cache_dir.stats()
+        if not recent:
+            return 0
+        context = recent[0]['context']
+    namespace = option('-n', '--namespace', 'KUBEY_NAMESPACE') or DEFAULT_NAMESPACE
+    index = cache_dir.name_index_for(context)
+    for completion in candidates(index, words[-1], namespace):
+        sys.stdout.write(completion + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,6 +5,7 @@ from .item import Item
 class Condition(Item):
     PRIMARY_ATTRIBUTES = ('name', 'status', 'reason')
     ATTRIBUTES = PRIMARY_ATTRIBUTES
+    FIELDS = ('type', 'status', 'reason', 'message')
 
     class UnknownStatusError(ValueError):
         pass
@@ -1,4 +1,5 @@
 from . import timestamp
+from . import units
 from .item import Item
 
 
@@ -7,9 +8,13 @@ class Container(Item):
         pass
 
     PRIMARY_ATTRIBUTES = ('name', 'ready')
-    ATTRIBUTES = PRIMARY_ATTRIBUTES + ('state', 'started_at', 'restart_count', 'image')
+    ATTRIBUTES = PRIMARY_ATTRIBUTES + ('state', 'started_at', 'restart_count', 'image',
+                                       'cpu', 'memory', 'cpu_percent_of_request')
+    FIELDS = ('name', 'image', 'terminationMessagePath', 'resources')
+    STATUS_FIELDS = ('name', 'state', 'restartCount', 'ready')
 
-    def __init__(self, config, info, status):
+    def __init__(self, config, info, status, usage=None):
+        '''Usage is the (CPU, memory) row reported by `kubectl top pod --containers`.'''
         super(Container, self).__init__(config, info)
         state_info = status['state']
         if len(state_info) != 1:
@@ -20,6 +25,19 @@ class Container(Item):
         self.restart_count = status['restartCount']
         self.ready = status['ready']
         self.image = info['image']
+        resources = info.get('resources') or {}
+        requests = resources.get('requests') or {}
+        limits = resources.get('limits') or {}
+        self.cpu_request = units.cpu_cores(requests.get('cpu'))
+        self.cpu_limit = units.cpu_cores(limits.get('cpu'))
+        self.memory_request = units.quantity_bytes(requests.get('memory'))
+        self.memory_limit = units.quantity_bytes(limits.get('memory'))
+        self.cpu = units.cpu_cores(usage[0]) if usage else None
+        self.memory = units.quantity_bytes(usage[1]) if usage else None
+
+    @property
+    def cpu_percent_of_request(self):
+        return units.percent_of(self.cpu, self.cpu_request)
 
     def __str__(self):
         highlighter = self._config.highlight_ok if self.ready else self._config.highlight_error
@@ -31,9 +49,11 @@ class Container(Item):
                 rsts = self._config.highlight_warn(' restarts:{0}'.format(self.restart_count))
             else:
                 rsts = ''
-            return 'name={0} ready={1} state={2} started={3}{4} image={5}'.format(
+            usage = '' if self.cpu is None else ' cpu={0} memory={1}'.format(
+                units.cpu_in_words(self.cpu), units.bytes_in_words(self.memory))
+            return 'name={0} ready={1} state={2} started={3}{4} image={5}{6}'.format(
                 self.name, rstr, self.state,
                 timestamp.in_words_from_now(self.started_at),
-                rsts, self.image
+                rsts, self.image, usage
             )
         return 'name=%s ready=%s' % (self.name, rstr)
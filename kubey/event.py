@@ -1,10 +1,14 @@
 from . import timestamp
 from .item import Item
+from .projection import prefixed
 
 
 class Event(Item):
     PRIMARY_ATTRIBUTES = ('last_time', 'name', 'count', 'info')
     ATTRIBUTES = PRIMARY_ATTRIBUTES + ('namespace', 'first_time', 'level', 'reason', 'message')
+    FIELDS = Item.FIELDS + ('metadata.uid', 'type', 'count', 'reason', 'message', 'firstTimestamp',
+                            'lastTimestamp', 'eventTime', 'source.host') + \
+        prefixed('involvedObject', ('kind', 'name'))
 
     def __init__(self, config, info):
         super(Event, self).__init__(config, info)
@@ -0,0 +1,100 @@
+import json
+import time
+import logging
+import sqlite3
+
+from . import projection
+from . import timestamp
+
+
+_logger = logging.getLogger(__name__)
+
+
+class EventStore(object):
+    '''History of every event seen, kept in SQLite so it outlives the (about an hour) retention of
+    events in the cluster.
+
+    Events are kept by UID, so seeing one again just updates its count and timestamps. Columns
+    that queries filter on are indexed and the rest of the event is kept as (projected) JSON.
+    '''
+
+    RETENTION_SECONDS = 7 * 24 * 3600
+
+    SCHEMA = (
+        '''CREATE TABLE IF NOT EXISTS events (
+            uid TEXT PRIMARY KEY,
+            namespace TEXT NOT NULL,
+            involved_kind TEXT,
+            involved_name TEXT,
+            host TEXT,
+            reason TEXT,
+            last_seen REAL NOT NULL,
+            info TEXT NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS events_last_seen ON events (last_seen)',
+        'CREATE INDEX IF NOT EXISTS events_namespace ON events (namespace, last_seen)',
+        'CREATE INDEX IF NOT EXISTS events_involved ON events (involved_name, last_seen)',
+        'CREATE INDEX IF NOT EXISTS events_host ON events (host, last_seen)',
+        'CREATE INDEX IF NOT EXISTS events_reason ON events (reason, last_seen)',
+    )
+
+    # filters accepted by `query`, with the column each one uses
+    FILTERS = {'namespace': 'namespace', 'involved_name': 'involved_name', 'host': 'host',
+               'reason': 'reason'}
+
+    def __init__(self, path, fields=None, retention_seconds=RETENTION_SECONDS):
+        self.path = path
+        self._fields = fields
+        self._retention_seconds = retention_seconds
+        self._db = sqlite3.connect(path, timeout=30)
+        with self._db:
+            for statement in self.SCHEMA:
+                self._db.execute(statement)
+
+    def close(self):
+        self._db.close()
+
+    def save(self, infos):
+        '''Record (or update) events and drop those older than the retention.'''
+        rows = []
+        for info in infos:
+            if self._fields:
+                info = projection.project(info, self._fields)
+            metadata = info['metadata']
+            involved = info.get('involvedObject') or {}
+            rows.append((metadata.get('uid') or '{0}/{1}'.format(metadata['namespace'],
+                                                                 metadata['name']),
+                         metadata['namespace'], involved.get('kind'), involved.get('name'),
+                         (info.get('source') or {}).get('host'), info.get('reason'),
+                         self.last_seen(info), json.dumps(info)))
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                 rows)
+            self._db.execute('DELETE FROM events WHERE last_seen < ?',
+                             (time.time() - self._retention_seconds,))
+        _logger.debug('saved %d events to %s' % (len(rows), self.path))
+
+    def query(self, since=None, **filters):
+        '''Generate the info of each event last seen after `since` (epoch seconds), oldest first,
+        restricted to exact values of any FILTERS given (e.g. `reason='BackOff'`).
+        '''
+        clauses = []
+        params = []
+        if since is not None:
+            clauses.append('last_seen >= ?')
+            params.append(since)
+        for name, value in sorted(filters.items()):
+            if value is None:
+                continue
+            clauses.append('{0} = ?'.format(self.FILTERS[name]))
+            params.append(value)
+        sql = 'SELECT info FROM events'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        for row in self._db.execute(sql + ' ORDER BY last_seen', params):
+            yield json.loads(row[0])
+
+    @staticmethod
+    def last_seen(info):
+        stamp = info.get('lastTimestamp') or info.get('eventTime') or info.get('firstTimestamp')
+        return timestamp.to_epoch(timestamp.parse(stamp)) if stamp else 0
@@ -0,0 +1,55 @@
+from . import timestamp
+from .item import Item
+
+
+class Execution(Item):
+    '''Record of a single child process spawned through KubeCtl.'''
+
+    PRIMARY_ATTRIBUTES = ('target', 'exit_code', 'duration', 'stdout_bytes', 'stderr_bytes')
+    ATTRIBUTES = PRIMARY_ATTRIBUTES + ('command', 'queued', 'start_time', 'end_time')
+
+    def __init__(self, config, target, argv, queued=0):
+        super(Execution, self).__init__(config, {})
+        self.target = target
+        self.argv = [str(a) for a in argv]
+        self.queued = round(queued, 3)  # seconds held back by rate limiting before starting
+        self.start_time = timestamp.now()
+        self.end_time = None
+        self.exit_code = None
+        self.stdout_bytes = None
+        self.stderr_bytes = None
+
+    @property
+    def command(self):
+        return ' '.join(self.argv)
+
+    @property
+    def duration(self):
+        if self.end_time is None:
+            return None
+        return round((self.end_time - self.start_time).total_seconds(), 3)
+
+    @property
+    def failed(self):
+        return self.exit_code != 0
+
+    def finish(self, exit_code, stdout_bytes=None, stderr_bytes=None):
+        self.end_time = timestamp.now()
+        self.exit_code = exit_code
+        if stdout_bytes is not None:
+            self.stdout_bytes = stdout_bytes
+        if stderr_bytes is not None:
+            self.stderr_bytes = stderr_bytes
+
+    def as_dict(self):
+        return {
+            'target': self.target,
+            'argv': self.argv,
+            'start_time': self.start_time.isoformat(),
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'duration': self.duration,
+            'queued': self.queued,
+            'exit_code': self.exit_code,
+            'stdout_bytes': self.stdout_bytes,
+            'stderr_bytes': self.stderr_bytes,
+        }
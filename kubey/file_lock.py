@@ -0,0 +1,42 @@
+import os
+
+# Windows has no `fcntl`: locking is then a no-op
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class FileLock(object):
+    '''Exclusive advisory lock held on `path` for the duration of a `with` block.'''
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def fileno(self):
+        '''Descriptor of the locked file (while held), e.g. to keep state in the file itself.'''
+        return self._fd
+
+    def is_held(self):
+        '''Report if some other holder currently has the lock (without waiting for it).'''
+        if not fcntl:
+            return False
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return False
+        except (IOError, OSError):
+            return True
+        finally:
+            os.close(fd)
+
+    def __exit__(self, *_exc_info):
+        os.close(self._fd)  # also releases the lock
+        self._fd = None
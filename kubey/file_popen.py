@@ -0,0 +1,33 @@
+import io
+import os
+import subprocess
+
+
+class FilePopen(subprocess.Popen):
+    '''Has a command write its output directly into files, so none of it passes through (or is
+    decoded by) this process.
+    '''
+
+    def __init__(self, stdout_path, stderr_path, *args, **kwargs):
+        self.stdout_path = stdout_path
+        self.stderr_path = stderr_path
+        # the child gets its own descriptors, so these are only open while it is started
+        with io.open(stdout_path, 'wb') as stdout, io.open(stderr_path, 'wb') as stderr:
+            kwargs['stdout'] = stdout
+            kwargs['stderr'] = stderr
+            super(FilePopen, self).__init__(*args, **kwargs)
+
+    @property
+    def stdout_bytes(self):
+        return _size(self.stdout_path)
+
+    @property
+    def stderr_bytes(self):
+        return _size(self.stderr_path)
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
@@ -15,6 +15,9 @@ class Item(object):
 
     COMMON_ATTRIBUTES = ('name', 'namespace', 'labels')
 
+    # JSON paths read from the info of each kind (see `projection`), so caches keep nothing else
+    FIELDS = tuple('metadata.' + a for a in COMMON_ATTRIBUTES)
+
     def __init__(self, config, info):
         self._config = config
         for attr in self.COMMON_ATTRIBUTES:
@@ -0,0 +1,40 @@
+import json
+import logging
+import subprocess
+
+from threading import Thread
+
+
+_logger = logging.getLogger(__name__)
+
+
+class JsonPopen(subprocess.Popen):
+    '''Reads the JSON document a command outputs (e.g. `kubectl get --output=json`) on a thread and
+    gives it to `obj_handler` once complete.
+    '''
+
+    def __init__(self, obj_handler, *args, **kwargs):
+        self._obj_handler = obj_handler
+        kwargs['stdout'] = subprocess.PIPE
+        super(JsonPopen, self).__init__(*args, **kwargs)
+        self.stdout_bytes = 0
+        self._stdout_thread = Thread(target=self._parse_json)
+        self._stdout_thread.start()
+
+    def wait(self):
+        result = super(JsonPopen, self).wait()
+        self._stdout_thread.join()
+        return result
+
+    def _parse_json(self):
+        with self.stdout as io:
+            data = io.read()
+        self.stdout_bytes = len(data)
+        if not data.strip():
+            return  # failed (reported by its exit status)
+        try:
+            obj = json.loads(data.decode('utf-8'))
+        except ValueError as ex:
+            _logger.warn('discarding output that is not JSON: %s' % ex)
+            return
+        self._obj_handler(obj)
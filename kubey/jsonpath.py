@@ -0,0 +1,58 @@
+'''The subset of kubectl's JSONPath used for custom columns: ".key", "['key']", "[N]" and "[*]"
+steps (optionally wrapped in "{...}"), e.g. "{.spec.containers[*].image}".
+'''
+
+import re
+
+
+_STEP = re.compile(r"\.([^.\[\]{}]+)|\[(\*|-?\d+)\]|\['([^']*)'\]")
+
+_ALL = object()
+
+
+def compile_path(path):
+    '''Returns the steps of a path, raising ValueError when it is not of the supported subset.'''
+    path = path.strip()
+    if path.startswith('{') and path.endswith('}'):
+        path = path[1:-1]
+    steps = []
+    pos = 0
+    while pos < len(path):
+        m = _STEP.match(path, pos)
+        if not m:
+            raise ValueError('unsupported JSONPath at "{0}": {1}'.format(path[pos:], path))
+        key, index, quoted = m.groups()
+        if index is not None:
+            steps.append(_ALL if index == '*' else int(index))
+        else:
+            steps.append(quoted if quoted is not None else key)
+        pos = m.end()
+    if not steps:
+        raise ValueError('empty JSONPath')
+    return steps
+
+
+def find(obj, steps):
+    '''List every value at the path (several only when the path has "[*]").'''
+    found = [obj]
+    for step in steps:
+        matched = []
+        for value in found:
+            if step is _ALL:
+                if isinstance(value, list):
+                    matched.extend(value)
+                elif isinstance(value, dict):
+                    matched.extend(value.values())
+            elif isinstance(step, int):
+                if isinstance(value, list) and -len(value) <= step < len(value):
+                    matched.append(value[step])
+            elif isinstance(value, dict) and step in value:
+                matched.append(value[step])
+        found = matched
+    return found
+
+
+def default_name(steps):
+    '''A column name for a path (its last key).'''
+    keys = [s for s in steps if not (s is _ALL or isinstance(s, int))]
+    return keys[-1] if keys else 'value'
@@ -0,0 +1,26 @@
+import io
+import os
+import re
+
+
+# top level "current-context: NAME" in YAML (kubectl itself must be asked if this does not match)
+CURRENT_CONTEXT_RE = re.compile(r'^current-context:[ \t]*("[^"]*"|\'[^\']*\'|[^\s#]*)',
+                                re.MULTILINE)
+
+
+def current_context():
+    '''Read the current context as kubectl would (i.e. from the first file in KUBECONFIG that sets
+    one) without running it. Returns None when it can not be found this way.
+    '''
+    paths = os.environ.get('KUBECONFIG') or \
+        os.path.join(os.path.expanduser('~'), '.kube', 'config')
+    for path in paths.split(os.pathsep):
+        try:
+            with io.open(path, encoding='utf-8') as f:
+                m = CURRENT_CONTEXT_RE.search(f.read())
+        except (IOError, OSError, ValueError):
+            continue
+        context = m and m.group(1).strip('"\'')
+        if context:
+            return context
+    return None
@@ -1,28 +1,144 @@
+import os
 import sys
 import logging
 import subprocess
 import json
+import random
+import signal as signal_module
+import time
+from threading import Thread, Timer
 from configstruct import OpenStruct
 
+from . import kubeconfig
 from .background_popen import BackgroundPopen
+from .broadcaster import Broadcaster
+from .execution import Execution
+from .file_popen import FilePopen
+from .json_popen import JsonPopen
 from .table_row_popen import TableRowPopen
 
 
+# Python 3 compatibility (renamed `Queue` module):
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+# Python 2 compatibility (no `shutil.which`):
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+# children are started in process groups of their own: by `process_group` (Python 3.11+) or
+# otherwise by `start_new_session` (not `preexec_fn`, which is unsafe once threads are running), so
+# Python 2 and Windows (which has no `killpg`) signal children individually
+if not hasattr(os, 'killpg') or sys.version_info < (3, 2):
+    _OWN_GROUP = None
+elif sys.version_info >= (3, 11):
+    _OWN_GROUP = {'process_group': 0}
+else:
+    _OWN_GROUP = {'start_new_session': True}
+SIGKILL = getattr(signal_module, 'SIGKILL', None)
+
 _logger = logging.getLogger(__name__)
 
 
+def _check_output(cl, timeout=None):
+    '''`subprocess.check_output` killing the child after `timeout` seconds, also on Python 2 (which
+    has no `timeout` argument): it then fails as if the child exited on its own.
+    '''
+    if not timeout:
+        return subprocess.check_output(cl)
+    if hasattr(subprocess, 'TimeoutExpired'):
+        return subprocess.check_output(cl, timeout=timeout)
+    proc = subprocess.Popen(cl, stdout=subprocess.PIPE)
+    timer = Timer(timeout, KubeCtl._signal, [proc, None])
+    timer.daemon = True
+    timer.start()
+    try:
+        output, _ = proc.communicate()
+    finally:
+        timer.cancel()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cl, output)
+    return output
+
+
+class JsonLineDecoder(object):
+    '''Decodes each object of a stream of JSON objects (e.g. `--watch --output=json`), fed one
+    line at a time. Objects are indented by kubectl, so only a line starting with a closing brace
+    may end one.
+    '''
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+
+    def feed(self, line):
+        '''Returns the object completed by line (bytes) or None.'''
+        self._buf += line.decode('utf-8')
+        if not line.startswith(b'}'):
+            return None
+        try:
+            obj, _end = self._decoder.raw_decode(self._buf)
+        except ValueError:
+            return None
+        self._buf = ''
+        return obj
+
+
 class KubeCtl(object):
-    def __init__(self, context=None, config=None):
-        val = subprocess.check_output('which kubectl', shell=True).strip()
-        self._kubectl = val.decode('utf-8')
+    class NotFoundError(EnvironmentError):
+        def __init__(self):
+            super(KubeCtl.NotFoundError, self).__init__('kubectl not found in PATH')
+
+    POLL_SECONDS = 0.05
+    KILL_SECONDS = 2  # given to signaled children to exit before they are killed
+    KILLED_SECONDS = 0.25  # given to killed children to be reaped
+    REAP_AFTER = 64  # children spawned before finished ones are first looked for
+    BACKOFF_SECONDS = 0.5
+    BACKOFF_MAX_SECONDS = 10
+
+    # only these are safe to retry or to issue more than once concurrently
+    IDEMPOTENT_COMMANDS = ('api-resources', 'api-versions', 'cluster-info', 'config', 'describe',
+                           'explain', 'get', 'top', 'version')
+
+    RETRYABLE_ERRORS = (subprocess.CalledProcessError,) + \
+        ((subprocess.TimeoutExpired,) if hasattr(subprocess, 'TimeoutExpired') else ())
+
+    def __init__(self, context=None, config=None, timeout=None, retries=0, hedge_after=None):
+        '''Captured calls (e.g. `call_json`) are killed after `timeout` seconds. Idempotent ones are
+        retried up to `retries` times with jittered exponential backoff and, when `hedge_after`
+        seconds pass without a response, a duplicate request is raced against the first.
+        '''
+        self._kubectl = None
         self._context = context
         self._config = config
         self._processes = []
         self._threads = []
         self.final_rc = 0
+        self.failures = 0
+        self.executions = None
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge_after = hedge_after
+        self.rate_limiter = None
+        self._running = {}
+        self._reap_after = self.REAP_AFTER
+
+    @property
+    def executable(self):
+        if self._kubectl is None:
+            self._kubectl = which('kubectl')
+            if not self._kubectl:
+                raise self.NotFoundError()
+        return self._kubectl
 
     @property
     def context(self):
+        if self._context is None:
+            self._context = kubeconfig.current_context()
         if self._context is None:
             ctx = subprocess.check_output(self._commandline('config', 'current-context')).strip()
             self._context = ctx.decode('utf-8')  # returns a bytestring
@@ -38,53 +154,312 @@ class KubeCtl(object):
         self.call_async(cmd, *args)
         return self.wait()
 
+    def record_executions(self):
+        '''Keep an Execution for every child spawned from now on (see `executions`).'''
+        if self.executions is None:
+            self.executions = []
+
     def call_capture(self, cmd, *args):
-        cl = self._commandline(cmd, *args)
-        val = subprocess.check_output(cl)
-        return val.decode('utf-8')
+        return self.capture_commandline(self._commandline(cmd, *args),
+                                        cmd in self.IDEMPOTENT_COMMANDS)
+
+    def capture_commandline(self, cl, idempotent=False):
+        '''Output of a full command line (e.g. from `json_commandline`), requested with the timeout
+        and rate limiting of every captured call (and retries and hedging when idempotent).
+        '''
+        attempts = 1 + (self.retries if idempotent else 0)
+        for attempt in range(attempts):
+            try:
+                return self._capture(cl, idempotent).decode('utf-8')
+            except self.RETRYABLE_ERRORS as ex:
+                if attempt + 1 >= attempts:
+                    raise
+                delay = self._backoff(attempt)
+                _logger.warn('%s => %s (retrying in %.1fs)' % (' '.join(cl), ex, delay))
+                time.sleep(delay)
+
+    def json_commandline(self, cmd, *args):
+        '''Full command line that `call_json` would run (e.g. for running it elsewhere).'''
+        return self._commandline(cmd, '--output=json', *args)
 
     def call_json(self, cmd, *args):
         return json.loads(self.call_capture(cmd, '--output=json', *args))
 
-    def call_async(self, cmd, *args):
+    def call_watch(self, cmd, *args):
+        '''Generate (type, object) for each change streamed by `cmd --watch` until it exits (the
+        current objects are reported as ADDED first).
+        '''
+        cl = self._commandline(cmd, '--watch', '--output-watch-events', '--output=json', *args)
+        proc = self._spawn(subprocess.Popen, cl, stdout=subprocess.PIPE)
+        decoder = JsonLineDecoder()
+        eof = False
+        try:
+            for line in iter(proc.stdout.readline, b''):
+                event = decoder.feed(line)
+                if event is None:
+                    continue
+                if event.get('type') == 'ERROR':
+                    _logger.warn('%s => %s' % (' '.join(cl), event['object'].get('message')))
+                    continue
+                yield event['type'], event['object']
+            eof = True
+        finally:
+            if (cl, proc) in self._processes:
+                self._processes.remove((cl, proc))
+                if not eof and proc.poll() is None:
+                    proc.kill()  # consumer stopped early, so not a failure
+                    self._stopped(proc, proc.wait())
+                else:
+                    self._finish(cl, proc)
+            # otherwise it was already reaped (or killed)
+
+    def call_async(self, cmd, *args, **kwargs):
         cl = self._commandline(cmd, *args)
-        proc = subprocess.Popen(cl)
-        self._processes.append((cl, proc))
+        interactive = kwargs.pop('interactive', False)
+        if self.executions is not None and not interactive:
+            # proxy output (as bytes, unmodified) only so they can be counted for the report
+            out_handler = BackgroundPopen.raw_handler(sys.stdout)
+            err_handler = BackgroundPopen.raw_handler(sys.stderr)
+            self._spawn(BackgroundPopen, cl, out_handler, err_handler, raw=True, **kwargs)
+        else:
+            # an interactive child must stay in the foreground process group to use the terminal
+            self._spawn(subprocess.Popen, cl, own_group=not interactive, **kwargs)
+        return 0
+
+    def call_lines(self, line_handler, err_prefix, cmd, *args, **kwargs):
+        '''Start a command giving each line of its output to line_handler (from another thread, as
+        bytes when `raw`) and showing errors with a prefix.
+        '''
+        err_handler = BackgroundPopen.prefix_handler('[ERR] ' + err_prefix, sys.stderr)
+        if kwargs.get('raw'):
+            err_handler = BackgroundPopen.decoding_handler(err_handler)
+        self.start(line_handler, err_handler, cmd, *args, **kwargs)
         return 0
 
-    def call_prefix(self, prefix, cmd, *args):
+    def start(self, out_handler, err_handler, cmd, *args, **kwargs):
+        '''Start a command giving each line of its output and errors to the handlers (from other
+        threads) and return the child, e.g. to `stop` it on its own.
+        '''
+        cl = self._commandline(cmd, *args)
+        return self._spawn(BackgroundPopen, cl, out_handler, err_handler, **kwargs)
+
+    def stop(self, proc):
+        '''Kill a child started by `start` (unless it already exited) and reap it, without
+        counting it as a failure.
+        '''
+        self._processes = [(cl, p) for cl, p in self._processes if p is not proc]
+        self._signal(proc, None)
+        self._stopped(proc, proc.wait())
+
+    def call_to_files(self, stdout_path, stderr_path, cmd, *args, **kwargs):
+        '''Start a command writing its output (as is) into files.'''
+        cl = self._commandline(cmd, *args)
+        self._spawn(FilePopen, cl, stdout_path, stderr_path, **kwargs)
+        return 0
+
+    def call_prefix(self, prefix, cmd, *args, **kwargs):
         out_handler = BackgroundPopen.prefix_handler(prefix, sys.stdout)
         err_handler = BackgroundPopen.prefix_handler('[ERR] ' + prefix, sys.stderr)
         cl = self._commandline(cmd, *args)
-        proc = BackgroundPopen(out_handler, err_handler, cl)
-        self._processes.append((cl, proc))
+        self._spawn(BackgroundPopen, cl, out_handler, err_handler, **kwargs)
         return 0
 
-    def call_table_rows(self, row_handler, cmd, *args):
+    def call_table_rows(self, row_handler, cmd, *args, **kwargs):
         cl = self._commandline(cmd, *args)
-        proc = TableRowPopen(row_handler, cl)
-        self._processes.append((cl, proc))
+        self._spawn(TableRowPopen, cl, row_handler, **kwargs)
         return 0
 
-    def wait(self):
-        procs = self._processes
-        self._process = []
-        for cl, proc in procs:
-            self._check(cl, proc.wait())
+    def call_json_async(self, obj_handler, cmd, *args, **kwargs):
+        cl = self.json_commandline(cmd, *args)
+        self._spawn(JsonPopen, cl, obj_handler, **kwargs)
+        return 0
+
+    def wait(self, timeout=None):
+        '''Wait for every child to exit, killing any still running after `timeout` seconds (and
+        counting them as failed).
+        '''
+        if timeout:
+            for cl, proc in self._reap_by(self._processes, time.time() + timeout):
+                _logger.warn('%s => no response after %ss (killing)' % (' '.join(cl), timeout))
+                self._signal(proc, None)
+        # children stay listed while waiting so that an interrupt can still kill them
+        for cl, proc in list(self._processes):
+            self._finish(cl, proc)
+        self._processes = []
         return self.final_rc
 
-    def kill(self, signal=None):
+    def throttle(self, limit):
+        '''Block until fewer than `limit` children are still running.'''
+        while limit and len(self._processes) >= limit:
+            if not self._reap():
+                time.sleep(self.POLL_SECONDS)
+
+    def kill(self, signal=None, deadline=KILL_SECONDS):
+        '''Send signal to every child at once (or kill them when no signal is given) and reap them,
+        killing any still running after `deadline` seconds.
+        '''
         procs = self._processes
-        self._process = []
-        for cl, proc in procs:
+        self._processes = []
+        for _cl, proc in procs:
+            self._signal(proc, signal)
+        running = self._reap_by(procs, time.time() + deadline) if signal else procs
+        for cl, proc in running:
             if signal:
+                _logger.debug('%s => still running after %ss (killing)' % (' '.join(cl), deadline))
+            self._signal(proc, None)
+        # killed children exit at once (but one being waited for by an interrupted `wait` can only
+        # be reaped by it)
+        for _cl, proc in self._reap_by(running, time.time() + self.KILLED_SECONDS):
+            self._stopped(proc, None)  # still reported, with its exit status unknown
+
+    @staticmethod
+    def _signal(proc, signal):
+        if proc.poll() is not None:
+            return  # reaped, so its ID may already be reused
+        try:
+            if getattr(proc, 'process_group', None):
+                os.killpg(proc.process_group, signal or SIGKILL)  # includes its own children
+            elif signal:
                 proc.send_signal(signal)
             else:
                 proc.kill()
-            proc.wait()
+        except OSError:
+            pass  # already gone
+
+    def _spawn(self, popen, cl, *popen_args, **kwargs):
+        # a broadcaster is fed through a pipe by its own thread; anything else goes to popen as-is
+        target = kwargs.pop('target', None)
+        stdin = kwargs.get('stdin')
+        if isinstance(stdin, Broadcaster):
+            kwargs['stdin'] = subprocess.PIPE
+        # each child leads its own process group so that it is signaled (by `kill`) along with
+        # anything it started, and only once (not also by the terminal, so the CLI passes on
+        # hangups too)
+        own_group = kwargs.pop('own_group', True) and _OWN_GROUP is not None
+        if own_group:
+            kwargs.update(_OWN_GROUP)
+        execution = self._record(target, cl, self._pace())
+        proc = popen(*(popen_args + (cl,)), **kwargs)
+        if own_group:
+            proc.process_group = proc.pid
+        if isinstance(stdin, Broadcaster):
+            stdin.attach(proc.stdin)
+        if execution:
+            self._running[proc] = execution
+        self._processes.append((cl, proc))
+        if len(self._processes) >= self._reap_after:
+            # those already finished are collected as more are started, so that a long running
+            # session keeps only live children (at amortized constant cost per spawn)
+            self._reap()
+            self._reap_after = max(self.REAP_AFTER, 2 * len(self._processes))
+        return proc
+
+    def _capture(self, cl, hedge):
+        if not hedge or not self.hedge_after:
+            return self._check_output(cl)
+        results = Queue()
+
+        def attempt():
+            try:
+                results.put((True, self._check_output(cl)))
+            except Exception as ex:
+                results.put((False, ex))
+
+        def start():
+            thread = Thread(target=attempt)
+            thread.daemon = True  # a losing request is left to finish (or time out) on its own
+            thread.start()
+
+        start()
+        pending = 1
+        hedged = False
+        while True:
+            try:
+                ok, val = results.get(timeout=None if hedged else self.hedge_after)
+            except Empty:
+                _logger.info('%s => no response after %.1fs (hedging)' % (
+                    ' '.join(cl), self.hedge_after))
+                start()
+                pending += 1
+                hedged = True
+                continue
+            pending -= 1
+            if ok:
+                return val
+            if pending < 1:
+                raise val
+
+    def _check_output(self, cl):
+        execution = self._record(None, cl, self._pace())
+        try:
+            val = _check_output(cl, self.timeout)
+        except subprocess.CalledProcessError as ex:
+            if execution:
+                execution.finish(ex.returncode, len(ex.output or b''))
+            raise
+        except Exception:
+            if execution:
+                execution.finish(None)
+            raise
+        if execution:
+            execution.finish(0, len(val))
+        return val
+
+    @classmethod
+    def _backoff(cls, attempt):
+        # "full jitter": spreads retries from many processes across the whole backoff window
+        return random.uniform(0, min(cls.BACKOFF_MAX_SECONDS, cls.BACKOFF_SECONDS * 2 ** attempt))
+
+    def _pace(self):
+        return self.rate_limiter.acquire() if self.rate_limiter else 0
+
+    def _record(self, target, cl, queued=0):
+        if self.executions is None:
+            return None
+        execution = Execution(None, target, cl, queued)
+        self.executions.append(execution)
+        return execution
+
+    def _finish(self, cl, proc):
+        rc = proc.wait()
+        self._stopped(proc, rc)
+        return self._check(cl, rc)
+
+    def _stopped(self, proc, rc):
+        execution = self._running.pop(proc, None)
+        if execution:
+            execution.finish(rc, getattr(proc, 'stdout_bytes', None),
+                             getattr(proc, 'stderr_bytes', None))
+
+    def _reap_by(self, procs, expires):
+        # polled, as an interrupted `wait` may be blocked waiting for one of them
+        while True:
+            running = []
+            for cl, proc in procs:
+                rc = proc.poll()
+                if rc is None:
+                    running.append((cl, proc))
+                else:
+                    self._stopped(proc, rc)
+            if not running or time.time() >= expires:
+                return running
+            procs = running
+            time.sleep(self.POLL_SECONDS)
+
+    def _reap(self):
+        running = []
+        reaped = 0
+        for cl, proc in self._processes:
+            if proc.poll() is None:
+                running.append((cl, proc))
+                continue
+            self._finish(cl, proc)
+            reaped += 1
+        self._processes = running
+        return reaped
 
     def _commandline(self, command, *args):
-        commandline = [self._kubectl]
+        commandline = [self.executable]
         if self._context:
             commandline.extend(['--context', self._context])
         commandline.append(command)
@@ -95,5 +470,6 @@ class KubeCtl(object):
     def _check(self, cl, rc):
         if rc != 0:
             self.final_rc = rc
+            self.failures += 1
             _logger.warn('%s => exit status: %d' % (' '.join(cl), rc))
         return rc
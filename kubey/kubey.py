@@ -1,11 +1,14 @@
-import os
-import re
 import logging
 import time
 
+from . import projection
+from . import refresh
 from . import timestamp
 from .kubectl import KubeCtl
 from .cache import Cache
+from .cache_dir import CacheDir
+from .rate_limiter import RateLimiter
+from .selector import Selector
 from .pod import Pod
 from .node import Node
 from .event import Event
@@ -20,37 +23,113 @@ class Kubey(object):
 
     ANY = '.'
 
+    # bounds the memory held per node when sampling usage for a long time
+    MAX_SAMPLES = 1440
+
     def __init__(self, config):
+        '''Nothing is run, read or created until first needed (so that startup stays quick).'''
         self._config = config
-        self.kubectl = KubeCtl(config.context)
-        self._split_match()
-        self._namespaces = self._cache('namespaces')
-        self._nodes_cache = self._cache('nodes')
-        self._pods_cache = self._cache('pods', '--all-namespaces')
-        self._set_namespace()
+        self.kubectl = KubeCtl(config.context, timeout=config.request_timeout,
+                               retries=config.retries or 0, hedge_after=config.hedge_after)
+        self._cache_dir = None
+        self._caches = {}
+        if config.qps:
+            self.kubectl.rate_limiter = RateLimiter(
+                self._state_path('rate'), config.qps, config.burst or 1)
+        self.selector = Selector(
+            config.match, '' if config.namespace == self.ANY else config.namespace,
+            phases=config.phases, ready=config.ready, min_restarts=config.min_restarts,
+            labels=config.labels)
+        # FIXME: namespace validation!
+        # validation_query = 'items[?contains(metadata.name,\'%s\')].status.phase' % (
+        #     self._config.namespace)
+        # if not jmespath.search(validation_query, self._namespaces.obj()):
+        #     raise self.UnknownNamespace(self._config.namespace)
         self._pods = None
         self._nodes = None
+        self._event_store = None
 
     def __repr__(self):
-        return "<Kubey: context=%s namespace=%s match=%s/%s/%s>" % (
-            self.kubectl.context, self._config.namespace,
-            self._node_re.pattern, self._pod_re.pattern, self._container_re.pattern)
+        return "<Kubey: context=%s namespace=%s match=%r>" % (
+            self.kubectl.context, self._config.namespace, self.selector)
 
-    def each_pod(self, limit=None):
+    def close(self):
+        '''Save what is only kept in memory until finished (e.g. cache statistics).'''
+        if self._cache_dir is not None:
+            self._cache_dir.flush()
+
+    def each_pod(self, limit=None, include_top_info=False):
         if self._pods:
             for pod in self._pods:
                 yield pod
             return
+        # usage is collected by another process while the pods are read
+        top_info = self._start_top_pod_info() if include_top_info else None
+        pods_info = self._pods_cache.obj()['items']
+        if top_info is not None:
+            self.kubectl.wait(self.kubectl.timeout)
         self._pods = []
-        for info in self._pods_cache.obj()['items']:
-            if not self._pod_matches(info):
+        for info in pods_info:
+            container_selector = self.selector.match_pod(info)
+            if not container_selector:
                 continue
-            pod = Pod(self._config, info, self._container_re.search)
+            metadata = info['metadata']
+            usage = top_info.get((metadata['namespace'], metadata['name'])) if top_info else None
+            pod = Pod(self._config, info, container_selector, usage)
             self._pods.append(pod)
             yield pod
             if self._exceeded_max(len(self._pods), limit):
                 break
 
+    def summarize(self, group_by, label=None, limit=None):
+        '''Count matched pods (up to `limit`) by `group_by` (image, node, phase, namespace or
+        label).
+
+        Returns [group, pods, containers, ready containers, restarts] for each group, computed in
+        one pass over the cached pods info (no Pod objects are built). Grouping by image counts
+        each container in its image's group, and a pod once in every group its images are in.
+        Pods without a value (missing or empty) are counted together as "<none>".
+        '''
+        groups = {}
+        matched = 0
+        for info in self._pods_cache.obj()['items']:
+            container_selector = self.selector.match_pod(info)
+            if not container_selector:
+                continue
+            if self._exceeded_max(matched, limit):
+                break
+            matched += 1
+            statuses = dict((s['name'], s) for s in info['status'].get('containerStatuses', []))
+            if group_by == 'image':
+                keyed = [(c['image'], c['name']) for c in info['spec']['containers']]
+            else:
+                if group_by == 'node':
+                    key = info['spec'].get('nodeName')
+                elif group_by == 'phase':
+                    key = info['status'].get('phase')
+                elif group_by == 'namespace':
+                    key = info['metadata']['namespace']
+                else:
+                    key = (info['metadata'].get('labels') or {}).get(label)
+                keyed = [(key, c['name']) for c in info['spec']['containers']]
+            counted = set()
+            for key, name in keyed:
+                if not container_selector(name):
+                    continue
+                key = key or None
+                counters = groups.get(key)
+                if counters is None:
+                    counters = groups[key] = [key or '<none>', 0, 0, 0, 0]
+                if key not in counted:
+                    counted.add(key)
+                    counters[1] += 1
+                counters[2] += 1
+                status = statuses.get(name)
+                if status:
+                    counters[3] += 1 if status.get('ready') else 0
+                    counters[4] += status.get('restartCount', 0)
+        return sorted(groups.values(), key=lambda c: (-c[1], c[0]))
+
     def each_node(self, limit=None, include_top_info=False):
         if self._nodes:
             for node in self._nodes:
@@ -59,7 +138,7 @@ class Kubey(object):
         top_info = self._get_top_node_info() if include_top_info else {}
         self._nodes = []
         for info in self._nodes_cache.obj()['items']:
-            if not self._node_matches(info):
+            if not self.selector.match_node(info):
                 continue
             node = Node(self._config, info, self.each_pod(), top_info)
             if self._config.namespace != self.ANY and len(node.pods) == 0:
@@ -69,14 +148,60 @@ class Kubey(object):
             if self._exceeded_max(len(self._nodes), limit):
                 break
 
+    def watch_pods(self):
+        '''Generate (key, pod) as matched pods change, with None once one is gone or no longer
+        matches. Only the pods that changed are parsed, so cost follows the rate of change.
+        '''
+        for change, info in self._watch('pods', '--all-namespaces'):
+            metadata = info['metadata']
+            container_selector = change != 'DELETED' and self.selector.match_pod(info)
+            pod = Pod(self._config, info, container_selector) if container_selector else None
+            yield (metadata['namespace'], metadata['name']), pod
+
+    def watch_nodes(self, include_top_info=False):
+        '''Generate (name, node) as matched nodes change, like `watch_pods` (usage is only
+        sampled once at the start).
+        '''
+        top_info = self._get_top_node_info() if include_top_info else {}
+        for change, info in self._watch('nodes'):
+            name = info['metadata']['name']
+            node = None
+            if change != 'DELETED' and self.selector.match_node(info):
+                node = Node(self._config, info, self.each_pod(), top_info)
+                if self._config.namespace != self.ANY and len(node.pods) == 0:
+                    node = None
+            yield name, node
+
+    def sample_nodes(self, interval, duration, limit=None):
+        '''Generate the matched nodes after each sample of their usage, taken every `interval`
+        seconds for `duration` seconds. Nodes are only built once: each sample just runs `top`.
+        '''
+        nodes = list(self.each_node(limit, True))
+        for node in nodes:
+            node.start_sampling(min(self.MAX_SAMPLES, int(duration / interval) + 1))
+        yield nodes
+        start = time.time()
+        ticks = 0
+        while True:
+            ticks += 1
+            next_sample = start + ticks * interval
+            if next_sample - start > duration:
+                break
+            time.sleep(max(0, next_sample - time.time()))
+            top_info = self._get_top_node_info()
+            for node in nodes:
+                node.sample(top_info)
+            yield nodes
+
     def each_event(self, limit=None, watch_seconds=10):
         count = 0
         args = ['events', '--all-namespaces', '--sort-by=lastTimestamp']
         last_ts = youngest_ts = timestamp.epoch
         while True:
             json = self.kubectl.call_json('get', *args)
+            self.event_store.save(json['items'])
             for info in json['items']:
-                if not self._event_matches(info):
+                if not self.selector.match_event(info):
                     continue
                 last_ts = timestamp.parse(info['lastTimestamp'])
                 if last_ts <= youngest_ts:
@@ -90,6 +215,36 @@ class Kubey(object):
             youngest_ts = last_ts
             time.sleep(watch_seconds)
 
+    def each_past_event(self, since=None, limit=None, refresh=True):
+        '''Generate matched events from the local history (oldest first), last seen after `since`
+        (epoch seconds). Unless `refresh` is false, current events are first added to it.
+        '''
+        if refresh:
+            json = self.kubectl.call_json('get', 'events', '--all-namespaces')
+            self.event_store.save(json['items'])
+        count = 0
+        for info in self.event_store.query(since, **self.selector.event_filters()):
+            if not self.selector.match_event(info, involved=True):
+                continue
+            yield Event(self._config, info)
+            count += 1
+            if self._exceeded_max(count, limit):
+                break
+
+    @property
+    def cache_dir(self):
+        if self._cache_dir is None:
+            self._cache_dir = CacheDir(self._config.cache_path, self._config.cache_max_bytes)
+        return self._cache_dir
+
+    @property
+    def event_store(self):
+        if self._event_store is None:
+            from .event_store import EventStore  # sqlite is only loaded for event history
+            path = self.cache_dir.path_for(self.kubectl.context, 'events', '.sqlite')
+            self._event_store = EventStore(path, Event.FIELDS)
+        return self._event_store
+
     # Private
 
     @staticmethod
@@ -99,52 +254,72 @@ class Kubey(object):
             return True
         return False
 
-    def _set_namespace(self):
-        ns = '' if self._config.namespace == self.ANY else self._config.namespace
-        self._namespace_re = re.compile(ns)
-        if self._config.namespace == self.ANY:
-            return
-        # FIXME: namespace validation!
-        # validation_query = 'items[?contains(metadata.name,\'%s\')].status.phase' % (
-        #     self._config.namespace)
-        # if not jmespath.search(validation_query, self._namespaces.obj()):
-        #     raise self.UnknownNamespace(self._config.namespace)
+    def _watch(self, resource, *args):
+        while True:
+            for change in self.kubectl.call_watch('get', resource, *args):
+                yield change
+            if self.kubectl.final_rc != 0:
+                return
+            # the server ends watches periodically: the new one reports everything as ADDED again
+            _logger.debug('restarting watch of %s' % resource)
 
-    def _split_match(self):
-        match_items = self._config.match.split('/', 2)
-        node = match_items.pop(0) if len(match_items) > 2 else ''
-        pod = match_items.pop(0)
-        container = match_items.pop(0) if len(match_items) > 0 else ''
-        if node == self.ANY:
-            node = ''
-        if pod == self.ANY:
-            pod = ''
-        if container == self.ANY:
-            container = ''
-        self._node_re = re.compile(node, re.IGNORECASE)
-        self._pod_re = re.compile(pod, re.IGNORECASE)
-        self._container_re = re.compile(container, re.IGNORECASE)
-
-    def _cache(self, name, *args):
-        cache_fn = os.path.join(
-            self._config.cache_path, '.%s_%s_%s' % (__name__, self.kubectl.context, name)
-        )
+    @property
+    def _namespaces(self):
+        if 'namespaces' not in self._caches:
+            self._caches['namespaces'] = self._cache('namespaces')
+        return self._caches['namespaces']
+
+    @property
+    def _nodes_cache(self):
+        if 'nodes' not in self._caches:
+            self._caches['nodes'] = self._cache(
+                'nodes', fields=projection.prefixed('items', Node.FIELDS))
+        return self._caches['nodes']
+
+    @property
+    def _pods_cache(self):
+        if 'pods' not in self._caches:
+            self._caches['pods'] = self._cache(
+                'pods', '--all-namespaces', fields=projection.prefixed('items', Pod.FIELDS))
+        return self._caches['pods']
+
+    def _state_path(self, name):
+        return self.cache_dir.path_for(self.kubectl.context, name)
+
+    def _cache(self, name, *args, **kwargs):
+        seconds, max_age = (self._config.cache_ttls or {}).get(
+            name, (self._config.cache_seconds, None))
         return Cache(
-            cache_fn, self._config.cache_seconds, self.kubectl.call_json, 'get', name, *args
+            self.cache_dir.cache_path_for(self.kubectl.context, name), seconds,
+            self.kubectl.call_json, 'get', name, *args,
+            name=name, max_age=max_age,
+            refresh_argv=refresh.refresh_argv(
+                self.kubectl, self.kubectl.json_commandline('get', name, *args)),
+            on_access=self._record_cache_access,
+            fields=kwargs.get('fields')
         )
 
-    def _pod_matches(self, info):
-        return (self._namespace_re.search(info['metadata']['namespace']) and
-                self._node_re.search(info['spec'].get('nodeName', '')) and
-                self._pod_re.search(info['metadata']['name']))
+    def _record_cache_access(self, name, outcome):
+        self.cache_dir.record(self.kubectl.context, name, outcome)
 
-    def _node_matches(self, info):
-        return self._node_re.search(info['metadata']['name'])
+    def _start_top_pod_info(self):
+        '''Start collecting usage of every container, indexed by (namespace, pod name) and then
+        container name, into the returned dict (complete once the kubectl process is waited on,
+        with the request timeout).
+        '''
+        info = {}
+        columns = {}
 
-    def _event_matches(self, info):
-        return (self._namespace_re.search(info['metadata']['namespace']) and
-                self._node_re.search(info['source'].get('host', '')) and
-                self._pod_re.search(info['metadata']['name']))
+        def add_info(i, row):
+            if i == 1:
+                columns.update((c.split('(')[0], j) for j, c in enumerate(row))
+                return
+            key = (row[columns['NAMESPACE']], row[columns['POD']])
+            info.setdefault(key, {})[row[columns['NAME']]] = (
+                row[columns['CPU']], row[columns['MEMORY']])
+
+        self.kubectl.call_table_rows(add_info, 'top', 'pod', '--all-namespaces', '--containers')
+        return info
 
     def _get_top_node_info(self):
         info = {}
@@ -155,5 +330,5 @@ class Kubey(object):
             info[row[0]] = row[1:]
 
         self.kubectl.call_table_rows(add_info, 'top', 'node')
-        self.kubectl.wait()
+        self.kubectl.wait(self.kubectl.timeout)  # bounded like any request (e.g. each sample)
         return info
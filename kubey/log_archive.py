@@ -0,0 +1,199 @@
+import io
+import os
+import re
+import time
+import gzip
+import logging
+import threading
+from collections import OrderedDict
+
+
+_logger = logging.getLogger(__name__)
+
+
+class LogArchive(object):
+    '''Files under a directory that each receive the lines of one stream (e.g. the log of a
+    container), optionally compressed and rotated by size or age.
+
+    Lines are buffered per stream and written in large chunks (or by a background thread once
+    they have waited `FLUSH_SECONDS`). Only `max_open` files are open at once: the least recently
+    written one is closed to make room and later reopened for appending (a new gzip member or zstd
+    frame, which decompress as one). So memory and file descriptors are bounded however many
+    streams there are. Streams are compressed and written concurrently.
+    '''
+
+    SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+    BUFFER_BYTES = 64 * 1024  # per stream
+    FLUSH_SECONDS = 5  # longest a line is buffered
+    GZIP_LEVEL = 6
+    ZSTD_LEVEL = 3
+
+    def __init__(self, root, compression=None, rotate_bytes=None, rotate_seconds=None,
+                 max_open=64):
+        if compression not in self.SUFFIXES:
+            raise ValueError('unknown compression: {0}'.format(compression))
+        if compression == 'zstd':
+            import zstandard  # optional, so only required when asked for
+            self._zstd = zstandard.ZstdCompressor(level=self.ZSTD_LEVEL)
+        self.root = root
+        self.compression = compression
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.max_open = max_open
+        self.closed = False
+        self._streams = []
+        self._open = OrderedDict()  # stream => None, least recently written first
+        self._lock = threading.Lock()  # of the streams and open files (not of writing to them)
+        self._stopped = threading.Event()
+        flusher = threading.Thread(target=self._flush_periodically)
+        flusher.daemon = True
+        flusher.start()
+
+    def stream(self, *names):
+        '''Handler of lines (bytes, as given by `BackgroundPopen` when `raw`) for a stream kept in
+        files named by the path names (e.g. namespace, pod and container) as "NAME.NNNN.log" (with
+        a suffix for the compression), numbered after any left by earlier runs.
+        '''
+        stream = _Stream(self, os.path.join(self.root, *names))
+        with self._lock:
+            self._streams.append(stream)
+        return stream.write
+
+    def close(self):
+        '''Write everything buffered and close all files. Lines arriving later are written
+        directly.
+        '''
+        with self._lock:
+            self.closed = True
+            streams = list(self._streams)
+        self._stopped.set()
+        for stream in streams:
+            self._flush(stream)
+            with stream.io_lock:
+                self._close_file(stream)
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.FLUSH_SECONDS):
+            with self._lock:
+                streams = list(self._streams)
+            for stream in streams:
+                self._flush(stream)
+
+    def _flush(self, stream):
+        # only the stream is locked while its data is compressed and written
+        with stream.io_lock:
+            data = stream.take()
+            if not data:
+                return
+            now = time.time()
+            if stream.size and self._due_for_rotation(stream, len(data), now):
+                if stream.file:
+                    self._close_file(stream)
+                stream.segment += 1
+                stream.size = 0
+            if stream.file:
+                with self._lock:
+                    self._open.pop(stream)
+                    self._open[stream] = None
+            else:
+                self._make_room(stream)
+                self._open_file(stream, now)
+            stream.file.write(data)
+            stream.size += len(data)
+            if self.closed:
+                self._close_file(stream)
+
+    def _make_room(self, stream):
+        '''Count stream as open, first closing the least recently written files not being written
+        (which are otherwise skipped, so two streams never wait for each other).
+        '''
+        while True:
+            with self._lock:
+                if len(self._open) < self.max_open:
+                    self._open[stream] = None
+                    return
+                for victim in self._open:
+                    if victim.io_lock.acquire(False):
+                        break
+                else:
+                    victim = None
+            if victim is None:
+                time.sleep(0)  # all being written: one is done soon
+                continue
+            try:
+                self._close_file(victim)
+            finally:
+                victim.io_lock.release()
+
+    def _due_for_rotation(self, stream, size, now):
+        if self.rotate_bytes and stream.size + size > self.rotate_bytes:
+            return True
+        return bool(self.rotate_seconds and now - stream.started >= self.rotate_seconds)
+
+    def _open_file(self, stream, now):
+        directory, name = os.path.split(stream.path)
+        if stream.segment is None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            stream.segment = _last_segment(directory, name) + 1
+        if stream.size == 0:
+            stream.started = now
+            _logger.debug('writing %s' % stream.path_of(stream.segment))
+        path = stream.path_of(stream.segment)
+        if self.compression == 'gzip':
+            stream.file = gzip.open(path, 'ab', self.GZIP_LEVEL)
+        elif self.compression == 'zstd':
+            stream.file = self._zstd.stream_writer(io.open(path, 'ab'))
+        else:
+            stream.file = io.open(path, 'ab')
+
+    def _close_file(self, stream):
+        # by the thread holding the stream's `io_lock` (the file is None if it failed to open)
+        with self._lock:
+            self._open.pop(stream, None)
+        if stream.file:
+            stream.file.close()
+            stream.file = None
+
+
+class _Stream(object):
+    def __init__(self, archive, path):
+        self.path = path
+        self.file = None
+        self.segment = None
+        self.size = 0  # logged to the current segment (before any compression)
+        self.started = None  # when the current segment was started
+        self.io_lock = threading.Lock()  # held while writing to (or opening or closing) the file
+        self._archive = archive
+        self._lock = threading.Lock()  # the buffer is also taken by the flushing thread
+        self._buffer = []
+        self._buffered = 0
+
+    def path_of(self, segment):
+        return '{0}.{1:04d}.log{2}'.format(self.path, segment,
+                                           LogArchive.SUFFIXES[self._archive.compression])
+
+    def write(self, line):
+        with self._lock:
+            self._buffer.append(line)
+            self._buffered += len(line)
+            due = self._buffered >= LogArchive.BUFFER_BYTES
+        if due or self._archive.closed:
+            self._archive._flush(self)
+
+    def take(self):
+        with self._lock:
+            data = b''.join(self._buffer)
+            self._buffer = []
+            self._buffered = 0
+        return data
+
+
+def _last_segment(directory, name):
+    pattern = re.compile(re.escape(name) + r'\.(\d+)\.log')
+    last = 0
+    for filename in os.listdir(directory):
+        m = pattern.match(filename)
+        if m:
+            last = max(last, int(m.group(1)))
+    return last
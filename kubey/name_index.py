@@ -0,0 +1,111 @@
+import io
+import os
+import mmap
+import logging
+
+from . import cache
+
+
+_logger = logging.getLogger(__name__)
+
+
+class NameIndex(object):
+    '''Sorted names of every pod container ("POD/CONTAINER" and "NODE/POD/CONTAINER") and node
+    ("NODE/") from the pods and nodes caches of a context, for prefix searches.
+
+    The index is kept in a text file next to the caches, one "NAME<TAB>NAMESPACE" per line, and
+    is only rebuilt (from the cached JSON) when a cache was written after it. Searches bisect the
+    (memory mapped) file, so only the few pages holding matches are ever read.
+    '''
+
+    SEP = '\t'
+
+    def __init__(self, path, cache_paths):
+        self.path = path
+        self._cache_paths = cache_paths
+
+    def search(self, prefix):
+        '''Generate (name, namespace) of each name starting with prefix, in order.'''
+        if self._is_stale():
+            self._build()
+        try:
+            f = io.open(self.path, 'rb')
+        except (IOError, OSError):
+            return  # nothing cached yet
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                prefix = prefix.encode('utf-8')
+                start = _bisect(data, prefix)
+                while start < len(data):
+                    end = _line_end(data, start)
+                    line = data[start:end]
+                    if not line.startswith(prefix):
+                        break
+                    name, namespace = line.decode('utf-8').split(self.SEP, 1)
+                    yield name, namespace
+                    start = end + 1
+            finally:
+                data.close()
+
+    def _is_stale(self):
+        try:
+            built = os.path.getmtime(self.path)
+        except OSError:
+            return True
+        for path in self._cache_paths:
+            try:
+                if os.path.getmtime(path) > built:
+                    return True
+            except OSError:
+                pass
+        return False
+
+    def _build(self):
+        lines = set()
+        found = False
+        for path in self._cache_paths:
+            try:
+                items = cache.read(path)['items']
+            except cache.Cache.READ_ERRORS:
+                continue
+            found = True
+            for info in items:
+                metadata = info['metadata']
+                spec = info.get('spec') or {}
+                if 'containers' not in spec:  # a node
+                    lines.add(metadata['name'] + '/' + self.SEP)
+                    continue
+                node = spec.get('nodeName')
+                for container in spec['containers']:
+                    name = '{0}/{1}'.format(metadata['name'], container['name'])
+                    lines.add(name + self.SEP + metadata['namespace'])
+                    if node:
+                        lines.add(node + '/' + name + self.SEP + metadata['namespace'])
+        if not found:
+            return  # nothing cached yet
+        # sorted as bytes, as they are searched
+        data = b'\n'.join(sorted(line.encode('utf-8') for line in lines))
+        cache.write_atomically(self.path, data)
+        _logger.debug('indexed %d names in %s' % (len(lines), self.path))
+
+
+def _line_end(data, start):
+    end = data.find(b'\n', start)
+    return len(data) if end < 0 else end
+
+
+def _bisect(data, prefix):
+    '''Offset of the first line not less than prefix in sorted lines.'''
+    lo, hi = 0, len(data)
+    while lo < hi:  # both are always at the start of a line (or the end)
+        mid = (lo + hi) // 2
+        start = data.rfind(b'\n', 0, mid) + 1
+        end = _line_end(data, mid)
+        if data[start:end] < prefix:
+            lo = end + 1
+        else:
+            hi = start
+    return min(lo, len(data))
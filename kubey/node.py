@@ -1,6 +1,9 @@
 from . import timestamp
+from . import units
 from .item import Item
 from .condition import NodeCondition
+from .projection import prefixed
+from .ring_buffer import RingBuffer
 
 
 class Node(Item):
@@ -8,6 +11,19 @@ class Node(Item):
                           'memory_percent', 'conditions', 'pods')
     ATTRIBUTES = PRIMARY_ATTRIBUTES + ('name', 'labels', 'private_ip', 'external_ip', 'hostname',
                                        'cpu_cores', 'memory_bytes', 'creation_time')
+    # only known while sampling usage over time (see `Kubey.sample_nodes`)
+    SAMPLED_ATTRIBUTES = tuple('{0}_percent_{1}'.format(m, s) for m in ('cpu', 'memory')
+                               for s in ('min', 'avg', 'p95', 'max')) + \
+        ('cpu_sparkline', 'memory_sparkline')
+    ATTRIBUTES += SAMPLED_ATTRIBUTES
+    SAMPLED_PRIMARY_ATTRIBUTES = ('identity', 'cpu_percent_avg', 'cpu_percent_p95',
+                                  'cpu_percent_max', 'cpu_sparkline', 'memory_percent_avg',
+                                  'memory_percent_max', 'memory_sparkline')
+    SORT_ATTRIBUTES = ('name', 'cpu_percent', 'memory_percent', 'cpu_cores', 'memory_bytes',
+                       'creation_time')
+    FIELDS = Item.FIELDS + ('metadata.creationTimestamp', 'spec.unschedulable') + \
+        prefixed('status.conditions', NodeCondition.FIELDS) + \
+        prefixed('status.addresses', ('type', 'address'))
 
     def __init__(self, config, info, all_pods, top_info):
         super(Node, self).__init__(config, info)
@@ -23,6 +39,9 @@ class Node(Item):
         self.conditions = [NodeCondition(self._config, o) for o in status['conditions']]
         self._extract_addresses(status['addresses'])
         self._consider(top_info)
+        self._samples = None
+        for attr in self.SAMPLED_ATTRIBUTES:
+            setattr(self, attr, None)
 
     @property
     def identity(self):
@@ -35,6 +54,27 @@ class Node(Item):
             self._pods = [p for p in self._all_pods if p.node_name == self.name]
         return self._pods
 
+    def start_sampling(self, capacity):
+        '''Keep the latest `capacity` samples of usage, starting with the current one.'''
+        self._samples = {'cpu': RingBuffer(capacity), 'memory': RingBuffer(capacity)}
+        self._record_sample()
+
+    def sample(self, top_info):
+        '''Take in new usage (as reported by `kubectl top node`) and summarize the samples.'''
+        self._consider(top_info)
+        self._record_sample()
+
+    def _record_sample(self):
+        for metric, samples in self._samples.items():
+            value = getattr(self, metric + '_percent')
+            if value is not None:
+                samples.append(value)
+            summary = samples.summary() or (None,) * 4
+            for stat, value in zip(('min', 'avg', 'p95', 'max'), summary):
+                setattr(self, '{0}_percent_{1}'.format(metric, stat),
+                        None if value is None else int(round(value)))
+            setattr(self, metric + '_sparkline', samples.values())
+
     def _extract_addresses(self, info):
         self.private_ip = self.external_ip = self.hostname = None
         for item in info:
@@ -52,7 +92,7 @@ class Node(Item):
 
     def _consider(self, top_info):
         info = top_info.get(self.name)
-        self.cpu_cores = info[0] if info else None
-        self.cpu_percent = info[1] if info else None
-        self.memory_bytes = info[2] if info else None
-        self.memory_percent = info[3] if info else None
+        self.cpu_cores = units.cpu_cores(info[0]) if info else None
+        self.cpu_percent = units.percent(info[1]) if info else None
+        self.memory_bytes = units.quantity_bytes(info[2]) if info else None
+        self.memory_percent = units.percent(info[3]) if info else None
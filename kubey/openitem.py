@@ -6,5 +6,5 @@ class OpenItem(Item):
         if len(headers) != len(values):
             raise ValueError('mismatched headers and values')
         self.ATTRIBUTES = headers
-        for attr in headers:
-            setattr(self, attr, values.pop(0))
+        for attr, value in zip(headers, values):
+            setattr(self, attr, value)
@@ -1,5 +1,7 @@
 from . import timestamp
+from . import units
 from .item import Item
+from .projection import prefixed
 from .condition import Condition
 from .container import Container
 
@@ -7,7 +9,19 @@ from .container import Container
 class Pod(Item):
     PRIMARY_ATTRIBUTES = ('name', 'phase', 'conditions', 'containers')
     ATTRIBUTES = PRIMARY_ATTRIBUTES + ('labels', 'namespace', 'node_name', 'node',
-                                       'host_ip', 'pod_ip', 'start_time')
+                                       'host_ip', 'pod_ip', 'start_time', 'restart_count',
+                                       'cpu', 'memory', 'cpu_percent_of_request')
+    SORT_ATTRIBUTES = ('name', 'namespace', 'node_name', 'start_time', 'restart_count', 'cpu',
+                       'memory', 'cpu_percent_of_request')
+
+    # only known when `kubectl top pod` is consulted (see `Kubey.each_pod`)
+    USAGE_ATTRIBUTES = ('cpu', 'memory', 'cpu_percent_of_request')
+    FIELDS = Item.FIELDS + \
+        ('spec.nodeName', 'status.phase', 'status.message', 'status.reason',
+         'status.hostIP', 'status.podIP', 'status.startTime') + \
+        prefixed('status.conditions', Condition.FIELDS) + \
+        prefixed('spec.containers', Container.FIELDS) + \
+        prefixed('status.containerStatuses', Container.STATUS_FIELDS)
 
     _TERMINATED_STATUS = {
         'ready': False,
@@ -42,7 +56,9 @@ class Pod(Item):
                 self._config.highlight_warn
             return highlighter(self._phase)
 
-    def __init__(self, config, info, container_selector):
+    def __init__(self, config, info, container_selector, usage=None):
+        '''Usage maps each container name to the row reported by `kubectl top pod --containers`.
+        '''
         super(Pod, self).__init__(config, info)
         status = info['status']
         spec = info['spec']
@@ -55,7 +71,7 @@ class Pod(Item):
         self._extract_conditions(status.get('conditions', []))
         self._extract_containers(spec['containers'],
                                  status.get('containerStatuses', []),
-                                 container_selector)
+                                 container_selector, usage or {})
 
     def __str__(self, namespaced=False):
         pstr = '' if self.phase.running else ':' + str(self.phase)
@@ -63,6 +79,25 @@ class Pod(Item):
             return '{0}/{1}{2}'.format(self.namespace, self.name, pstr)
         return '{0}{1}'.format(self.name, pstr)
 
+    @property
+    def restart_count(self):
+        return sum(max(c.restart_count, 0) for c in self.containers)
+
+    @property
+    def cpu(self):
+        return self._sum_of('cpu')
+
+    @property
+    def memory(self):
+        return self._sum_of('memory')
+
+    @property
+    def cpu_percent_of_request(self):
+        cpu = self.cpu
+        if cpu is None or any(c.cpu_request is None for c in self.containers):
+            return None
+        return units.percent_of(cpu, sum(c.cpu_request for c in self.containers))
+
     @property
     def node(self):
         return [self.node_name, self.host_ip]
@@ -70,7 +105,13 @@ class Pod(Item):
     def _extract_conditions(self, info):
         self.conditions = [Condition(self._config, o) for o in info]
 
-    def _extract_containers(self, info, status_info, selector):
+    def _sum_of(self, attr):
+        values = [getattr(c, attr) for c in self.containers]
+        if not values or any(v is None for v in values):
+            return None
+        return sum(values)
+
+    def _extract_containers(self, info, status_info, selector, usage):
         self.containers = []
         for info in info:
             name = info['name']
@@ -81,7 +122,7 @@ class Pod(Item):
                     if not term:
                         raise ValueError('Status not found: ' + name)
                     status = self._TERMINATED_STATUS
-                self.containers.append(Container(self._config, info, status))
+                self.containers.append(Container(self._config, info, status, usage.get(name)))
 
     @staticmethod
     def _status_for(name, statuses):
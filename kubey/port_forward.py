@@ -0,0 +1,216 @@
+import re
+import time
+import socket
+import logging
+import threading
+
+from .item import Item
+from .kubectl import KubeCtl
+
+
+_logger = logging.getLogger(__name__)
+
+
+class Backend(Item):
+    '''A `kubectl port-forward` to a port of one pod (from a local port that kubectl picks), with
+    counts of the connections relayed through it.
+
+    It is restarted (backing off while it keeps failing) whenever it exits or reports an error.
+    '''
+
+    PRIMARY_ATTRIBUTES = ('target', 'state', 'active', 'connections', 'failures', 'restarts',
+                          'bytes_sent', 'bytes_received')
+    ATTRIBUTES = PRIMARY_ATTRIBUTES + ('local_port',)
+
+    FORWARDING_RE = re.compile(r'^Forwarding from 127\.0\.0\.1:(\d+) ')
+
+    def __init__(self, config, pod, remote_port):
+        super(Backend, self).__init__(config, {})
+        self.pod = pod
+        self.target = '{0}/{1}'.format(pod.namespace, pod.name)
+        self.remote_port = remote_port
+        self.local_port = None  # once forwarding
+        self.active = 0
+        self.connections = 0
+        self.failures = 0  # connections that could not be relayed
+        self.restarts = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._proc = None
+        self._broken = False
+        self._backoffs = 0
+        self._retry_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.local_port:
+            return 'ready'
+        return 'starting' if self._proc else 'down'
+
+    def supervise(self, kubectl, now):
+        '''Start the forward unless running (or waiting to retry) and stop it when it broke. Only
+        ever called from one thread.
+        '''
+        if self._proc and (self._broken or self._proc.poll() is not None):
+            self.stop(kubectl)
+            delay = min(KubeCtl.BACKOFF_MAX_SECONDS, KubeCtl.BACKOFF_SECONDS * 2 ** self._backoffs)
+            self._backoffs += 1
+            self._retry_at = now + delay
+            _logger.info('%s => forward stopped (restarting in %.1fs)' % (self.target, delay))
+        if not self._proc and now >= self._retry_at:
+            if self._retry_at:
+                self.restarts += 1
+            self._broken = False
+            self._proc = kubectl.start(
+                self._forwarding, self._error, 'port-forward', '-n', self.pod.namespace,
+                '--address', '127.0.0.1', 'pod/' + self.pod.name, ':%d' % self.remote_port,
+                target=self.target)
+
+    def stop(self, kubectl):
+        self.local_port = None
+        if self._proc:
+            kubectl.stop(self._proc)
+            self._proc = None
+
+    def acquire(self):
+        with self._lock:
+            self.active += 1
+            self.connections += 1
+
+    def release(self, failed=False):
+        with self._lock:
+            self.active -= 1
+            if failed:
+                self.failures += 1
+            else:
+                self._backoffs = 0  # forwarding works, so restart promptly next time
+
+    def sent(self, count):
+        with self._lock:
+            self.bytes_sent += count
+
+    def received(self, count):
+        with self._lock:
+            self.bytes_received += count
+
+    def _forwarding(self, line):
+        m = self.FORWARDING_RE.match(line)
+        if m:
+            self.local_port = int(m.group(1))
+        # otherwise e.g. "Handling connection for PORT"
+
+    def _error(self, line):
+        _logger.warn('%s => %s' % (self.target, line.rstrip()))
+        # kubectl may keep running after losing the pod, so any error gets it restarted
+        self.local_port = None
+        self._broken = True
+
+
+class ForwardProxy(object):
+    '''Accepts connections on a local port and relays each to a ready backend: the next in turn
+    or the one with the fewest active connections (taking turns among equals).
+
+    Every connection is relayed by two threads (one per direction) in large chunks.
+    '''
+
+    BALANCING = ('round-robin', 'least-connections')
+    BUFFER_BYTES = 64 * 1024
+    CONNECT_SECONDS = 5  # waited for a backend to be ready (or connected to)
+
+    def __init__(self, backends, address='127.0.0.1', port=0, balancing='round-robin'):
+        if balancing not in self.BALANCING:
+            raise ValueError('unknown balancing: {0}'.format(balancing))
+        self.backends = backends
+        self._least_connections = balancing == 'least-connections'
+        self._turn = 0
+        self._lock = threading.Lock()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((address, port))
+        self._server.listen(128)
+        self.port = self._server.getsockname()[1]
+
+    def start(self):
+        _daemon(self._accept)
+
+    def close(self):
+        self._server.close()
+
+    def choose(self, exclude=()):
+        '''The backend to relay the next connection to (counted as active), or None when none is
+        ready.
+        '''
+        with self._lock:
+            ready = [b for b in self.backends if b.local_port and b not in exclude]
+            if not ready:
+                return None
+            turn = self._turn % len(ready)
+            self._turn += 1
+            if self._least_connections:
+                backend = min(ready[turn:] + ready[:turn], key=lambda b: b.active)
+            else:
+                backend = ready[turn]
+            backend.acquire()
+            return backend
+
+    def _accept(self):
+        while True:
+            try:
+                client, _address = self._server.accept()
+            except socket.error:
+                return  # closed
+            _daemon(self._handle, client)
+
+    def _handle(self, client):
+        tried = []
+        expires = time.time() + self.CONNECT_SECONDS
+        while True:
+            backend = self.choose(tried)
+            if backend is None:
+                if time.time() >= expires:
+                    _logger.warn('no forward ready (closing connection)')
+                    client.close()
+                    return
+                time.sleep(KubeCtl.POLL_SECONDS)
+                continue
+            port = backend.local_port
+            try:
+                upstream = socket.create_connection(('127.0.0.1', port), self.CONNECT_SECONDS)
+                upstream.settimeout(None)
+                break
+            except (socket.error, TypeError) as ex:  # TypeError: no longer forwarding
+                _logger.debug('%s => %r' % (backend.target, ex))
+                backend.release(failed=True)
+                tried.append(backend)
+        try:
+            thread = _daemon(self._pump, upstream, client, backend.received)
+            self._pump(client, upstream, backend.sent)
+            thread.join()
+        finally:
+            client.close()
+            upstream.close()
+            backend.release()
+
+    def _pump(self, source, sink, count):
+        try:
+            while True:
+                data = source.recv(self.BUFFER_BYTES)
+                if not data:
+                    break
+                sink.sendall(data)
+                count(len(data))
+            sink.shutdown(socket.SHUT_WR)  # pass the end along (the other way may continue)
+        except socket.error:
+            for sock in (source, sink):  # and stop the other way too
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+
+def _daemon(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True  # left when interrupted
+    thread.start()
+    return thread
@@ -0,0 +1,38 @@
+'''Reduce JSON documents to just the fields that are needed.
+
+Fields are dotted paths (e.g. "metadata.name"). Lists are traversed transparently, so
+"spec.containers.image" keeps the image of every container. A path that ends on an object keeps
+that object whole.
+'''
+
+
+def compile_fields(fields):
+    tree = {}
+    for field in fields:
+        node = tree
+        parts = field.split('.')
+        for part in parts[:-1]:
+            if node.get(part, {}) is None:
+                break  # a parent is already kept whole
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+def project(obj, fields):
+    return _project(obj, compile_fields(fields))
+
+
+def prefixed(prefix, fields):
+    return tuple(prefix + '.' + f for f in fields)
+
+
+def _project(obj, tree):
+    if tree is None:
+        return obj
+    if isinstance(obj, list):
+        return [_project(o, tree) for o in obj]
+    if not isinstance(obj, dict):
+        return obj
+    return dict((k, _project(obj[k], sub)) for k, sub in tree.items() if k in obj)
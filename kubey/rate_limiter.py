@@ -0,0 +1,68 @@
+import os
+import time
+import logging
+
+from threading import Lock
+
+# Windows has no `fcntl` (see FileLock): limiting then only applies within a single process
+from .file_lock import FileLock
+
+
+_logger = logging.getLogger(__name__)
+
+
+class RateLimiter(object):
+    '''Token bucket whose state lives in a small file so every process on the host shares it.
+
+    Each caller takes a token under an exclusive lock on the file. When none are left the caller
+    still takes one (leaving the bucket in debt) and sleeps until it would have been refilled, so
+    waiting callers are served in order without polling the file.
+    '''
+
+    def __init__(self, path, qps, burst=1):
+        if qps <= 0:
+            raise ValueError('qps must be positive: {0}'.format(qps))
+        self.path = path
+        self.qps = float(qps)
+        self.burst = max(1, burst)
+        self.calls = 0
+        self.queued_calls = 0
+        self.queued_seconds = 0.0
+        self.max_queued_seconds = 0.0
+        self._lock = Lock()
+
+    def acquire(self):
+        '''Block until a call may be made and return the number of seconds spent waiting.'''
+        with self._lock:
+            delay = self._reserve()
+            self.calls += 1
+            if delay > 0:
+                self.queued_calls += 1
+                self.queued_seconds += delay
+                self.max_queued_seconds = max(self.max_queued_seconds, delay)
+        if delay > 0:
+            _logger.debug('rate limited: queued for %.3fs' % delay)
+            time.sleep(delay)
+        return delay
+
+    def _reserve(self):
+        with FileLock(self.path) as lock:
+            now = time.time()
+            tokens, stamp = self._load(lock.fileno(), now)
+            tokens = min(self.burst, tokens + (now - stamp) * self.qps) - 1
+            self._store(lock.fileno(), tokens, now)
+        return -tokens / self.qps if tokens < 0 else 0
+
+    def _load(self, fd, now):
+        data = os.read(fd, 64).decode('ascii')
+        try:
+            tokens, stamp = data.split()
+            return float(tokens), float(stamp)
+        except ValueError:
+            return float(self.burst), now  # new or unreadable state starts with a full bucket
+
+    @staticmethod
+    def _store(fd, tokens, now):
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, '{0!r} {1!r}\n'.format(tokens, now).encode('ascii'))
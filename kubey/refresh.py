@@ -0,0 +1,57 @@
+'''Refreshes a cache file from a detached process (see `Cache._refresh_detached`).
+
+Usage: python -m kubey.refresh PATH SECONDS FIELD[,FIELD...] [OPTIONS] -- COMMAND [ARGS...]
+
+The options (see `refresh_argv`) have the command requested as the kubey that started the refresh
+would: --timeout SECONDS, --retries COUNT, --hedge-after SECONDS and, to share its rate limit,
+--qps QPS --burst COUNT --rate-path PATH.
+'''
+
+import sys
+import json
+import getopt
+
+from .cache import Cache
+from .kubectl import KubeCtl
+from .rate_limiter import RateLimiter
+
+OPTIONS = ('timeout=', 'retries=', 'hedge-after=', 'qps=', 'burst=', 'rate-path=')
+
+
+def refresh_argv(kubectl, commandline):
+    '''Arguments (after the fields) to refresh with `commandline` requested like `kubectl` does.'''
+    argv = []
+    for option, value in (('--timeout', kubectl.timeout), ('--retries', kubectl.retries),
+                          ('--hedge-after', kubectl.hedge_after)):
+        if value:
+            argv.extend([option, str(value)])
+    limiter = kubectl.rate_limiter
+    if limiter:
+        argv.extend(['--qps', str(limiter.qps), '--burst', str(limiter.burst),
+                     '--rate-path', limiter.path])
+    return argv + ['--'] + list(commandline)
+
+
+def retrieve(kubectl, argv):
+    return json.loads(kubectl.capture_commandline(argv, idempotent=True))
+
+
+def main(args):
+    path, seconds, fields = args[0], float(args[1]), args[2]
+    fields = fields.split(',') if fields else None
+    options, argv = getopt.getopt(args[3:], '', OPTIONS)
+    options = dict(options)
+    timeout = options.get('--timeout')
+    hedge_after = options.get('--hedge-after')
+    kubectl = KubeCtl(timeout=timeout and float(timeout),
+                      retries=int(options.get('--retries', 0)),
+                      hedge_after=hedge_after and float(hedge_after))
+    if '--qps' in options:
+        kubectl.rate_limiter = RateLimiter(options['--rate-path'], float(options['--qps']),
+                                           int(options.get('--burst', 1)))
+    # a no-op when another process already refreshed it while this one waited on the lock
+    Cache(path, seconds, retrieve, kubectl, argv, fields=fields).obj()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
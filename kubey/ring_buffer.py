@@ -0,0 +1,40 @@
+from array import array
+
+
+class RingBuffer(object):
+    '''Keeps only the most recent values, up to a fixed capacity, in a compact array.'''
+
+    def __init__(self, capacity, typecode='f'):
+        if capacity < 1:
+            raise ValueError('capacity must be positive: {0}'.format(capacity))
+        self._values = array(typecode, [0] * capacity)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value):
+        self._values[self._next] = value
+        self._next = (self._next + 1) % len(self._values)
+        self._count = min(self._count + 1, len(self._values))
+
+    def values(self):
+        '''Oldest to newest.'''
+        if self._count < len(self._values):
+            return self._values[:self._count].tolist()
+        return (self._values[self._next:] + self._values[:self._next]).tolist()
+
+    def summary(self):
+        '''Returns (min, average, 95th percentile, max) or None when empty.'''
+        if not self._count:
+            return None
+        ordered = sorted(self.values())
+        average = sum(ordered) / len(ordered)
+        return ordered[0], average, percentile(ordered, 95), ordered[-1]
+
+
+def percentile(ordered, percent):
+    '''Nearest-rank percentile of already sorted values.'''
+    rank = int(-(-percent * len(ordered) // 100))  # ceiling without floats
+    return ordered[max(rank, 1) - 1]
@@ -0,0 +1,143 @@
+import re
+
+
+# anything else in a pattern is matched literally
+_REGEX_CHARS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+# alternatives are comma separated (ignoring commas within a regex quantifier, e.g. "{1,3}")
+_ALTERNATIVES_SEP = re.compile(r',(?![^{]*\})')
+
+
+def compile_pattern(pattern, ignore_case=True):
+    '''Build a predicate for a regular expression, using plain string operations when it is a
+    literal substring, prefix, suffix or exact name (i.e. the common cases).
+
+    Kubernetes names are always lowercase, so for those only the pattern needs folding.
+    '''
+    if not pattern:
+        return _always
+    anchored_beg = pattern.startswith('^')
+    anchored_end = pattern.endswith('$') and not pattern.endswith('\\$')
+    literal = pattern[1 if anchored_beg else 0:-1 if anchored_end else None]
+    if _REGEX_CHARS.search(literal):
+        return re.compile(pattern, re.IGNORECASE if ignore_case else 0).search
+    if ignore_case:
+        literal = literal.lower()
+    if anchored_beg and anchored_end:
+        return lambda value: value == literal
+    if anchored_beg:
+        return lambda value: value.startswith(literal)
+    if anchored_end:
+        return lambda value: value.endswith(literal)
+    return lambda value: literal in value
+
+
+def exact_literal(pattern):
+    '''The name a pattern only matches exactly (e.g. "^web-1$"), otherwise None.'''
+    if len(pattern) > 2 and pattern[0] == '^' and pattern[-1] == '$' and \
+            not _REGEX_CHARS.search(pattern[1:-1]):
+        return pattern[1:-1]
+    return None
+
+
+def _always(_value):
+    return True
+
+
+class Alternative(object):
+    '''One [<NODE>/]<POD>[/<CONTAINER>] pattern from MATCH.'''
+
+    ANY = '.'
+
+    def __init__(self, match):
+        items = match.split('/', 2)
+        node = items.pop(0) if len(items) > 2 else ''
+        pod = items.pop(0)
+        container = items.pop(0) if len(items) > 0 else ''
+        self.patterns = tuple('' if p == self.ANY else p for p in (node, pod, container))
+        self.node, self.pod, self.container = (compile_pattern(p) for p in self.patterns)
+
+    def __repr__(self):
+        return '/'.join(self.patterns)
+
+
+class Selector(object):
+    '''Compiled MATCH (one or more comma separated alternatives) and predicates, evaluated directly
+    against the raw JSON info so that only selected items are ever turned into objects.
+    '''
+
+    def __init__(self, match, namespace='', phases=None, ready=None, min_restarts=None,
+                 labels=None):
+        self.alternatives = [Alternative(m) for m in _ALTERNATIVES_SEP.split(match)]
+        self._namespace_pattern = namespace
+        self._namespace = compile_pattern(namespace, ignore_case=False)
+        self._phases = frozenset(p.lower() for p in phases) if phases else None
+        self._ready = ready
+        self._min_restarts = min_restarts
+        self._labels = labels or {}
+
+    def __repr__(self):
+        return ','.join(repr(a) for a in self.alternatives)
+
+    def match_pod(self, info):
+        '''Returns a container name predicate for a selected pod or None when not selected.'''
+        metadata = info['metadata']
+        if not self._namespace(metadata['namespace']):
+            return None
+        name = metadata['name']
+        node_name = info['spec'].get('nodeName', '')
+        matched = [a for a in self.alternatives if a.pod(name) and a.node(node_name)]
+        if not matched or not self._predicates_match(info):
+            return None
+        if len(matched) == 1:
+            return matched[0].container
+        return lambda container_name: any(a.container(container_name) for a in matched)
+
+    def match_node(self, info):
+        name = info['metadata']['name']
+        return any(a.node(name) for a in self.alternatives)
+
+    def match_event(self, info, involved=False):
+        '''Match an event by its source host and name or, when `involved`, also by the name of the
+        object it is about (as the history is looked up, see `event_filters`).
+        '''
+        metadata = info['metadata']
+        if not self._namespace(metadata['namespace']):
+            return False
+        host = (info.get('source') or {}).get('host', '')
+        names = [metadata['name']]
+        if involved:
+            names.append((info.get('involvedObject') or {}).get('name', ''))
+        return any(a.node(host) and any(a.pod(n) for n in names) for a in self.alternatives)
+
+    def event_filters(self):
+        '''Exact values every selected event has (see `EventStore.query`), so that the history of
+        one pod or node can be looked up by index.
+        '''
+        if len(self.alternatives) != 1:
+            return {}
+        node, pod, _container = self.alternatives[0].patterns
+        filters = {'namespace': exact_literal(self._namespace_pattern),
+                   'involved_name': exact_literal(pod.lower()),
+                   'host': exact_literal(node.lower())}
+        return dict((k, v) for k, v in filters.items() if v)
+
+    def _predicates_match(self, info):
+        status = info.get('status', {})
+        if self._phases is not None and status.get('phase', '').lower() not in self._phases:
+            return False
+        if self._ready is not None:
+            ready = any(c['type'] == 'Ready' and c['status'] == 'True'
+                        for c in status.get('conditions', []))
+            if ready != self._ready:
+                return False
+        if self._min_restarts is not None:
+            restarts = sum(s.get('restartCount', 0) for s in status.get('containerStatuses', []))
+            if restarts < self._min_restarts:
+                return False
+        if self._labels:
+            labels = info['metadata'].get('labels') or {}
+            for key, value in self._labels.items():
+                if key not in labels or (value is not None and labels[key] != value):
+                    return False
+        return True
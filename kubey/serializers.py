@@ -1,6 +1,6 @@
 import re
 from . import timestamp
-from .kubey import Kubey
+from . import units
 
 
 class ColumnSerializer(object):
@@ -42,24 +42,70 @@ class PodsSerializer(ColumnSerializer):
         return column == 'pods'
 
     def serialize(self, pods):
+        from .kubey import Kubey  # already loaded once there are pods (but not to show help)
         if self._config.namespace == Kubey.ANY:
             return [pod.__str__(True) for pod in pods]
         return pods
 
 
+class CpuSerializer(ColumnSerializer):
+    def match(self, column):
+        return column in ('cpu', 'cpu_cores')
+
+    def serialize(self, cores):
+        return cores if cores is None else units.cpu_in_words(cores)
+
+
+class MemorySerializer(ColumnSerializer):
+    def match(self, column):
+        return column in ('memory', 'memory_bytes')
+
+    def serialize(self, count):
+        return count if count is None else units.bytes_in_words(count)
+
+
+class SparklineSerializer(ColumnSerializer):
+    '''Draws percentages as bars (the highest in each bucket when there are too many).'''
+
+    BARS = u'\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588'
+    WIDTH = 30
+
+    def match(self, column):
+        return column.endswith('_sparkline')
+
+    def serialize(self, values):
+        if not values:
+            return ''
+        size = -(-len(values) // self.WIDTH)
+        buckets = [max(values[i:i + size]) for i in range(0, len(values), size)]
+        return u''.join(self._bar(v) for v in buckets)
+
+    def _bar(self, value):
+        bar = self.BARS[min(int(value * len(self.BARS) / 100), len(self.BARS) - 1)]
+        if value >= self._config.hard_percent_limit:
+            return self._config.highlight_error(bar)
+        if value >= self._config.soft_percent_limit:
+            return self._config.highlight_warn(bar)
+        return bar
+
+
 class PercentSerializer(ColumnSerializer):
     PERCENT_RE = re.compile(r'^(\d+)\s*%$')
 
     def match(self, column):
-        return column.endswith('_percent')
+        return '_percent' in column
 
     def serialize(self, value):
-        if not value:
-            return value
-        m = self.PERCENT_RE.match(value)
-        if not m:
+        if value is None or value == '':
             return value
-        v = int(m.group(1))
+        if isinstance(value, int):
+            v = value
+            value = '{0}%'.format(value)
+        else:
+            m = self.PERCENT_RE.match(value)
+            if not m:
+                return value
+            v = int(m.group(1))
         if v >= self._config.hard_percent_limit:
             return self._config.highlight_error(value)
         if v >= self._config.soft_percent_limit:
@@ -69,4 +115,5 @@ class PercentSerializer(ColumnSerializer):
 
 def default(config):
     return (RelativeTimestampSerializer(config), LevelSerializer(config),
-            PodsSerializer(config), PercentSerializer(config))
+            PodsSerializer(config), CpuSerializer(config), MemorySerializer(config),
+            SparklineSerializer(config), PercentSerializer(config))
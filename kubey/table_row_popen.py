@@ -9,6 +9,7 @@ class TableRowPopen(subprocess.Popen):
         self._row_handler = row_handler
         kwargs['stdout'] = subprocess.PIPE
         super(TableRowPopen, self).__init__(*args, **kwargs)
+        self.stdout_bytes = 0
         self._stdout_thread = Thread(target=self._parse_table)
         self._stdout_thread.start()
 
@@ -21,7 +22,9 @@ class TableRowPopen(subprocess.Popen):
         line_number = 0
         with self.stdout as io:
             while True:
-                line = io.readline().rstrip().decode('utf-8')
+                line = io.readline()
+                self.stdout_bytes += len(line)
+                line = line.rstrip().decode('utf-8')
                 if not line:
                     break
                 line_number += 1
@@ -1,10 +1,13 @@
+import re
+import heapq
 import types
-import tabulate as real_tabulate
 from . import serializers
 from .openitem import OpenItem
 
 
-formats = real_tabulate.tabulate_formats
+def formats():
+    import tabulate as real_tabulate  # slow to load, so only once a table is made
+    return real_tabulate.tabulate_formats
 
 
 class RowCollector(object):
@@ -22,6 +25,24 @@ class RowCollector(object):
         return add
 
 
+class ItemCollector(object):
+    '''Merges the items of JSON responses (each a list of items or a single one), keeping the
+    responses in the order of their keys no matter which completes first.
+    '''
+
+    def __init__(self):
+        self._items = {}
+
+    def handler_for(self, key):
+        def add(obj):
+            self._items[key] = obj['items'] if 'items' in obj else [obj]
+        return add
+
+    @property
+    def items(self):
+        return [item for key in sorted(self._items) for item in self._items[key]]
+
+
 class RowExtractor(object):
     def __init__(self, config, attributes, serializers):
         self._config = config
@@ -41,12 +62,88 @@ class RowExtractor(object):
 
 def tabulate(config, items, columns, flat=False, serialize=True):
     flattener = flatten if flat else None
-    extractor = RowExtractor(config, columns, serializers.default(config))
+    extractor = RowExtractor(config, columns, serializers.default(config) if serialize else ())
     headers = [] if config.no_headers else columns
-    rows = each_row(items, flattener, extractor)
+    rows = list(each_row(items, flattener, extractor))
+    if config.table_format == SIMPLE_FORMAT:
+        table = simple_table(rows, headers)
+        if table is not None:
+            return table
+    import tabulate as real_tabulate
     return real_tabulate.tabulate(rows, headers=headers, tablefmt=config.table_format)
 
 
+SIMPLE_FORMAT = 'simple'
+_INT_RE = re.compile(r'^-?[0-9]+$')
+_PLAIN_RE = re.compile(r'^[ -~]*$')  # printable ASCII (i.e. no colors, tabs or line breaks)
+
+
+def simple_table(rows, headers):
+    '''The table tabulate makes in its "simple" format (columns of whole numbers aligned right,
+    others left) without loading it, or None when a cell is not plain text or a whole number.
+    '''
+    columns = len(headers) if headers else len(rows[0]) if rows else 0
+    texts = [[_plain_text(cell) for cell in row] for row in rows]
+    numeric = []
+    for i in range(columns):
+        values = [t[i] for t in texts if t[i] is not None]
+        if any(v is False for v in values):
+            return None
+        ints = [bool(_INT_RE.match(v)) for v in values]
+        if any(ints) and not all(ints) and '' in values:
+            return None  # versions of tabulate disagree on aligning these
+        numeric.append(bool(values) and all(ints))
+    widths = [max([len(t[i] or '') for t in texts] + [len(headers[i]) + 2 if headers else 0])
+              for i in range(columns)]
+
+    def line(cells):
+        return '  '.join((c or '').rjust(w) if n else (c or '').ljust(w)
+                         for c, w, n in zip(cells, widths, numeric)).rstrip()
+    rule = '  '.join('-' * w for w in widths).rstrip()
+    lines = [line(t) for t in texts]
+    if headers:
+        return '\n'.join([line(headers), rule] + lines)
+    return '\n'.join([rule] + lines + [rule]) if lines else ''
+
+
+def _plain_text(cell):
+    # None when missing and False when only tabulate can format it (e.g. colored or a float)
+    if cell is None:
+        return None
+    if isinstance(cell, (bool, bytes)) or hasattr(cell, '__float__') and not isinstance(cell, int):
+        return False
+    text = str(cell)  # as tabulate shows any other object
+    if _INT_RE.match(text) and isinstance(cell, (int, str)):
+        return text
+    if not _PLAIN_RE.match(text):
+        return False
+    try:
+        float(text)
+        return False
+    except ValueError:
+        return text
+
+
+def ranked(items, attribute, count=None, ascending=False):
+    '''Order items by the raw value of an attribute (items without a value are last). When only
+    the first count are wanted, a bounded heap is kept instead of sorting everything.
+    '''
+    if ascending:
+        def key(item):
+            value = _raw_value(item, attribute)
+            return (value is None, value)
+        if count:
+            return heapq.nsmallest(count, items, key=key)
+        return sorted(items, key=key)
+
+    def key(item):
+        value = _raw_value(item, attribute)
+        return (value is not None, value)
+    if count:
+        return heapq.nlargest(count, items, key=key)
+    return sorted(items, key=key, reverse=True)
+
+
 def lines(config, items, columns):
     serials = [s for s in serializers.default(config)
                if not isinstance(s, serializers.RelativeTimestampSerializer)] + \
@@ -86,6 +183,10 @@ def flatten(enumerable):
     return ' '.join(str(i) for i in expand(enumerable))
 
 
+def _raw_value(item, attribute):
+    return next(item.attrvals([attribute]))[1]
+
+
 def table_of(items, row_extractor):
     return (row_extractor.row_from(o) for o in items)
 
@@ -1,28 +1,46 @@
+import re
 from datetime import datetime
-import dateutil.parser
-import dateutil.relativedelta
-import dateutil.tz
 
+# `dateutil` is slow to load, so it is only imported once times are parsed or localized
+try:
+    from datetime import timezone
+    utc = timezone.utc
+except ImportError:  # Python 2
+    import dateutil.tz
+    utc = dateutil.tz.tzutc()
 
-epoch = datetime.fromtimestamp(0, tz=dateutil.tz.tzutc())
+
+epoch = datetime.fromtimestamp(0, tz=utc)
+
+# how Kubernetes writes times (e.g. "2017-04-23T00:00:00Z")
+RFC3339_UTC_RE = re.compile(r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)Z$')
 
 
 def now():
-    return datetime.now(dateutil.tz.tzlocal())
+    return datetime.now(_tzlocal())
 
 
 def parse(string, default=None):
     if string is None:
         return default
+    m = RFC3339_UTC_RE.match(string)
+    if m:  # most times, so these are parsed without loading dateutil
+        return datetime(*[int(g) for g in m.groups()], tzinfo=utc)
+    import dateutil.parser
     return dateutil.parser.parse(string)
 
 
+def to_epoch(stamp):
+    return (stamp - epoch).total_seconds()
+
+
 def delta(t1, t2):
+    import dateutil.relativedelta
     return dateutil.relativedelta.relativedelta(t1, t2)
 
 
 def as_local(stamp):
-    return stamp.astimezone(dateutil.tz.tzlocal())
+    return stamp.astimezone(_tzlocal())
 
 
 def in_words_from_now(stamp, sep='_', precision='{:0.1f}'):
@@ -36,7 +54,7 @@ def in_words_from_now(stamp, sep='_', precision='{:0.1f}'):
         words = ('from', 'now')
         rdate = delta(stamp, nw)
     if rdate.days > 0 or rdate.weeks > 0 or rdate.months > 0 or rdate.years > 0:
-        return stamp.astimezone(dateutil.tz.tzlocal()).isoformat()
+        return stamp.astimezone(_tzlocal()).isoformat()
     if rdate.hours > 0:
         value = rdate.hours + (rdate.minutes / 60.0)
         label = 'hours'
@@ -47,3 +65,8 @@ def in_words_from_now(stamp, sep='_', precision='{:0.1f}'):
         value = rdate.seconds + (rdate.microseconds / 1000000.0)
         label = 'sec'
     return sep.join((precision.format(value), label) + words)
+
+
+def _tzlocal():
+    import dateutil.tz
+    return dateutil.tz.tzlocal()
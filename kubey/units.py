@@ -0,0 +1,68 @@
+import re
+
+
+BYTE_UNITS = ('B', 'KiB', 'MiB', 'GiB', 'TiB')
+
+# suffixes of Kubernetes resource quantities (e.g. "250m" cores or "128Mi" bytes)
+CPU_SUFFIXES = {'': 1, 'n': 1e-9, 'u': 1e-6, 'm': 1e-3}
+BYTE_SUFFIXES = {'': 1, 'k': 10 ** 3, 'M': 10 ** 6, 'G': 10 ** 9, 'T': 10 ** 12, 'P': 10 ** 15,
+                 'E': 10 ** 18, 'Ki': 2 ** 10, 'Mi': 2 ** 20, 'Gi': 2 ** 30, 'Ti': 2 ** 40,
+                 'Pi': 2 ** 50, 'Ei': 2 ** 60}
+QUANTITY_RE = re.compile(r'^([+-]?[0-9.]+(?:[eE][+-]?[0-9]+)?)([a-zA-Z]*)$')
+
+
+def bytes_in_words(count, precision='{:0.1f}'):
+    value = float(count)
+    for unit in BYTE_UNITS[:-1]:
+        if abs(value) < 1024:
+            break
+        value /= 1024
+    else:
+        unit = BYTE_UNITS[-1]
+    if unit == 'B':
+        return '{0} {1}'.format(int(value), unit)
+    return '{0} {1}'.format(precision.format(value), unit)
+
+
+def cpu_cores(quantity):
+    '''Cores of a CPU quantity (e.g. "250m" is 0.25), or None if missing or unknown.'''
+    value = _quantity(quantity, CPU_SUFFIXES)
+    return None if value is None else float(value)
+
+
+def quantity_bytes(quantity):
+    '''Bytes of a memory quantity (e.g. "128Mi"), or None if missing or unknown.'''
+    value = _quantity(quantity, BYTE_SUFFIXES)
+    return None if value is None else int(value)
+
+
+def percent(value):
+    '''Number of a percentage (e.g. "12%"), or None if missing or unknown.'''
+    try:
+        return int(value.rstrip('%'))
+    except (AttributeError, ValueError):
+        return None
+
+
+def percent_of(value, total):
+    '''Whole percentage of value in total, or None if either is unknown.'''
+    if value is None or not total:
+        return None
+    return int(round(100.0 * value / total))
+
+
+def cpu_in_words(cores):
+    return '{0}m'.format(int(round(cores * 1000)))
+
+
+def rate_in_words(count, seconds):
+    if seconds <= 0:
+        return bytes_in_words(0) + '/s'
+    return bytes_in_words(count / seconds) + '/s'
+
+
+def _quantity(quantity, suffixes):
+    m = QUANTITY_RE.match(quantity or '')
+    if not m or m.group(2) not in suffixes:
+        return None  # e.g. "<unknown>" reported by `top` for metrics not yet collected
+    return float(m.group(1)) * suffixes[m.group(2)]
@@ -0,0 +1,175 @@
+import sys
+
+import click
+
+from . import serializers
+from . import tabular
+
+
+class WatchTable(object):
+    '''Rows of items kept up to date as each one changes (see `Kubey.watch_pods`).
+
+    Only the rows of a changed item are extracted and serialized again; subclasses decide how
+    that change is shown.
+    '''
+
+    def __init__(self, config, columns, flat=False, out=None):
+        self._flattener = tabular.flatten if flat else None
+        self._extractor = tabular.RowExtractor(config, columns, serializers.default(config))
+        self._headers = [] if config.no_headers else list(columns)
+        self._out = out or sys.stdout
+        self._keys = []
+        self._rows = {}
+
+    def update(self, key, item):
+        '''Show item as the latest state for key (None when it is gone).'''
+        old = self._rows.get(key)
+        if item is None:
+            if old is None:
+                return
+            index = self._keys.index(key)
+            del self._keys[index]
+            del self._rows[key]
+            self._removed(index, old)
+        else:
+            rows = [[str(cell) for cell in row]
+                    for row in tabular.each_row([item], self._flattener, self._extractor)]
+            if rows == old:
+                return
+            self._rows[key] = rows
+            if old is None:
+                self._keys.append(key)
+                self._added(len(self._keys) - 1, rows)
+            else:
+                self._changed(self._keys.index(key), old, rows)
+        self._out.flush()
+
+    def _added(self, index, rows):
+        raise NotImplementedError()
+
+    def _changed(self, index, old, rows):
+        raise NotImplementedError()
+
+    def _removed(self, index, old):
+        raise NotImplementedError()
+
+
+class DiffLog(WatchTable):
+    '''Appends each change as lines marked with "+" (added), "~" (changed) or "-" (removed), for
+    output that is not a terminal.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(DiffLog, self).__init__(*args, **kwargs)
+        if self._headers:
+            self._write('#', [self._headers])
+
+    def _added(self, _index, rows):
+        self._write('+', rows)
+
+    def _changed(self, _index, _old, rows):
+        self._write('~', rows)
+
+    def _removed(self, _index, old):
+        self._write('-', old)
+
+    def _write(self, mark, rows):
+        for row in rows:
+            self._out.write(' '.join([mark] + row).rstrip() + '\n')
+
+
+class LiveTable(WatchTable):
+    '''Redraws a table in place on a terminal, rewriting only the lines that changed.
+
+    Columns only ever widen (which redraws everything). Lines scrolled above the top of the
+    terminal are left alone.
+    '''
+
+    SEPARATOR = '  '
+
+    def __init__(self, *args, **kwargs):
+        super(LiveTable, self).__init__(*args, **kwargs)
+        self._widths = [len(h) for h in self._headers]
+        self._lines = []
+        self._header_count = 0
+        if self._headers:
+            self._lines = self._header_lines()
+            self._header_count = len(self._lines)
+            self._redraw_from(0, 0)
+
+    def _added(self, index, rows):
+        if self._widen(rows):
+            return
+        self._splice(self._start_of(index), 0, rows)
+
+    def _changed(self, index, old, rows):
+        if self._widen(rows):
+            return
+        start = self._start_of(index)
+        if len(old) != len(rows):
+            self._splice(start, len(old), rows)
+            return
+        for i, row in enumerate(rows):
+            line = self._format(row)
+            if line != self._lines[start + i]:
+                self._lines[start + i] = line
+                self._rewrite(start + i)
+
+    def _removed(self, index, old):
+        self._splice(self._start_of(index), len(old), [])
+
+    def _start_of(self, index):
+        return self._header_count + sum(len(self._rows[k]) for k in self._keys[:index])
+
+    def _splice(self, start, count, rows):
+        old_len = len(self._lines)
+        self._lines[start:start + count] = [self._format(row) for row in rows]
+        self._redraw_from(start, old_len)
+
+    def _widen(self, rows):
+        widths = list(self._widths)
+        for row in rows:
+            for i, cell in enumerate(row):
+                if i >= len(widths):
+                    widths.append(0)
+                widths[i] = max(widths[i], _width(cell))
+        if widths == self._widths:
+            return False
+        self._widths = widths
+        old_len = len(self._lines)
+        self._lines = self._header_lines() + \
+            [self._format(row) for key in self._keys for row in self._rows[key]]
+        self._redraw_from(0, old_len)
+        return True
+
+    def _header_lines(self):
+        if not self._headers:
+            return []
+        return [self._format(self._headers), self._format(['-' * w for w in self._widths])]
+
+    def _format(self, row):
+        return self.SEPARATOR.join(
+            cell + ' ' * (width - _width(cell)) for cell, width in zip(row, self._widths)).rstrip()
+
+    def _rewrite(self, index):
+        up = len(self._lines) - index
+        if up > self._visible_lines():
+            return
+        self._out.write('\x1b[%dA\r%s\x1b[K\x1b[%dB\r' % (up, self._lines[index], up))
+
+    def _redraw_from(self, index, old_len):
+        # the cursor always rests on the line just below the table
+        index = max(index, old_len - self._visible_lines())
+        if old_len > index:
+            self._out.write('\x1b[%dA\r' % (old_len - index))
+        for line in self._lines[index:]:
+            self._out.write(line + '\x1b[K\n')
+        self._out.write('\x1b[J')
+
+    @staticmethod
+    def _visible_lines():
+        return click.get_terminal_size()[1] - 1
+
+
+def _width(cell):
+    return len(click.unstyle(cell))
@@ -35,7 +35,8 @@ setup(
                  'kubey'},
     entry_points={
         'console_scripts': [
-            'kubey=kubey.cli:cli'
+            'kubey=kubey.cli:cli',
+            'kubey-complete=kubey.complete:main',
         ]
     },
     include_package_data=True,
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+'''
+benchmark_startup
+----------------------------------
+
+Time from launch to finished output of common `kubey` invocations against a warm cache, using a
+stand-in kubectl (so no cluster is needed). Exits non-zero if the median of any is over budget.
+
+Budgets are for the time kubey adds to starting Python and importing click (measured first, as
+the baseline), so that they hold on slower and faster machines alike.
+
+    python tests/benchmark_startup.py [--runs N] [--pods N]
+'''
+
+import argparse
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+
+BASELINE = [sys.executable, '-c', 'import click']
+
+# command => milliseconds allowed over the baseline
+COMMANDS = (
+    (['--help'], 50),
+    (['.', 'list', '--help'], 60),
+    (['.', 'list'], 80),
+    (['cache', 'stats'], 50),
+)
+
+FAKE_KUBECTL = '''#!{python}
+import sys
+if 'pods' in sys.argv:
+    sys.stdout.write(open({pods!r}).read())
+else:
+    sys.stdout.write('{{"items": []}}')
+'''
+
+
+def pod(i):
+    name = 'web-{0}'.format(i)
+    return {
+        'metadata': {'name': name, 'namespace': 'production'},
+        'spec': {'nodeName': 'node-{0}'.format(i % 10),
+                 'containers': [{'name': 'app', 'image': 'app:1'}]},
+        'status': {'phase': 'Running', 'startTime': '2017-04-23T00:00:00Z',
+                   'containerStatuses': [{'name': 'app', 'ready': True, 'restartCount': 0,
+                                          'state': {'running': {
+                                              'startedAt': '2017-04-23T00:00:00Z'}}}]},
+    }
+
+
+def setup(root, pods):
+    home = os.path.join(root, 'home')
+    bin_dir = os.path.join(root, 'bin')
+    os.makedirs(os.path.join(home, '.kube'))
+    os.makedirs(bin_dir)
+    with open(os.path.join(home, '.kube', 'config'), 'w') as f:
+        f.write('apiVersion: v1\ncurrent-context: bench\n')
+    pods_path = os.path.join(root, 'pods.json')
+    with open(pods_path, 'w') as f:
+        json.dump({'items': [pod(i) for i in range(pods)]}, f)
+    kubectl = os.path.join(bin_dir, 'kubectl')
+    with open(kubectl, 'w') as f:
+        f.write(FAKE_KUBECTL.format(python=sys.executable, pods=pods_path))
+    os.chmod(kubectl, os.stat(kubectl).st_mode | stat.S_IEXEC)
+    env = dict(os.environ, HOME=home, PATH=bin_dir + os.pathsep + os.environ.get('PATH', ''))
+    env.pop('KUBECONFIG', None)
+    return env
+
+
+def run(args, env):
+    return time_of([sys.executable, '-m', 'kubey.cli', '-n', '.'] + args, env)
+
+
+def time_of(argv, env):
+    started = time.time()
+    subprocess.check_call(argv, env=env, stdout=open(os.devnull, 'w'))
+    return (time.time() - started) * 1000
+
+
+def median(times):
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[-1])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--pods', type=int, default=100)
+    opts = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='kubey-bench-')
+    try:
+        env = setup(root, opts.pods)
+        run(['.', 'list'], env)  # warm the cache (and bytecode)
+        baseline = median([time_of(BASELINE, env) for _ in range(opts.runs)])
+        print('{0:<28} median {1:6.1f}ms'.format('baseline (python + click)', baseline))
+        over = 0
+        for args, budget in COMMANDS:
+            added = median([run(args, env) for _ in range(opts.runs)]) - baseline
+            over += added > budget
+            print('{0:<28} median {1:+6.1f}ms{2}'.format(
+                'kubey ' + ' '.join(args), added,
+                '  (over {0}ms)'.format(budget) if added > budget else ''))
+    finally:
+        shutil.rmtree(root)
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,15 +7,50 @@ test_kubey
 Tests for `kubey` module.
 '''
 
+import gzip
+import io
+import json
+import logging
 import os
 import re
+import signal
+import socket
 import subprocess
+import sys
 import time
+import click
 import pytest
 import mockfs
+import tabulate  # (kubey loads it lazily, and loading it must happen before mockfs)
 
 from click.testing import CliRunner
+from kubey import cache
 from kubey import cli
+from kubey import complete
+from kubey import kubectl
+from kubey.kubectl import KubeCtl
+from kubey.background_popen import BackgroundPopen
+from kubey.broadcaster import Broadcaster
+from kubey.cache_dir import CacheDir
+from kubey.rate_limiter import RateLimiter
+from kubey.ring_buffer import RingBuffer
+from kubey.event_store import EventStore
+from kubey.execution import Execution
+from kubey.file_lock import FileLock
+from kubey.file_popen import FilePopen
+from kubey.log_archive import LogArchive
+from kubey.name_index import NameIndex
+from kubey.port_forward import Backend, ForwardProxy
+from kubey import jsonpath
+from kubey import projection
+from kubey import refresh
+from kubey.kubey import Kubey
+from kubey.pod import Pod
+from kubey.selector import Selector
+from kubey import tabular
+from kubey import timestamp
+from kubey import units
+from kubey.watch_table import DiffLog
 from configstruct import OpenStruct
 
 
@@ -46,16 +81,18 @@ class Responder(object):
 class MockSubprocess(object):
     ATTRS = ('check_output', 'call', 'Popen')
 
-    def setup(self):
+    def setup_method(self):
         def mock_getmtime(_):
             return time.time()
+        self._orig_getmtime = os.path.getmtime
         os.path.getmtime = mock_getmtime
         self.mfs = mockfs.replace_builtins()
         self.responders = OpenStruct()
         for name in self.ATTRS:
             self._intercept(name)
 
-    def teardown(self):
+    def teardown_method(self):
+        os.path.getmtime = self._orig_getmtime
         mockfs.restore_builtins()
         for name in self.ATTRS:
             self._release(name)
@@ -86,15 +123,997 @@ class TestCli(MockSubprocess):
         assert help_result.exit_code == 0
         assert 'Show this message and exit.' in help_result.output
 
-    def test_empty_list(self):
-        self.responders.check_output.expect('which kubectl', and_return='mykubectl')
-        self.responders.check_output.expect('mykubectl config current-context', and_return='myctx')
+    def test_empty_list(self, tmpdir, monkeypatch):
+        # kubectl is looked up and the context read from KUBECONFIG without running anything
+        monkeypatch.setattr(kubectl, 'which', {'kubectl': 'mykubectl'}.get)
+        self.mfs.add_entries({'/kube/config': 'apiVersion: v1\ncurrent-context: "myctx"\n'})
         self.responders.check_output.expect(
             'mykubectl --context myctx get --output=json pods --all-namespaces',
             and_return='{"items":[]}'
         )
         runner = CliRunner()
-        result = runner.invoke(cli.cli, ['-n', '.', '--wide', 'myprod'], catch_exceptions=False)
+        result = runner.invoke(cli.cli, ['-n', '.', '--wide', 'myprod'], catch_exceptions=False,
+                               env={'KUBEY_CACHE_DIR': str(tmpdir),
+                                    'KUBECONFIG': '/missing:/kube/config'})
         exp = ['node', 'status', 'name', 'node-ip', 'namespace', 'containers']
         cols = [str(c) for c in re.split(r'\s+', result.output.strip()) if not c.startswith('---')]
         assert exp.sort() == cols.sort()  # FIXME: order should not matter...but does in tox runs
+
+
+class TestStartup(object):
+
+    def test_cli_import_defers_slow_modules(self):
+        loaded = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, kubey.cli; print(" ".join(sorted(sys.modules)))']).decode().split()
+        assert not set(['tabulate', 'dateutil.parser', 'sqlite3', 'tarfile']) & set(loaded)
+
+
+class TestBroadcaster(object):
+
+    def test_each_stream_receives_whole_input(self):
+        source = io.BytesIO(b'x' * 100000)
+        broadcaster = Broadcaster(source, chunk_size=4096)
+        sinks = [io.BytesIO() for _ in range(3)]
+        for sink in sinks:
+            sink.close = lambda: None  # keep contents readable after feeding completes
+            broadcaster.attach(sink)
+        broadcaster.join()
+        assert broadcaster.size == 100000
+        assert all(sink.getvalue() == b'x' * 100000 for sink in sinks)
+
+    def test_input_beyond_memory_bound_is_spilled_and_replayed_to_late_streams(self):
+        data = os.urandom(50000)
+        broadcaster = Broadcaster(io.BytesIO(data), chunk_size=1000, memory_bytes=10000)
+        early = io.BytesIO()
+        early.close = lambda: None
+        broadcaster.attach(early)
+        broadcaster.join()
+        late = io.BytesIO()
+        late.close = lambda: None
+        broadcaster.attach(late)  # e.g. the next container of a sequential `each --stdin`
+        broadcaster.join()
+        assert broadcaster._buffer._rolled  # no longer held in memory
+        assert early.getvalue() == data and late.getvalue() == data
+
+
+class TestCache(object):
+
+    @staticmethod
+    def _cache(path, objs, outcomes):
+        return cache.Cache(str(path), 60, lambda: objs.pop(0),
+                           on_access=lambda _name, outcome: outcomes.append(outcome))
+
+    def test_written_compressed_and_atomically(self, tmpdir, monkeypatch):
+        path = tmpdir.join('pods.json.gz')
+        outcomes = []
+        assert self._cache(path, [{'items': [1]}], outcomes).obj() == {'items': [1]}
+        assert cache.read(str(path)) == {'items': [1]}
+        assert gzip.open(str(path)).read() == b'{"items":[1]}'
+
+        def interrupted(_fd, _data):
+            raise OSError('disk full')
+        monkeypatch.setattr(os, 'write', interrupted)
+        with pytest.raises(OSError):
+            cache.write_atomically(str(path), b'partial')
+        assert cache.read(str(path)) == {'items': [1]}  # untouched
+        assert sorted(p.basename for p in tmpdir.listdir()) == \
+            ['pods.json.gz', 'pods.json.gz.lock']  # and nothing left beside it
+        assert self._cache(path, [], outcomes).obj() == {'items': [1]}
+        assert outcomes == [cache.Cache.MISS, cache.Cache.HIT]
+
+    @pytest.mark.parametrize('content', [b'', b'not gzip', b'\x1f\x8b\x08\x00trunc'])
+    def test_unreadable_file_discarded(self, tmpdir, content):
+        path = tmpdir.join('pods.json.gz')
+        path.write_binary(content)
+        outcomes = []
+        assert self._cache(path, [{'items': []}], outcomes).obj() == {'items': []}
+        assert outcomes == [cache.Cache.MISS]
+        assert cache.read(str(path)) == {'items': []}
+
+    def test_file_lock_excludes_other_holders(self, tmpdir):
+        path = str(tmpdir.join('pods.json.gz.lock'))
+        other = FileLock(path)  # its own descriptor, as in another process
+        assert not other.is_held()
+        with FileLock(path):
+            assert other.is_held()
+        assert not other.is_held()
+
+
+class TestCacheDir(object):
+
+    def test_keys_keep_contexts_apart(self):
+        contexts = ['a.b', 'a-b', 'a_b', 'gke_proj_us-east1_web', 'arn:aws:eks:us/web', u'caf\xe9']
+        keys = [CacheDir.key_for(c) for c in contexts]
+        assert len(set(keys)) == len(contexts)
+        assert not [k for k in keys if '.' in k or '_' in k]
+        assert [CacheDir.context_for(k) for k in keys] == contexts
+
+    def test_least_recently_accessed_evicted_first(self, tmpdir):
+        cache_dir = CacheDir(str(tmpdir))
+        paths = [tmpdir.join('ctx_%s.json.gz' % name) for name in ('pods', 'nodes', 'events')]
+        for age, path in enumerate(paths):
+            path.write('x' * 100)
+            os.utime(str(path), (time.time() - 100 * (3 - age), time.time()))
+        cache_dir.record('ctx', 'pods', cache.Cache.HIT)  # now the most recent
+        evicted = cache_dir.prune(150)
+        assert [os.path.basename(p) for p, _size in evicted] == \
+            ['ctx_nodes.json.gz', 'ctx_events.json.gz']
+        assert [p.check() for p in paths] == [True, False, False]
+
+    def test_stats_written_once_per_run_or_on_misses(self, tmpdir):
+        cache_dir = CacheDir(str(tmpdir))
+        tmpdir.join(CacheDir.key_for('a.b') + '_pods.json.gz').write('x' * 10)
+        for _ in range(3):
+            cache_dir.record('a.b', 'pods', cache.Cache.HIT)
+        assert not tmpdir.join(CacheDir.STATS_FILENAME).check()
+        cache_dir.record('a.b', 'pods', cache.Cache.MISS)
+        cache_dir.record('a.b', 'nodes', cache.Cache.STALE)
+        assert [(s['hit'], s['stale'], s['miss']) for s in CacheDir(str(tmpdir)).stats()] == \
+            [(3, 0, 1)]
+        cache_dir.flush()
+        [summary] = CacheDir(str(tmpdir)).stats()
+        assert (summary['context'], summary['files'], summary['bytes']) == ('a.b', 1, 10)
+        assert (summary['hit'], summary['stale'], summary['miss']) == (3, 1, 1)
+
+    def test_commands_need_no_match_nor_kubectl(self, tmpdir, monkeypatch):
+        monkeypatch.setenv('PATH', str(tmpdir))  # no kubectl
+        monkeypatch.setenv('HOME', str(tmpdir))  # nor files of older versions
+        tmpdir.join('ctx_pods.json.gz').write('x' * 2048)
+        runner = CliRunner(env={'KUBEY_CACHE_DIR': str(tmpdir)})
+        result = runner.invoke(cli.cli, ['cache', 'stats'], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert result.output.splitlines()[2].split()[:3] == ['ctx', '1', '2.0']
+        result = runner.invoke(cli.cli, ['-n', '.', 'cache', 'prune', '--max-mb', '0'],
+                               catch_exceptions=False)
+        assert result.output == 'evicted 1 files (2.0 KiB)\n'
+
+
+class TestRefresh(object):
+
+    @pytest.fixture
+    def flaky(self, tmpdir, monkeypatch):
+        _fake_kubectl(tmpdir, monkeypatch, FLAKY_KUBECTL)
+        monkeypatch.setattr(KubeCtl, 'BACKOFF_SECONDS', 0.01)
+        monkeypatch.setenv('FAKE_ATTEMPTS', 'fail ok')
+        return str(tmpdir.join('kubectl'))
+
+    def test_requested_like_the_kubey_that_started_it(self, tmpdir, flaky):
+        kubectl = KubeCtl('test', timeout=5, retries=1)
+        kubectl.rate_limiter = RateLimiter(str(tmpdir.join('rate')), qps=100)
+        path = str(tmpdir.join('pods.json.gz'))
+        argv = refresh.refresh_argv(kubectl, [flaky, 'get', 'pods'])
+        assert argv[:4] == ['--timeout', '5', '--retries', '1']
+        refresh.main([path, '60', ''] + argv)
+        assert cache.read(path) == {'attempt': 1}  # retried
+        assert tmpdir.join('rate').check()  # and rate limited
+
+    def test_expired_served_while_refreshed_in_background(self, tmpdir, flaky, monkeypatch):
+        monkeypatch.setenv('PYTHONPATH', os.path.dirname(os.path.dirname(cli.__file__)))
+        path = tmpdir.join('pods.json.gz')
+        cache.Cache(str(path), 60, lambda: {'attempt': None}).obj()
+        path.setmtime(time.time() - 10)
+        outcomes = []
+        served = cache.Cache(
+            str(path), 5, lambda: pytest.fail('retrieved in the foreground'), max_age=60,
+            refresh_argv=refresh.refresh_argv(KubeCtl(retries=1), [flaky, 'get', 'pods']),
+            on_access=lambda _name, outcome: outcomes.append(outcome))
+        assert served.obj() == {'attempt': None}
+        assert outcomes == [cache.Cache.STALE]
+        expires = time.time() + 10
+        while cache.read(str(path)) != {'attempt': 1} and time.time() < expires:
+            time.sleep(0.05)
+        assert cache.read(str(path)) == {'attempt': 1}
+
+
+class TestRateLimiter(object):
+
+    def test_burst_then_paced_across_instances(self, tmpdir):
+        path = str(tmpdir.join('rate'))
+        first = RateLimiter(path, qps=10, burst=2)
+        second = RateLimiter(path, qps=10, burst=2)  # as if from another process
+        assert first.acquire() == 0
+        assert second.acquire() == 0
+        assert 0 < first.acquire() <= 0.1
+        assert first.queued_calls == 1
+
+
+class TestProjection(object):
+
+    def test_keeps_only_requested_paths_through_lists(self):
+        doc = {'items': [{'metadata': {'name': 'a', 'managedFields': [{}]},
+                          'spec': {'containers': [{'name': 'c', 'env': [{'name': 'X'}]}]}}]}
+        fields = ['items.metadata.name', 'items.spec.containers.name']
+        assert projection.project(doc, fields) == {
+            'items': [{'metadata': {'name': 'a'}, 'spec': {'containers': [{'name': 'c'}]}}]}
+
+    def test_pod_fields_build_a_pod(self):
+        info = {'metadata': {'name': 'p', 'namespace': 'ns', 'uid': 'x'},
+                'spec': {'nodeName': 'n', 'volumes': [{}],
+                         'containers': [{'name': 'c', 'image': 'i', 'env': []}]},
+                'status': {'phase': 'Running', 'containerStatuses': [
+                    {'name': 'c', 'ready': True, 'restartCount': 0, 'imageID': 'x',
+                     'state': {'running': {'startedAt': '2017-04-23T00:00:00Z'}}}]}}
+        pod = Pod(OpenStruct(), projection.project(info, Pod.FIELDS), lambda _name: True)
+        assert pod.name == 'p' and pod.containers[0].image == 'i'
+
+
+class TestPodUsage(object):
+
+    @staticmethod
+    def _pod(usage, requests=None):
+        info = {'metadata': {'name': 'p', 'namespace': 'ns'}, 'spec': {'containers': [
+                    {'name': 'c', 'image': 'i', 'resources': {'requests': requests or {}}}]},
+                'status': {'phase': 'Running', 'containerStatuses': [
+                    {'name': 'c', 'ready': True, 'restartCount': 0, 'state': {'running': {}}}]}}
+        return Pod(OpenStruct(), projection.project(info, Pod.FIELDS), lambda _name: True, usage)
+
+    def test_usage_against_requests(self):
+        pod = self._pod({'c': ('125m', '1Gi')}, {'cpu': '0.5'})
+        assert (pod.cpu, pod.memory, pod.cpu_percent_of_request) == (0.125, 2 ** 30, 25)
+
+    def test_unknown_usage_or_requests(self):
+        assert self._pod({'c': ('125m', '1Gi')}).cpu_percent_of_request is None
+        pod = self._pod({'c': ('<unknown>', '<unknown>')}, {'cpu': '0.5'})
+        assert (pod.cpu, pod.memory, pod.cpu_percent_of_request) == (None, None, None)
+        assert self._pod(None).cpu is None
+
+
+class TestSummarize(object):
+
+    @staticmethod
+    def _kubey(*pods):
+        kubey = Kubey(OpenStruct(match='.', namespace=Kubey.ANY))
+        kubey._caches['pods'] = OpenStruct(obj=lambda: {'items': list(pods)})
+        return kubey
+
+    @staticmethod
+    def _pod(name, node, labels, *containers):
+        return {'metadata': {'name': name, 'namespace': 'production', 'labels': labels},
+                'spec': {'nodeName': node,
+                         'containers': [{'name': c, 'image': i} for c, i, _r, _n in containers]},
+                'status': {'phase': 'Running', 'containerStatuses': [
+                    {'name': c, 'ready': r, 'restartCount': n} for c, _i, r, n in containers]}}
+
+    def test_by_field_with_ready_containers_and_restarts(self):
+        kubey = self._kubey(
+            self._pod('web-1', 'node-1', None,
+                      ('app', 'web:1', True, 2), ('log', 'log:1', False, 5)),
+            self._pod('web-2', 'node-1', None, ('app', 'web:1', True, 0)),
+            self._pod('db-1', '', None, ('pg', 'pg:9', True, 1)),
+            self._pod('db-2', None, None, ('pg', 'pg:9', False, 0)))
+        assert kubey.summarize('node') == [['<none>', 2, 2, 1, 1], ['node-1', 2, 3, 2, 7]]
+        assert kubey.summarize('image') == [['pg:9', 2, 2, 1, 1], ['web:1', 2, 2, 2, 2],
+                                            ['log:1', 1, 1, 0, 5]]
+
+    def test_by_label_normalized_and_limited(self):
+        kubey = self._kubey(
+            self._pod('web-1', 'node-1', {'tier': 'front'}, ('app', 'web:1', True, 0)),
+            self._pod('web-2', 'node-1', {'tier': ''}, ('app', 'web:1', True, 0)),
+            self._pod('web-3', 'node-1', {}, ('app', 'web:1', False, 0)),
+            self._pod('web-4', 'node-1', None, ('app', 'web:1', True, 0)))
+        assert kubey.summarize('label', 'tier') == [['<none>', 3, 3, 2, 0], ['front', 1, 1, 1, 0]]
+        assert kubey.summarize('label', 'tier', limit=2) == \
+            [['<none>', 1, 1, 1, 0], ['front', 1, 1, 1, 0]]
+
+
+class TestSelector(object):
+
+    @staticmethod
+    def _pod(name, node='node-1', phase='Running', restarts=0, labels=None):
+        return {'metadata': {'name': name, 'namespace': 'production', 'labels': labels},
+                'spec': {'nodeName': node},
+                'status': {'phase': phase, 'containerStatuses': [{'restartCount': restarts}]}}
+
+    def test_alternatives_select_their_own_containers(self):
+        selector = Selector('WEB,node-2/db/pg')
+        assert selector.match_pod(self._pod('web-1'))('anything')
+        assert selector.match_pod(self._pod('db-1')) is None
+        containers = selector.match_pod(self._pod('db-1', node='node-2'))
+        assert containers('pg') and not containers('backup')
+
+    def test_regex_and_predicates(self):
+        selector = Selector('^web-[0-9]+$', 'prod', phases=['running'], min_restarts=2,
+                            labels={'app': 'web', 'tier': None})
+        labels = {'app': 'web', 'tier': 'front'}
+        assert selector.match_pod(self._pod('web-1', restarts=2, labels=labels))
+        assert not selector.match_pod(self._pod('web-x', restarts=2, labels=labels))
+        assert not selector.match_pod(self._pod('web-1', restarts=1, labels=labels))
+        assert not selector.match_pod(self._pod('web-1', restarts=2, labels={'app': 'web'}))
+        assert not selector.match_pod(self._pod('web-1', phase='Pending', restarts=2,
+                                                labels=labels))
+
+    def test_events_by_involved_object_only_when_asked(self):
+        event = {'metadata': {'name': 'db.15f3', 'namespace': 'production'},
+                 'involvedObject': {'name': 'web-1'}, 'source': {'host': 'node-1'}}
+        selector = Selector('^web-1$', 'production')
+        assert not selector.match_event(event)
+        assert selector.match_event(event, involved=True)
+        assert Selector('db', 'production').match_event(event)
+
+
+class TestRanked(object):
+
+    def test_top_keeps_largest_with_missing_values_last(self):
+        items = [OpenStruct(v=v, attrvals=lambda a, v=v: iter([(a[0], v)]))
+                 for v in (3, None, 7, 1, 5)]
+        assert [i.v for i in tabular.ranked(items, 'v', 2)] == [7, 5]
+        assert [i.v for i in tabular.ranked(iter(items), 'v')] == [7, 5, 3, 1, None]
+        assert [i.v for i in tabular.ranked(items, 'v', 3, ascending=True)] == [1, 3, 5]
+
+
+class TestSimpleTable(object):
+
+    @pytest.mark.parametrize('rows,headers', [
+        ([['web-1', 'Running', 3, None], ['db-10', 'Pending', 12, 'x y']],
+         ['NAME', 'PHASE', 'N', 'O']),
+        ([['a', -1], ['bb', 200]], []),
+        ([['a', 'b']], ['LONGER', 'L']),
+        ([], ['NAME']),
+    ])
+    def test_same_as_tabulate(self, rows, headers):
+        assert tabular.simple_table(rows, headers) == tabulate.tabulate(rows, headers)
+
+    @pytest.mark.parametrize('cell', [1.5, '2.5', '1e3', True, b'x', u'caf\u00e9'])
+    def test_leaves_cells_it_cannot_match_to_tabulate(self, cell):
+        assert tabular.simple_table([['a', cell]], ['N', 'V']) is None
+
+
+class TestTimestamp(object):
+
+    def test_parses_kubernetes_times_like_dateutil(self):
+        from dateutil.parser import parse
+        for text in ('2017-03-01T12:34:56Z', '2017-03-01T12:34:56.1Z', '2017-03-01 12:34:56+02:00'):
+            assert timestamp.parse(text) == parse(text)
+
+
+class TestJsonPath(object):
+
+    def test_kubectl_custom_column_paths(self):
+        pod = {'metadata': {'name': 'web-1', 'labels': {'app.kubernetes.io/name': 'web'}},
+               'spec': {'containers': [{'image': 'app:1'}, {'image': 'proxy:2'}]}}
+        assert jsonpath.find(pod, jsonpath.compile_path('.metadata.name')) == ['web-1']
+        assert jsonpath.find(pod, jsonpath.compile_path('{.spec.containers[*].image}')) == \
+            ['app:1', 'proxy:2']
+        assert jsonpath.find(pod, jsonpath.compile_path('.spec.containers[-1].image')) == \
+            ['proxy:2']
+        assert jsonpath.find(pod, jsonpath.compile_path(
+            ".metadata.labels['app.kubernetes.io/name']")) == ['web']
+        assert jsonpath.find(pod, jsonpath.compile_path('.status.phase')) == []
+        with pytest.raises(ValueError):
+            jsonpath.compile_path('.spec..image')
+
+    def test_items_merged_in_namespace_order(self):
+        collector = tabular.ItemCollector()
+        collector.handler_for('staging')({'kind': 'List', 'items': [{'n': 3}]})
+        collector.handler_for('default')({'n': 1})  # a single object when one name is given
+        collector.handler_for('production')({'kind': 'List', 'items': []})
+        assert collector.items == [{'n': 1}, {'n': 3}]
+
+
+class TestDiffLog(object):
+
+    def test_only_changes_are_written(self):
+        out = io.StringIO()
+        config = OpenStruct(no_headers=True, namespace='production')
+        table = DiffLog(config, ['v'], out=out)
+        item = OpenStruct(v=1, attrvals=lambda a: iter([('v', item.v)]))
+        table.update('a', item)
+        table.update('a', item)
+        item.v = 2
+        table.update('a', item)
+        table.update('a', None)
+        table.update('b', None)
+        assert out.getvalue() == '+ 1\n~ 2\n- 2\n'
+
+
+class TestRingBuffer(object):
+
+    def test_keeps_latest_values_and_summarizes_them(self):
+        ring = RingBuffer(20)
+        for value in range(1, 31):
+            ring.append(value)
+        assert len(ring) == 20 and ring.values() == list(range(11, 31))
+        assert ring.summary() == (11, 20.5, 29, 30)
+        assert RingBuffer(3).summary() is None
+
+
+class TestEventStore(object):
+
+    @staticmethod
+    def _event(uid, pod, reason, last):
+        return {'metadata': {'uid': uid, 'name': pod + '.x', 'namespace': 'production'},
+                'involvedObject': {'kind': 'Pod', 'name': pod}, 'source': {'host': 'node-1'},
+                'reason': reason, 'lastTimestamp': last}
+
+    def test_history_survives_and_updates_by_uid(self, tmpdir):
+        now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        store = EventStore(str(tmpdir.join('events.sqlite')))
+        store.save([self._event('1', 'web-1', 'BackOff', '2000-01-01T00:00:00Z'),
+                    self._event('2', 'web-2', 'Pulled', now)])
+        store.save([self._event('1', 'web-1', 'BackOff', now)])
+        assert sorted(e['metadata']['uid'] for e in store.query(time.time() - 60)) == ['1', '2']
+        assert [e['reason'] for e in store.query(involved_name='web-2')] == ['Pulled']
+
+
+class TestLogArchive(object):
+
+    def test_streams_rotate_and_reopen_within_open_file_limit(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(LogArchive, 'BUFFER_BYTES', 100)
+        archive = LogArchive(str(tmpdir), 'gzip', rotate_bytes=1000, max_open=2)
+        streams = [archive.stream('production', 'web-%d' % i, 'app') for i in range(5)]
+        for n in range(200):
+            for write in streams:
+                write(b'line %d\n' % n)
+            assert len(archive._open) <= 2
+        archive.close()
+        segments = sorted(tmpdir.join('production', 'web-3').listdir())
+        assert [s.basename for s in segments[:2]] == ['app.0001.log.gz', 'app.0002.log.gz']
+        lines = b''.join(gzip.open(str(s)).read() for s in segments).decode().splitlines()
+        assert lines == ['line %d' % n for n in range(200)]
+        assert max(len(gzip.open(str(s)).read()) for s in segments) <= 1000
+
+    def test_quiet_streams_written_as_is_by_timer(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(LogArchive, 'FLUSH_SECONDS', 0.1)
+        archive = LogArchive(str(tmpdir))
+        archive.stream('production', 'web-0', 'app')(b'caf\xc3\xa9 \xff\r\n')
+        path = tmpdir.join('production', 'web-0', 'app.0001.log')
+        expires = time.time() + 5
+        while not (path.check() and path.size()) and time.time() < expires:
+            time.sleep(0.05)
+        assert path.read_binary() == b'caf\xc3\xa9 \xff\r\n'  # before closing
+        archive.close()
+
+    def test_stream_written_while_another_is(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(LogArchive, 'BUFFER_BYTES', 1)
+        archive = LogArchive(str(tmpdir), max_open=1)
+        busy, quick = [archive.stream('web-%d' % i) for i in range(2)]
+        busy(b'one\n')
+        with archive._streams[0].io_lock:  # e.g. still compressing
+            quick(b'two\n')  # neither waits for it nor closes its file
+            assert archive._streams[0].file
+        busy(b'three\n')
+        archive.close()
+        assert tmpdir.join('web-0.0001.log').read_binary() == b'one\nthree\n'
+        assert tmpdir.join('web-1.0001.log').read_binary() == b'two\n'
+
+
+class TestForwardProxy(object):
+
+    @pytest.fixture
+    def backends(self):
+        servers = []
+        backends = []
+        for i in range(2):
+            server = socket.socket()
+            server.bind(('127.0.0.1', 0))
+            server.listen(8)
+            servers.append(server)
+            backend = Backend(None, OpenStruct(namespace='production', name='web-%d' % i), 80)
+            backend.local_port = server.getsockname()[1]
+            backends.append(backend)
+        yield backends, servers
+        for server in servers:
+            server.close()
+
+    @staticmethod
+    def _request(proxy, data):
+        client = socket.create_connection(('127.0.0.1', proxy.port))
+        client.sendall(data)
+        client.shutdown(socket.SHUT_WR)
+        return client
+
+    @staticmethod
+    def _respond(server):
+        conn = server.accept()[0]
+        data = conn.makefile('rb').read()
+        conn.sendall(data.upper())
+        conn.close()
+
+    @staticmethod
+    def _settle(backend):
+        deadline = time.time() + 5
+        while backend.active and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_least_connections_and_counters(self, backends):
+        backends, servers = backends
+        proxy = ForwardProxy(backends, balancing='least-connections')
+        proxy.start()
+        try:
+            held = self._request(proxy, b'held')  # stays active until answered
+            held_server = servers[0].accept()[0]
+            for _ in range(3):
+                client = self._request(proxy, b'abc')
+                self._respond(servers[1])
+                assert client.makefile('rb').read() == b'ABC'
+                client.close()
+                self._settle(backends[1])
+            held_server.sendall(b'done')
+            held_server.close()
+            assert held.makefile('rb').read() == b'done'
+            held.close()
+            self._settle(backends[0])
+        finally:
+            proxy.close()
+        assert [(b.connections, b.active) for b in backends] == [(1, 0), (3, 0)]
+        assert (backends[1].bytes_sent, backends[1].bytes_received) == (9, 9)
+
+
+class TestComplete(object):
+
+    @staticmethod
+    def _cache(path, items):
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as gz:
+            gz.write(json.dumps({'items': items}).encode('utf-8'))
+        cache.write_atomically(str(path), buf.getvalue())
+
+    @staticmethod
+    def _pod(namespace, name, node, *containers):
+        return {'metadata': {'namespace': namespace, 'name': name},
+                'spec': {'nodeName': node, 'containers': [{'name': c} for c in containers]}}
+
+    def test_completes_one_level_at_a_time_from_index(self, tmpdir):
+        pods, nodes = tmpdir.join('pods.json.gz'), tmpdir.join('nodes.json.gz')
+        self._cache(pods, [self._pod('production', 'web-1', 'node-1', 'app', 'proxy'),
+                           self._pod('production', 'web-2', 'node-2', 'app'),
+                           self._pod('staging', 'web-3', 'node-1', 'app')])
+        self._cache(nodes, [{'metadata': {'name': 'node-1'}}, {'metadata': {'name': 'node-9'}}])
+        index = NameIndex(str(tmpdir.join('names.txt')), [str(pods), str(nodes)])
+        assert complete.candidates(index, 'web') == ['web-1/', 'web-2/']
+        assert complete.candidates(index, 'web', '.') == ['web-1/', 'web-2/', 'web-3/']
+        assert complete.candidates(index, 'web-1/') == ['web-1/app', 'web-1/proxy']
+        assert complete.candidates(index, 'node-') == ['node-1/', 'node-2/', 'node-9/']
+        assert complete.candidates(index, 'node-1/') == ['node-1/web-1/']
+        assert complete.candidates(index, 'db,web-2') == ['db,web-2/']
+        # persisted, so the cached JSON is only read again once rewritten
+        assert NameIndex(str(tmpdir.join('names.txt')), [str(pods)])._is_stale() is False
+        os.utime(str(pods), (time.time() + 10, time.time() + 10))
+        assert NameIndex(str(tmpdir.join('names.txt')), [str(pods)])._is_stale() is True
+
+    def test_only_match_is_completed(self):
+        assert complete.parse_options(['-n', 'staging', '--context=prod']) == \
+            {'-n': 'staging', '--context': 'prod'}
+        assert complete.parse_options(['--wide', 'web-1']) is None
+
+    def test_value_options_agree_with_cli(self):
+        options = [p for p in cli.cli.params if isinstance(p, click.Option)]
+        assert complete.VALUE_OPTIONS == set(
+            name for p in options if not p.is_flag for name in p.opts)
+        assert complete.DEFAULT_NAMESPACE == \
+            [p for p in options if p.name == 'namespace'][0].default
+
+
+# runs commands "in" a pod as a directory of the same name under "pods" (pods listed in FAKE_FAIL
+# fail instead)
+FAKE_KUBECTL = '''
+import json, os, shutil, subprocess, sys
+args = sys.argv[3:]  # after "--context test"
+pods = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pods')
+
+
+def in_pod(pod):
+    if pod in os.environ.get('FAKE_FAIL', '').split():
+        sys.stderr.write('error: unable to upgrade connection: container not found\\n')
+        sys.exit(1)
+    path = os.path.join(pods, pod)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+if '--watch' in args:
+    # each watch reports the events so far and one more (the third fails)
+    with open(os.path.join(os.path.dirname(pods), 'watches'), 'a+') as f:
+        f.write('.')
+        f.seek(0)
+        watch = len(f.read())
+    if watch > 2:
+        sys.exit(1)
+    for i in range(watch):
+        print(json.dumps({'type': 'ADDED', 'object': {
+            'metadata': {'name': 'web-%d.1' % i, 'namespace': 'production', 'uid': str(i),
+                         'resourceVersion': '1'},
+            'type': 'Normal', 'count': 1, 'reason': 'Started', 'message': 'started',
+            'firstTimestamp': '2017-04-23T00:00:00Z', 'lastTimestamp': '2017-04-23T00:00:00Z',
+            'source': {'host': 'node-1'}}}, indent=4))
+elif args[0] == 'get':
+    print(json.dumps({'items': [{
+        'metadata': {'name': 'web-%d' % i, 'namespace': 'production'},
+        'spec': {'nodeName': 'node-1', 'containers': [{'name': 'app', 'image': 'app:1'}]},
+        'status': {'phase': 'Running', 'containerStatuses': [
+            {'name': 'app', 'ready': True, 'restartCount': 0,
+             'state': {'running': {'startedAt': '2017-04-23T00:00:00Z'}}}]},
+    } for i in range(3)]}))
+elif args[0] == 'logs' and '-f' in args:
+    # follows until stopped, with a child of its own (both noted for the tests to look for)
+    sleeper = subprocess.Popen(['sleep', '30'])
+    with open(os.path.join(os.path.dirname(pods), 'followers'), 'a') as f:
+        f.write('%d %d\\n' % (os.getpid(), sleeper.pid))
+    sleeper.wait()
+elif args[0] == 'logs':
+    print('one ' + args[-1])
+    print('two ' + args[-1])
+elif args[0] == 'exec':
+    sep = args.index('--')
+    sys.exit(subprocess.call(args[sep + 1:], cwd=in_pod(args[sep - 1])))
+elif args[0] == 'cp':
+    source, dest = [a for a in args[1:] if a != '-c'][-2:]
+    pod, path = source.split('/', 1)[1].split(':', 1)
+    path = os.path.join(in_pod(pod), path.lstrip('/'))
+    (shutil.copytree if os.path.isdir(path) else shutil.copy)(path, dest)
+'''
+
+
+# responds to each request as FAKE_ATTEMPTS says for that attempt (the last one repeating): "ok",
+# "fail" or "hang" (for FAKE_HANG seconds)
+FLAKY_KUBECTL = '''
+import os, sys, time
+attempts = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'attempts')
+with open(attempts, 'a+') as f:
+    f.write('.')
+    f.seek(0)
+    attempt = len(f.read()) - 1
+responses = os.environ['FAKE_ATTEMPTS'].split()
+response = responses[min(attempt, len(responses) - 1)]
+if response == 'hang':
+    time.sleep(float(os.environ.get('FAKE_HANG', 30)))
+elif response == 'fail':
+    sys.stderr.write('error: the server is currently unable to handle the request\\n')
+    sys.exit(1)
+print('{"attempt": %d}' % attempt)
+'''
+
+
+def _running(pid):
+    '''Whether a process exists and has not exited (some are only reaped by init eventually).'''
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except IOError:
+        return True
+
+
+def _fake_kubectl(tmpdir, monkeypatch, script=FAKE_KUBECTL):
+    '''Put the fake kubectl first in the PATH and return the directory of its pods.'''
+    kubectl = tmpdir.join('kubectl')
+    kubectl.write('#!{0}\n'.format(sys.executable) + script)
+    kubectl.chmod(0o755)
+    monkeypatch.setenv('PATH', str(tmpdir), prepend=os.pathsep)
+    return tmpdir.join('pods')
+
+
+@pytest.mark.skipif(sys.version_info < (3, 6), reason='asyncio API requires Python 3.6')
+class TestAsyncKubey(object):
+
+    @pytest.fixture
+    def kubey(self, tmpdir, monkeypatch):
+        from kubey.aio import AsyncKubey
+        _fake_kubectl(tmpdir, monkeypatch)
+        kubey = AsyncKubey(context='test')
+        kubey.kubectl.executions = []
+        return kubey
+
+    @staticmethod
+    def _collect(generator, loop):
+        items = []
+        while True:
+            try:
+                items.append(loop.run_until_complete(generator.__anext__()))
+            except StopAsyncIteration:  # noqa: F821 (only run by Python 3)
+                return items
+
+    @pytest.fixture
+    def asyncio(self):
+        import asyncio  # not importable by every Python tested
+        return asyncio
+
+    @pytest.fixture
+    def loop(self, asyncio):
+        loop = asyncio.new_event_loop()
+        yield loop
+        loop.close()
+
+    def test_concurrent_selections_share_one_query(self, kubey, loop, asyncio):
+        selections = [loop.create_task(kubey.pods(m)) for m in ('web', 'web-1', 'web-2$')]
+        loop.run_until_complete(asyncio.wait(selections))
+        assert [[p.name for p in s.result()] for s in selections] == \
+            [['web-0', 'web-1', 'web-2'], ['web-1'], ['web-2']]
+        assert len(kubey.kubectl.executions) == 1
+
+    def test_logs_and_exec_fan_out(self, kubey, loop):
+        lines = [(p.name, line.strip())
+                 for p, _c, line in self._collect(kubey.logs('web-[01]'), loop)]
+        assert sorted(lines) == [('web-0', 'one web-0'), ('web-0', 'two web-0'),
+                                 ('web-1', 'one web-1'), ('web-1', 'two web-1')]
+        results = self._collect(kubey.exec('web', 'cat', stdin=b'x', concurrency=2), loop)
+        assert sorted((r.target, r.exit_code, r.stdout) for r in results) == [
+            ('production/web-%d/app' % i, 0, b'x') for i in range(3)]
+
+    def test_timed_out_exec_is_recorded_without_exit_code(self, kubey, loop):
+        results = self._collect(kubey.exec('web-0', 'sleep', '1', timeout=0.2), loop)
+        assert [(r.target, r.exit_code) for r in results] == [('production/web-0/app', None)]
+        execution = kubey.kubectl.executions[-1]
+        assert execution.exit_code is None and execution.end_time is not None
+
+    def test_events_are_watched_again_without_repeats(self, kubey, loop):
+        events = kubey.events('web')
+        names = [loop.run_until_complete(events.__anext__()).name for _ in range(2)]
+        with pytest.raises(subprocess.CalledProcessError):
+            loop.run_until_complete(events.__anext__())
+        assert names == ['web-0.1', 'web-1.1']
+        assert [e.exit_code for e in kubey.kubectl.executions] == [0, 0, 1]
+
+
+class TestCopy(object):
+
+    @pytest.fixture
+    def pods(self, tmpdir, monkeypatch):
+        monkeypatch.setenv('KUBEY_CACHE_DIR', str(tmpdir.mkdir('cache')))
+        return _fake_kubectl(tmpdir, monkeypatch)
+
+    @staticmethod
+    def _kubey(*args):
+        return CliRunner().invoke(cli.cli, ['-c', 'test', '-n', '.', 'web'] + list(args),
+                                  catch_exceptions=False)
+
+    def test_push_creates_remote_directory_and_counts_only_successful_copies(
+            self, pods, tmpdir, monkeypatch):
+        local = tmpdir.mkdir('local').join('app.conf')
+        local.write('x' * 1000)
+        monkeypatch.setenv('FAKE_FAIL', 'web-2')
+        result = self._kubey('push', '-j', '2', str(local), 'etc/app/')
+        assert result.exit_code == 1
+        for pod in ('web-0', 'web-1'):
+            assert pods.join(pod, 'etc', 'app', 'app.conf').read() == 'x' * 1000
+        assert not pods.join('web-2', 'etc').check()
+        assert 'to 2 containers' in result.output
+
+    def test_pull_keeps_copies_apart(self, pods, tmpdir):
+        for i in range(3):
+            pods.join('web-%d' % i, 'out.log').write('web-%d' % i, ensure=True)
+        result = self._kubey('pull', 'out.log', str(tmpdir.join('logs')))
+        assert result.exit_code == 0
+        for i in range(3):
+            assert tmpdir.join('logs', 'production', 'web-%d' % i, 'app', 'out.log').read() == \
+                'web-%d' % i
+        assert 'pulled 15 B from 3 containers' in result.output
+
+
+class TestUnits(object):
+
+    def test_bytes_and_rates_in_words(self):
+        assert units.bytes_in_words(1023) == '1023 B'
+        assert units.bytes_in_words(1536) == '1.5 KiB'
+        assert units.bytes_in_words(3 * 2 ** 40) == '3.0 TiB'
+        assert units.bytes_in_words(2 ** 60) == '1048576.0 TiB'
+        assert units.rate_in_words(10 * 2 ** 20, 4) == '2.5 MiB/s'
+        assert units.rate_in_words(100, 0) == '0 B/s'
+
+    def test_quantities(self):
+        assert units.cpu_cores('250m') == 0.25
+        assert units.cpu_cores('2') == 2.0
+        assert units.cpu_cores('1500000n') == 0.0015
+        assert units.quantity_bytes('128Mi') == 128 * 2 ** 20
+        assert units.quantity_bytes('1e3') == 1000
+        assert units.quantity_bytes('1.5G') == 1500000000
+        for unknown in ('<unknown>', '', None, '5Xi'):
+            assert units.cpu_cores(unknown) is None and units.quantity_bytes(unknown) is None
+        assert (units.percent('12%'), units.percent('<unknown>')) == (12, None)
+        assert (units.percent_of(1, 3), units.percent_of(1, 0), units.percent_of(None, 3)) == \
+            (33, None, None)
+        assert units.cpu_in_words(0.125) == '125m'
+
+
+class TestReport(object):
+
+    def test_execution_records_outcome(self):
+        execution = Execution(None, 'production/web-0/app', ['kubectl', 'exec', 1])
+        assert (execution.duration, execution.command) == (None, 'kubectl exec 1')
+        execution.finish(0, 10)
+        assert execution.duration >= 0 and not execution.failed
+        execution.finish(None)  # e.g. killed and never reaped
+        record = execution.as_dict()
+        assert execution.failed
+        assert (record['exit_code'], record['stdout_bytes'], record['stderr_bytes']) == \
+            (None, 10, None)
+
+    def test_async_output_proxied_unmodified_and_counted(self, capfdbinary):
+        kubectl = KubeCtl('ctx')
+        kubectl.record_executions()
+        cl = ['sh', '-c', r'printf "\377a\nb"; printf "\376\n" >&2']
+        kubectl._spawn(BackgroundPopen, cl, BackgroundPopen.raw_handler(sys.stdout),
+                       BackgroundPopen.raw_handler(sys.stderr), raw=True, target='t')
+        assert kubectl.wait() == 0
+        assert capfdbinary.readouterr() == (b'\xffa\nb', b'\xfe\n')
+        execution = kubectl.executions[0]
+        assert (execution.target, execution.stdout_bytes, execution.stderr_bytes) == ('t', 4, 2)
+
+    def test_killed_children_are_reported(self):
+        kubectl = KubeCtl('ctx')
+        kubectl.record_executions()
+        kubectl._spawn(subprocess.Popen, ['sleep', '30'])
+        kubectl.kill(signal.SIGTERM)
+        assert [e.exit_code for e in kubectl.executions] == [-signal.SIGTERM]
+
+    def test_report_written_with_failures_first(self, tmpdir, capsys):
+        kubectl = KubeCtl('ctx')
+        kubectl.record_executions()
+        for rc in (0, 3):
+            kubectl._spawn(subprocess.Popen, ['sh', '-c', 'exit %d' % rc], target='rc-%d' % rc)
+        kubectl.wait()
+        obj = OpenStruct(kubey=OpenStruct(kubectl=kubectl), no_headers=False,
+                         table_format='plain')
+        report = tmpdir.join('report.json')
+        cli._write_report(obj, report.open('w'), True)
+        assert [(r['target'], r['exit_code']) for r in json.loads(report.read())] == \
+            [('rc-0', 0), ('rc-3', 3)]
+        summary = capsys.readouterr().err.splitlines()
+        assert summary[1].split()[:2] == ['rc-3', '3']
+        assert summary[-1] == '2 processes, 1 failed'
+
+
+class TestRequests(object):
+
+    @pytest.fixture
+    def flaky(self, tmpdir, monkeypatch):
+        _fake_kubectl(tmpdir, monkeypatch, FLAKY_KUBECTL)
+        monkeypatch.setattr(KubeCtl, 'BACKOFF_SECONDS', 0.01)
+        return lambda *attempts: monkeypatch.setenv('FAKE_ATTEMPTS', ' '.join(attempts))
+
+    def test_idempotent_requests_retried(self, flaky):
+        flaky('fail', 'fail', 'ok')
+        assert KubeCtl('test', retries=2).call_json('get', 'pods') == {'attempt': 2}
+
+    def test_retries_give_up_and_other_requests_are_not_retried(self, flaky):
+        flaky('fail', 'ok')
+        with pytest.raises(subprocess.CalledProcessError):
+            KubeCtl('test', retries=0).call_json('get', 'pods')
+        flaky('fail')
+        with pytest.raises(subprocess.CalledProcessError):
+            KubeCtl('test', retries=3).call_capture('exec', 'web-0', '--', 'true')
+        flaky('ok')
+        assert KubeCtl('test').call_json('get', 'pods') == {'attempt': 2}  # one each before
+
+    def test_backoff_is_jittered_exponential_and_capped(self):
+        kubectl = KubeCtl('test')
+        for attempt in range(8):
+            cap = min(KubeCtl.BACKOFF_MAX_SECONDS, KubeCtl.BACKOFF_SECONDS * 2 ** attempt)
+            delays = [kubectl._backoff(attempt) for _ in range(50)]
+            assert all(0 <= d <= cap for d in delays)
+            assert len(set(delays)) > 1
+        assert cap == KubeCtl.BACKOFF_MAX_SECONDS
+
+    def test_hung_request_killed_after_timeout_then_retried(self, flaky):
+        flaky('hang', 'ok')
+        started = time.time()
+        assert KubeCtl('test', timeout=0.5, retries=1).call_json('get', 'pods') == \
+            {'attempt': 1}
+        assert time.time() - started < 5
+
+    def test_slow_request_hedged(self, flaky, monkeypatch):
+        flaky('hang', 'ok')
+        monkeypatch.setenv('FAKE_HANG', '3')
+        kubectl = KubeCtl('test', hedge_after=0.2)
+        kubectl.record_executions()
+        started = time.time()
+        assert kubectl.call_json('get', 'pods') == {'attempt': 1}
+        assert time.time() - started < 2
+        assert len(kubectl.executions) == 2
+
+    def test_wait_kills_children_past_timeout(self):
+        kubectl = KubeCtl('ctx')
+        kubectl._spawn(subprocess.Popen, ['true'])
+        kubectl._spawn(subprocess.Popen, ['sleep', '30'])
+        started = time.time()
+        assert kubectl.wait(0.2) == -signal.SIGKILL
+        assert time.time() - started < 5
+        assert kubectl.failures == 1
+
+
+class TestKubeCtlChildren(object):
+
+    def test_throttle_bounds_running_children(self):
+        kubectl = KubeCtl('ctx')
+        started = time.time()
+        for _ in range(6):
+            kubectl.throttle(2)
+            assert len(kubectl._processes) < 2
+            kubectl._spawn(subprocess.Popen, ['sleep', '0.2'])
+        assert kubectl.wait() == 0
+        assert time.time() - started >= 0.6  # in three rounds of two
+
+    def test_waves_run_one_after_another(self, monkeypatch):
+        monkeypatch.setattr(cli, '_logger', logging.getLogger(cli.__name__))
+        kubectl = KubeCtl('ctx')
+        targets = [('pod-%d' % i, 'app') for i in range(5)]
+        running = []
+
+        def run(pod, container):
+            running.append(len(kubectl._processes))  # none left of an earlier wave
+            kubectl._spawn(subprocess.Popen, ['sleep', '0.1'])
+
+        cli._run_waves(kubectl, targets, run, 2)
+        assert running == [0, 1, 0, 1, 0]
+        assert kubectl._processes == []
+
+    def test_waves_stop_once_failures_exceed_budget(self, monkeypatch):
+        monkeypatch.setattr(cli, '_logger', logging.getLogger(cli.__name__))
+        kubectl = KubeCtl('ctx')
+        targets = [('pod-%d' % i, 'app') for i in range(6)]
+        ran = []
+
+        def run(pod, container):
+            ran.append(pod)
+            kubectl._spawn(subprocess.Popen, ['sh', '-c', 'exit 1' if pod != 'pod-0' else 'true'])
+
+        cli._run_waves(kubectl, targets, run, 2, max_failures=1)
+        # one failure is within budget but the second wave exceeds it
+        assert ran == ['pod-0', 'pod-1', 'pod-2', 'pod-3']
+        assert kubectl.failures == 3
+
+    def test_kill_signals_all_at_once_and_escalates(self):
+        kubectl = KubeCtl('ctx')
+        for _ in range(20):
+            kubectl._spawn(subprocess.Popen, ['sleep', '30'])
+        stubborn = kubectl._spawn(subprocess.Popen, ['sh', '-c', 'trap "" INT; echo; sleep 30'],
+                                  stdout=subprocess.PIPE)
+        stubborn.stdout.readline()  # trapped
+        started = time.time()
+        kubectl.kill(signal.SIGINT, deadline=0.5)
+        assert time.time() - started < 5
+        assert stubborn.returncode == -signal.SIGKILL
+        assert kubectl._processes == []
+
+    @pytest.mark.skipif(not hasattr(os, 'killpg'), reason='requires process groups')
+    def test_terminal_hangup_leaves_no_children(self, tmpdir, monkeypatch):
+        import pty
+        _fake_kubectl(tmpdir, monkeypatch)
+        monkeypatch.setenv('KUBEY_CACHE_DIR', str(tmpdir.mkdir('cache')))
+        monkeypatch.setenv('PYTHONPATH', os.path.dirname(os.path.dirname(kubectl.__file__)))
+        followers = tmpdir.join('followers')
+        pid, terminal = pty.fork()
+        if pid == 0:  # leads a new session, with the terminal as its controlling one
+            os.execv(sys.executable, [sys.executable, '-m', 'kubey.cli', '-c', 'test', '-n', '.',
+                                      'web', 'tail', '-f'])
+        pids = []
+        try:
+            expires = time.time() + 10
+            while len(pids) < 6 and time.time() < expires:
+                time.sleep(0.1)
+                text = followers.read() if followers.check() else ''
+                pids = [int(p) for p in text.split()] if text.endswith('\n') else []
+            assert len(pids) == 6  # three followers, each with a child
+            os.close(terminal)  # hangs up
+            expires = time.time() + 10
+            while any(_running(p) for p in pids) and time.time() < expires:
+                time.sleep(0.1)
+            assert [p for p in pids if _running(p)] == []
+        finally:
+            for p in [pid] + pids:
+                if _running(p):
+                    os.kill(p, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+    def test_output_written_to_files_as_is(self, tmpdir):
+        kubectl = KubeCtl('ctx')
+        kubectl.record_executions()
+        out, err = str(tmpdir.join('out')), str(tmpdir.join('err'))
+        kubectl._spawn(FilePopen, ['sh', '-c', r'printf "\377\000\r\n"; echo no >&2'], out, err)
+        assert kubectl.wait() == 0
+        assert io.open(out, 'rb').read() == b'\xff\x00\r\n'
+        assert io.open(err, 'rb').read() == b'no\n'
+        execution = kubectl.executions[0]
+        assert (execution.stdout_bytes, execution.stderr_bytes) == (4, 3)
+
+    def test_finished_children_are_reaped_while_spawning(self):
+        kubectl = KubeCtl('ctx')
+        for _ in range(KubeCtl.REAP_AFTER * 4):
+            kubectl._spawn(subprocess.Popen, ['true'])
+        assert len(kubectl._processes) < KubeCtl.REAP_AFTER * 4
+        assert kubectl.wait() == 0